@@ -1,3 +1,7 @@
+import base64
+import threading
+from collections import deque
+import x25519
 
 # WireGuard Configuration Settings
 
@@ -19,29 +23,117 @@ CLIENT_IPV4_ADDITIONAL_PREFIX = "10.202.10.10"  # Prefix for additional IPv4 add
 # Security settings
 ALLOWED_IPS = ["0.0.0.0/3", "::/3"]  # Allowed IPs for traffic routing
 
+# Keys generated ahead, so the shared work of a batch is paid once per batch
+KEY_BATCH_SIZE = 64
+_key_buffer = deque()
+_key_lock = threading.Lock()
+
 # Generate WireGuard keys
+def generate_wireguard_keypairs(count):
+    """
+    Generate WireGuard keypairs in-process, like wg genkey | wg pubkey.
+
+    Returns:
+        list: (private_key, public_key) tuples, base64 encoded
+    """
+    return [(base64.b64encode(private).decode('ascii'), base64.b64encode(public).decode('ascii'))
+            for private, public in x25519.generate_keypairs(count)]
+
 def generate_wireguard_keys():
     """
-    Generate WireGuard private and public keys.
-    In a real implementation, you should use the wg command or a proper WireGuard library.
+    Generate a WireGuard private key and the public key derived from it.
+
+    Returns:
+        tuple: (private_key, public_key), base64 encoded
     """
-    import base64
-    import os
-    import subprocess
-    
-    try:
-        # Try to use actual WireGuard tools if available
-        private_key = subprocess.check_output(['wg', 'genkey']).decode('utf-8').strip()
-        public_key = subprocess.check_output(['echo', private_key, '|', 'wg', 'pubkey']).decode('utf-8').strip()
-        return private_key, public_key
-    except (subprocess.SubprocessError, FileNotFoundError):
-        # Fallback to simplified version
-        private_key = base64.b64encode(os.urandom(32)).decode('utf-8')
-        # This is a simplified version for demonstration
-        # In production, you should derive the public key from the private key using WireGuard's algorithms
-        public_key = base64.b64encode(os.urandom(32)).decode('utf-8')
-        
-        return private_key, public_key
+    with _key_lock:
+        if not _key_buffer:
+            _key_buffer.extend(generate_wireguard_keypairs(KEY_BATCH_SIZE))
+        return _key_buffer.popleft()
+
+def derive_public_key(private_key):
+    """Return the base64 public key of a base64 private key."""
+    return base64.b64encode(x25519.public_key(base64.b64decode(private_key))).decode('ascii')
+
+# Rendering templates per location, rebuilt when the location's settings change
+_templates = {}
+_templates_lock = threading.Lock()
+
+def wireguard_settings(overrides=None):
+    """
+    Effective WireGuard settings: the module defaults with a location's
+    overrides (keys mtu, port, keepalive, allowed_ips) applied.
+
+    Returns:
+        tuple: (mtu, port, keepalive, allowed_ips)
+    """
+    overrides = overrides or {}
+    return (
+        int(overrides.get('mtu', DEFAULT_WG_MTU)),
+        int(overrides.get('port', DEFAULT_WG_PORT)),
+        int(overrides.get('keepalive', PERSISTENT_KEEPALIVE)),
+        tuple(overrides.get('allowed_ips', ALLOWED_IPS))
+    )
+
+def _compile_template(settings):
+    mtu, port, keepalive, allowed_ips = settings
+
+    def fixed(value):
+        return str(value).replace('{', '{{').replace('}', '}}')
+
+    # Only the per-client fields are left as placeholders
+    return (
+        "[Interface]\n"
+        "PrivateKey = {private_key}\n"
+        "Address = {client_ipv4}, {client_ipv4_add}, {client_ipv6}\n"
+        "DNS = {dns_list}\n"
+        f"MTU = {fixed(mtu)}\n"
+        "\n"
+        "[Peer]\n"
+        "PublicKey = {public_key}\n"
+        f"AllowedIPs = {fixed(', '.join(allowed_ips))}\n"
+        f"Endpoint = {{endpoint}}:{fixed(port)}\n"
+        f"PersistentKeepalive = {fixed(keepalive)}\n"
+    )
+
+def get_template(location=None, overrides=None):
+    """
+    Return the cached template of a location.
+
+    The cache is checked against the current settings on every call, so a
+    change to the module settings or the location's overrides takes effect
+    on the next render.
+    """
+    settings = wireguard_settings(overrides)
+    with _templates_lock:
+        cached = _templates.get(location)
+        if cached is None or cached[0] != settings:
+            cached = _templates[location] = (settings, _compile_template(settings))
+        return cached[1]
+
+def invalidate_templates(location=None):
+    """Drop the cached template of one location, or of all of them."""
+    with _templates_lock:
+        if location is None:
+            _templates.clear()
+        else:
+            _templates.pop(location, None)
+
+def render_wireguard_configs(clients, location=None, overrides=None):
+    """
+    Render a batch of configs from one template.
+
+    Args:
+        clients: Dicts with the create_wireguard_config() arguments
+        location: Location ID the template is cached under
+        overrides: The location's WireGuard setting overrides
+
+    Returns:
+        list: Config texts, in the order of clients
+    """
+    render = get_template(location, overrides).format
+    # WireGuard expects comma-separated DNS servers without spaces
+    return [render(dns_list=",".join(client['dns_servers']), **client) for client in clients]
 
 # Generate WireGuard config
 def create_wireguard_config(private_key, public_key, endpoint, client_ipv4, client_ipv4_add, client_ipv6, dns_servers):
@@ -60,21 +152,12 @@ def create_wireguard_config(private_key, public_key, endpoint, client_ipv4, clie
     Returns:
         str: WireGuard configuration content
     """
-    # WireGuard expects comma-separated DNS servers without spaces
-    dns_list = ",".join(dns_servers)
-    allowed_ips = ", ".join(ALLOWED_IPS)
-    
-    config = f"""[Interface]
-PrivateKey = {private_key}
-Address = {client_ipv4}, {client_ipv4_add}, {client_ipv6}
-DNS = {dns_list}
-MTU = {DEFAULT_WG_MTU}
-
-[Peer]
-PublicKey = {public_key}
-AllowedIPs = {allowed_ips}
-Endpoint = {endpoint}:{DEFAULT_WG_PORT}
-PersistentKeepalive = {PERSISTENT_KEEPALIVE}
-"""
-    
-    return config
+    return render_wireguard_configs([{
+        'private_key': private_key,
+        'public_key': public_key,
+        'endpoint': endpoint,
+        'client_ipv4': client_ipv4,
+        'client_ipv4_add': client_ipv4_add,
+        'client_ipv6': client_ipv6,
+        'dns_servers': dns_servers
+    }])[0]
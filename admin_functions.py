@@ -1,5 +1,4 @@
 import os
-import pickle
 import logging
 import datetime
 import random
@@ -10,20 +9,11 @@ from datetime import datetime, timedelta
 import pandas as pd
 import io
 
-# Load data function
-def load_data(DATA_FILE='bot_data.pkl'):
-    try:
-        with open(DATA_FILE, 'rb') as f:
-            return pickle.load(f)
-    except (FileNotFoundError, EOFError):
-        logger = logging.getLogger(__name__)
-        logger.error("Failed to load data file")
-        return None
-
-# Save data function
-def save_data(data, DATA_FILE='bot_data.pkl'):
-    with open(DATA_FILE, 'wb') as f:
-        pickle.dump(data, f)
+from storage import get_store
+import repository
+import ledger
+from repository import load_data
+from range_stats import get_dns_ranges_summary
 
 # Enhanced admin keyboard with more options
 def get_enhanced_admin_keyboard():
@@ -85,17 +75,18 @@ def get_main_buttons_management_keyboard():
 
     if 'main_buttons' not in data.get('settings', {}):
         # Initialize default button settings if they don't exist
-        data['settings']['main_buttons'] = {
-            'buy_dns': {'title': '🌐 خرید DNS اختصاصی', 'enabled': True},
-            'buy_vpn': {'title': '🔒 خرید کانفیگ اختصاصی', 'enabled': True},
-            'account': {'title': '💼 حساب کاربری', 'enabled': True},
-            'referral': {'title': '👥 دعوت از دوستان', 'enabled': True},
-            'support': {'title': '💬 پشتیبانی', 'enabled': True},
-            'add_balance': {'title': '💰 افزایش موجودی', 'enabled': True},
-            'tutorials': {'title': '📚 آموزش‌ها', 'enabled': True},
-            'rules': {'title': '📜 قوانین و مقررات', 'enabled': True}
-        }
-        save_data(data)
+        with repository.transaction() as draft:
+            draft.setdefault('settings', {})['main_buttons'] = {
+                'buy_dns': {'title': '🌐 خرید DNS اختصاصی', 'enabled': True},
+                'buy_vpn': {'title': '🔒 خرید کانفیگ اختصاصی', 'enabled': True},
+                'account': {'title': '💼 حساب کاربری', 'enabled': True},
+                'referral': {'title': '👥 دعوت از دوستان', 'enabled': True},
+                'support': {'title': '💬 پشتیبانی', 'enabled': True},
+                'add_balance': {'title': '💰 افزایش موجودی', 'enabled': True},
+                'tutorials': {'title': '📚 آموزش‌ها', 'enabled': True},
+                'rules': {'title': '📜 قوانین و مقررات', 'enabled': True}
+            }
+        data = load_data()
 
     # Create buttons for each main menu item
     for button_id, button_info in data['settings']['main_buttons'].items():
@@ -133,20 +124,17 @@ def get_tutorial_buttons_management_keyboard():
 
 # Toggle button visibility function
 def toggle_button_visibility(button_type, button_id):
-    data = load_data()
-
-    if button_type == 'main':
-        if button_id in data['settings']['main_buttons']:
-            current_state = data['settings']['main_buttons'][button_id].get('enabled', True)
-            data['settings']['main_buttons'][button_id]['enabled'] = not current_state
-            save_data(data)
-            return True
-    elif button_type == 'tutorial':
-        if button_id in data['tutorials']:
-            current_state = data['tutorials'][button_id].get('enabled', True)
-            data['tutorials'][button_id]['enabled'] = not current_state
-            save_data(data)
-            return True
+    with repository.transaction() as data:
+        if button_type == 'main':
+            if button_id in data['settings']['main_buttons']:
+                current_state = data['settings']['main_buttons'][button_id].get('enabled', True)
+                data['settings']['main_buttons'][button_id]['enabled'] = not current_state
+                return True
+        elif button_type == 'tutorial':
+            if button_id in data['tutorials']:
+                current_state = data['tutorials'][button_id].get('enabled', True)
+                data['tutorials'][button_id]['enabled'] = not current_state
+                return True
 
     return False
 
@@ -196,12 +184,13 @@ def get_advanced_server_management_keyboard():
     btn5 = types.InlineKeyboardButton("💰 قیمت سرورها", callback_data="server_pricing")
     btn6 = types.InlineKeyboardButton("🌐 مدیریت لوکیشن‌ها", callback_data="manage_locations")
     btn7 = types.InlineKeyboardButton("🚦 وضعیت فعال/غیرفعال", callback_data="toggle_server_status")
+    btn_ranges = types.InlineKeyboardButton("📊 رنج‌های DNS", callback_data="admin_dns_ranges")
     btn8 = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
 
     markup.add(btn1, btn2)
     markup.add(btn3, btn4)
     markup.add(btn5, btn6)
-    markup.add(btn7)
+    markup.add(btn7, btn_ranges)
     markup.add(btn8)
 
     return markup
@@ -219,49 +208,51 @@ def handle_payment_approval(bot, request_id, approved=True):
     Returns:
         bool: Success status
     """
-    data = load_data(force_reload=True)  # مطمئن شویم آخرین داده‌ها را داریم
+    payment_request = repository.get_payment_request(request_id)
     
-    if 'payment_requests' not in data or request_id not in data['payment_requests']:
+    if payment_request is None:
         logging.error(f"Payment request {request_id} not found in database")
         return False
         
-    payment_request = data['payment_requests'][request_id]
     user_id = payment_request['user_id']
     amount = payment_request['amount']
-    transaction_id = payment_request.get('transaction_id')
+    transaction_id = payment_request.get('transaction_id') or request_id
     
     # برای اطمینان از تبدیل صحیح
     user_id_str = str(user_id)
     amount_int = int(amount)
     
+    # A request that was already decided the other way cannot be flipped
+    status = payment_request.get('status')
+    if status == ('rejected' if approved else 'approved'):
+        logging.warning(f"Payment request {request_id} is already {status}")
+        return False
+    
     if approved:
-        # بررسی وجود کاربر
-        if user_id_str not in data['users']:
-            logging.error(f"User {user_id_str} not found in database when approving payment")
-            return False
-            
         try:
-            # Update payment request status
-            data['payment_requests'][request_id]['status'] = 'approved'
-            
-            # Update user balance with explicit conversion
-            current_balance = int(data['users'][user_id_str].get('balance', 0))
-            new_balance = current_balance + amount_int
+            # Credit the balance and mark the transaction approved in one step;
+            # approving the same request twice is a no-op
+            result = ledger.credit(
+                user_id_str, amount_int, 'deposit',
+                transaction_id=transaction_id,
+                status='approved'
+            )
+            if not result.ok:
+                logging.error(f"User {user_id_str} not found in database when approving payment")
+                return False
             
-            # برای اطمینان، موجودی جدید را چاپ می‌کنیم
-            logging.info(f"Current balance: {current_balance}, Amount to add: {amount_int}, New balance: {new_balance}")
+            # Update payment request status
+            repository.add_payment_request(request_id, dict(payment_request, status='approved'))
             
-            data['users'][user_id_str]['balance'] = new_balance
+            # Only tell the user once the credit is on disk
+            get_store().flush().result(timeout=10)
             
-            # Update transaction if exists
-            if transaction_id and transaction_id in data.get('transactions', {}):
-                data['transactions'][transaction_id]['status'] = 'approved'
-                
-            # Save data after updating balance
-            save_data(data)
+            if result.duplicate:
+                logging.info(f"Payment request {request_id} was already credited")
+                return True
             
             # Log the successful update
-            logging.info(f"Successfully updated balance for user {user_id_str}: +{amount_int}, new total: {data['users'][user_id_str]['balance']}")
+            logging.info(f"Successfully updated balance for user {user_id_str}: +{amount_int}, new total: {result.balance}")
                 
             # Notify user
             try:
@@ -269,7 +260,7 @@ def handle_payment_approval(bot, request_id, approved=True):
                     user_id,
                     f"✅ درخواست افزایش موجودی شما به مبلغ {amount_int} تومان تایید شد.\n"
                     f"💰 مبلغ به حساب شما اضافه شد.\n"
-                    f"💰 موجودی فعلی: {new_balance} تومان\n"
+                    f"💰 موجودی فعلی: {result.balance} تومان\n"
                     f"🆔 شناسه پیگیری: {request_id}"
                 )
             except Exception as e:
@@ -279,15 +270,12 @@ def handle_payment_approval(bot, request_id, approved=True):
             return False
     else:
         try:
-            # Update payment request status
-            data['payment_requests'][request_id]['status'] = 'rejected'
-            
-            # Update transaction if exists
-            if transaction_id and transaction_id in data.get('transactions', {}):
-                data['transactions'][transaction_id]['status'] = 'rejected'
-                
-            # Save data
-            save_data(data)
+            # Update payment request and transaction status together
+            rows = [('payment_requests', request_id, dict(payment_request, status='rejected'))]
+            transaction = repository.get_transaction(transaction_id)
+            if transaction:
+                rows.append(('transactions', transaction_id, dict(transaction, status='rejected')))
+            repository.put_rows(rows)
             
             # Notify user
             try:
@@ -303,8 +291,6 @@ def handle_payment_approval(bot, request_id, approved=True):
             logging.error(f"Error during payment rejection: {e}")
             return False
     
-    # برای اطمینان مجدداً ذخیره می‌کنیم
-    save_data(data)
     return True
 
 # Ticket management system
@@ -468,60 +454,92 @@ def process_add_new_server(bot, admin_states, user_id, message_text):
         return False
 
     # Add the server to the data
-    data = load_data()
+    with repository.transaction() as data:
+        # For a location
+        if admin_states[user_id].get('server_type') == 'location':
+            location_id = server_info['location'].lower().replace(' ', '_')
+            data['locations'][location_id] = {
+                'name': server_info['name'],
+                'price': int(server_info['price']),
+                'enabled': True
+            }
 
-    # For a location
     if admin_states[user_id].get('server_type') == 'location':
-        location_id = server_info['location'].lower().replace(' ', '_')
-        data['locations'][location_id] = {
-            'name': server_info['name'],
-            'price': int(server_info['price']),
-            'enabled': True
-        }
-
+        from main import location_changed
+        location_changed(location_id)
 
-
-    save_data(data)
     return True
 
+# Transactions shown per history page
+HISTORY_PAGE_SIZE = 10
+
 # Get user purchase history
-def get_user_purchase_history(user_id):
-    data = load_data()
+def get_user_purchase_history(user_id, page=0):
+    user = repository.get_user(user_id)
 
-    if str(user_id) not in data['users']:
+    if not user:
         return "❌ کاربری با این شناسه یافت نشد!"
 
-    user = data['users'][str(user_id)]
     history_text = f"📜 تاریخچه خرید کاربر {user_id}:\n\n"
 
-    # Add DNS purchase history
-    if user['dns_configs']:
-        history_text += "🌐 DNS های خریداری شده:\n"
-        for i, dns in enumerate(user['dns_configs']):
-            history_text += f"{i+1}. {dns.get('location', 'نامشخص')} - {dns.get('created_at', 'نامشخص')}\n"
-    else:
-        history_text += "🌐 تاکنون DNS خریداری نشده است.\n"
+    # Configs are listed once, on the first page
+    if page == 0:
+        # Add DNS purchase history
+        if user['dns_configs']:
+            history_text += "🌐 DNS های خریداری شده:\n"
+            for i, dns in enumerate(user['dns_configs']):
+                history_text += f"{i+1}. {dns.get('location', 'نامشخص')} - {dns.get('created_at', 'نامشخص')}\n"
+        else:
+            history_text += "🌐 تاکنون DNS خریداری نشده است.\n"
+
+        # Add VPN purchase history
+        if user.get('wireguard_configs', []):
+            history_text += "\n🔒 VPN های خریداری شده:\n"
+            for i, vpn in enumerate(user.get('wireguard_configs', [])):
+                history_text += f"{i+1}. {vpn.get('location_name', 'نامشخص')} - {vpn.get('created_at', 'نامشخص')}\n"
+        else:
+            history_text += "\n🔒 تاکنون VPN خریداری نشده است.\n"
+
+    # Add transaction history, one page at a time from the per-user index
+    history_text += format_transactions_page(user_id, page)
 
-    # Add VPN purchase history
-    if user.get('wireguard_configs', []):
-        history_text += "\n🔒 VPN های خریداری شده:\n"
-        for i, vpn in enumerate(user.get('wireguard_configs', [])):
-            history_text += f"{i+1}. {vpn.get('location_name', 'نامشخص')} - {vpn.get('created_at', 'نامشخص')}\n"
-    else:
-        history_text += "\n🔒 تاکنون VPN خریداری نشده است.\n"
+    return history_text
 
-    # Add transaction history
-    transactions = [tx for tx_id, tx in data.get('transactions', {}).items() if tx.get('user_id') == int(user_id)]
+def format_transactions_page(user_id, page=0, page_size=HISTORY_PAGE_SIZE):
+    total = repository.count_user_transactions(user_id)
+    if not total:
+        return "\n💰 تاکنون تراکنشی انجام نشده است.\n"
+
+    pages = (total + page_size - 1) // page_size
+    transactions = repository.get_user_transactions(user_id, page_size, page * page_size)
+    text = f"\n💰 تراکنش‌ها (صفحه {page + 1} از {pages}):\n"
+    for i, (tx_id, tx) in enumerate(transactions, page * page_size + 1):
+        status = "✅" if tx.get('status') in ('approved', 'completed') else "❌" if tx.get('status') == 'rejected' else "⏳"
+        text += f"{i}. {status} {tx.get('amount', 0)} تومان - {tx.get('timestamp', 'نامشخص')}\n"
+    return text
+
+# Previous/next buttons for a paginated transaction history
+def get_history_pagination_keyboard(user_id, page, page_callback, back_callback, page_size=HISTORY_PAGE_SIZE):
+    """
+    Args:
+        user_id: User whose history is shown
+        page: Current page (0-based)
+        page_callback: Callback data template with a {} slot for the page number
+        back_callback: Callback data of the back button
+    """
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    pages = (repository.count_user_transactions(user_id) + page_size - 1) // page_size
 
-    if transactions:
-        history_text += "\n💰 تراکنش‌ها:\n"
-        for i, tx in enumerate(sorted(transactions, key=lambda x: x.get('timestamp', ''), reverse=True)):
-            status = "✅" if tx.get('status') == 'approved' else "❌" if tx.get('status') == 'rejected' else "⏳"
-            history_text += f"{i+1}. {status} {tx.get('amount', 0)} تومان - {tx.get('timestamp', 'نامشخص')}\n"
-    else:
-        history_text += "\n💰 تاکنون تراکنشی انجام نشده است.\n"
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(types.InlineKeyboardButton("⬅️ قبلی", callback_data=page_callback.format(page - 1)))
+    if page + 1 < pages:
+        nav_buttons.append(types.InlineKeyboardButton("بعدی ➡️", callback_data=page_callback.format(page + 1)))
+    if nav_buttons:
+        markup.add(*nav_buttons)
 
-    return history_text
+    markup.add(types.InlineKeyboardButton("🔙 بازگشت", callback_data=back_callback))
+    return markup
 
 # Send reminder to users with expiring services
 def send_expiry_reminders(bot):
@@ -575,9 +593,9 @@ def send_expiry_reminders(bot):
 
 def show_dns_ranges_admin(call):
     """Show DNS ranges statistics for admin"""
-    from main import load_dns_ranges, bot
+    from main import bot
 
-    dns_ranges = load_dns_ranges()
+    dns_ranges = repository.load_dns_ranges()
 
     keyboard = types.InlineKeyboardMarkup()
     for location in dns_ranges.keys():
@@ -598,9 +616,9 @@ def show_dns_ranges_admin(call):
 
 def show_dns_range_detail(call, location):
     """Show DNS range details for a specific location"""
-    from main import load_dns_ranges, bot, get_dns_ranges_summary
+    from main import bot
 
-    dns_ranges = load_dns_ranges()
+    dns_ranges = repository.load_dns_ranges()
     summary = get_dns_ranges_summary()
 
     if location not in dns_ranges:
@@ -615,7 +633,8 @@ def show_dns_range_detail(call, location):
     message = f"📍 آمار رنج‌های <b>{location.upper()}</b>:\n\n"
     message += f"🔹 تعداد رنج IPv4: {summary_data['ipv4_ranges']}\n"
     message += f"🔹 تعداد تقریبی IP های IPv4: {summary_data['estimated_ipv4_ips']:,}\n"
-    message += f"🔹 تعداد پرفیکس IPv6: {summary_data['ipv6_ranges']}\n\n"
+    message += f"🔹 تعداد پرفیکس IPv6: {summary_data['ipv6_ranges']}\n"
+    message += f"🔹 پوشش IPv6 (تعداد /64): {summary_data['ipv6_slash64s']:,}\n\n"
 
     # Show sample ranges
     message += "📌 نمونه رنج‌های IPv4:\n"
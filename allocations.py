@@ -0,0 +1,387 @@
+import uuid
+import random
+import logging
+import ipaddress
+import threading
+from array import array
+from datetime import datetime
+from bisect import bisect_left
+from contextlib import contextmanager
+from storage import get_store
+import repository
+import ip_pool
+
+logger = logging.getLogger(__name__)
+
+# Random draws tried before falling back to picking among the free addresses
+MAX_DRAWS = 8
+
+# SortedBlocks typecode for 128-bit values (IPv6 addresses); see WideArray
+WIDE = 'W'
+
+_LOW_MASK = (1 << 64) - 1
+
+
+class WideArray:
+    """
+    Array of 128-bit unsigned integers, kept as two array('Q') of their
+    high and low halves: 16 bytes per value instead of a Python int each.
+
+    Supports what SortedBlocks needs: indexing, slicing, insert, del and
+    bisect.
+    """
+
+    __slots__ = ('_high', '_low')
+
+    def __init__(self, values=()):
+        self._high = array('Q')
+        self._low = array('Q')
+        for value in values:
+            self._high.append(value >> 64)
+            self._low.append(value & _LOW_MASK)
+
+    def __len__(self):
+        return len(self._low)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            part = WideArray()
+            part._high = self._high[index]
+            part._low = self._low[index]
+            return part
+        return (self._high[index] << 64) | self._low[index]
+
+    def __iter__(self):
+        for high, low in zip(self._high, self._low):
+            yield (high << 64) | low
+
+    def insert(self, index, value):
+        self._high.insert(index, value >> 64)
+        self._low.insert(index, value & _LOW_MASK)
+
+    def __delitem__(self, index):
+        del self._high[index]
+        del self._low[index]
+
+
+class SortedBlocks:
+    """
+    Sorted set of integers kept as a list of small sorted blocks.
+
+    A lookup, insert or delete bisects the block maxima and then one block
+    of at most 2 * BLOCK_SIZE entries, so it costs O(log n) plus a bounded
+    copy inside that block, instead of moving the whole array. Blocks are
+    array(typecode) when a typecode is given (e.g. 'I', 4 bytes per IPv4
+    address), a WideArray for WIDE and plain lists otherwise.
+    """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self, typecode=None, values=()):
+        """values must already be sorted."""
+        self._typecode = typecode
+        self._blocks = []
+        self._maxes = []
+        self._len = 0
+        values = list(values)
+        for start in range(0, len(values), self.BLOCK_SIZE):
+            self._blocks.append(self._block(values[start:start + self.BLOCK_SIZE]))
+            self._maxes.append(values[min(start + self.BLOCK_SIZE, len(values)) - 1])
+        self._len = len(values)
+
+    def _block(self, values):
+        if self._typecode == WIDE:
+            return WideArray(values)
+        return array(self._typecode, values) if self._typecode else list(values)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __contains__(self, value):
+        index = bisect_left(self._maxes, value)
+        if index == len(self._blocks):
+            return False
+        block = self._blocks[index]
+        position = bisect_left(block, value)
+        return position < len(block) and block[position] == value
+
+    def add(self, value):
+        """Insert value if absent; returns whether it was."""
+        if not self._blocks:
+            self._blocks.append(self._block([value]))
+            self._maxes.append(value)
+            self._len = 1
+            return True
+        index = min(bisect_left(self._maxes, value), len(self._blocks) - 1)
+        block = self._blocks[index]
+        position = bisect_left(block, value)
+        if position < len(block) and block[position] == value:
+            return False
+        block.insert(position, value)
+        self._maxes[index] = block[-1]
+        self._len += 1
+        if len(block) > 2 * self.BLOCK_SIZE:
+            self._blocks[index:index + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+            self._maxes[index:index + 1] = [block[self.BLOCK_SIZE - 1], block[-1]]
+        return True
+
+    def discard(self, value):
+        """Remove value if present; returns whether it was."""
+        index = bisect_left(self._maxes, value)
+        if index == len(self._blocks):
+            return False
+        block = self._blocks[index]
+        position = bisect_left(block, value)
+        if position == len(block) or block[position] != value:
+            return False
+        del block[position]
+        self._len -= 1
+        if block:
+            self._maxes[index] = block[-1]
+        else:
+            del self._blocks[index]
+            del self._maxes[index]
+        return True
+
+
+def new_owner():
+    """A fresh allocation owner key; random, so releasing it can never free another config's addresses."""
+    return uuid.uuid4().hex
+
+def config_owner(config):
+    """The allocation owner of a stored config; configs sold before owner keys existed used their ID."""
+    return config.get('allocation_id') or config.get('id')
+
+
+class AllocationRegistry:
+    """
+    Addresses handed out to configs, per location and IP version.
+
+    Each set is a SortedBlocks of integer addresses, array('I') blocks for
+    IPv4 (4 bytes per address) and WideArray blocks for IPv6 (16 bytes),
+    so membership and inserts are O(log n) and a million IPv4 allocations
+    take about 4 MB. Owners are kept in SQLite only and looked up when
+    addresses are released.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        # Allocations of this thread's open batch() blocks, not yet in SQLite
+        self._batch = threading.local()
+        loaded = {}
+        for location, address in store.load_allocations():
+            value = ipaddress.ip_address(address)
+            loaded.setdefault((location, value.version), []).append(int(value))
+        self._taken = {
+            key: SortedBlocks(self._typecode(key[1]), sorted(values))
+            for key, values in loaded.items()
+        }
+
+    @staticmethod
+    def _typecode(version):
+        return 'I' if version == 4 else WIDE
+
+    def _set(self, location, version):
+        key = (location, version)
+        if key not in self._taken:
+            self._taken[key] = SortedBlocks(self._typecode(version))
+        return self._taken[key]
+
+    @contextmanager
+    def batch(self):
+        """
+        Write the allocations this thread makes inside the block to SQLite
+        in one transaction when it exits, instead of committing each one.
+        Blocks may nest; the outermost one writes.
+        """
+        state = self._batch
+        state.depth = getattr(state, 'depth', 0) + 1
+        if state.depth == 1:
+            state.rows = []
+        try:
+            yield self
+        finally:
+            state.depth -= 1
+            if state.depth == 0:
+                self._write_batch()
+
+    def _write_batch(self):
+        # Releases look owners up in SQLite, so they write the batch first
+        rows = getattr(self._batch, 'rows', None)
+        if rows:
+            self._batch.rows = []
+            self.store.add_allocations(rows)
+
+    def allocate(self, location, version, owner):
+        """
+        Hand out an address from the location's ranges that nobody holds yet.
+
+        Args:
+            location: Location ID
+            version: 4 or 6
+            owner: Allocation key of the config the address is for (see
+                new_owner()); used by release_owner()
+
+        Returns:
+            str: The address, or None if the location's ranges are used up
+        """
+        pool = ip_pool.get_pool(location, version)
+        if pool is None or not pool.size:
+            return None
+
+        with self._lock:
+            taken = self._set(location, version)
+            value = None
+            for _ in range(MAX_DRAWS):
+                candidate = pool.random_int()
+                if candidate not in taken:
+                    value = candidate
+                    break
+            if value is None:
+                value = self._draw_free(pool, taken)
+                if value is None:
+                    logger.error(f"No free IPv{version} addresses left in {location}")
+                    return None
+
+            address = pool.format(value)
+            if getattr(self._batch, 'depth', 0):
+                self._batch.rows.append((location, address, owner))
+            else:
+                self.store.add_allocations([(location, address, owner)])
+            taken.add(value)
+            return address
+
+    @staticmethod
+    def _draw_free(pool, taken):
+        """Pick uniformly among the pool's free addresses; for nearly full pools."""
+        # Positions of the taken addresses in the pool, in ascending order
+        ranks = [rank for rank in map(pool.index_of, taken) if rank is not None]
+        free = pool.size - len(ranks)
+        if free <= 0:
+            return None
+        k = random.randrange(free)
+        # ranks[i] - i free addresses come before the i-th taken one; count
+        # the taken addresses that come before the k-th free one
+        low, high = 0, len(ranks)
+        while low < high:
+            middle = (low + high) // 2
+            if ranks[middle] - middle <= k:
+                low = middle + 1
+            else:
+                high = middle
+        return pool.address_at(k + low)
+
+    def is_allocated(self, location, address):
+        value = ipaddress.ip_address(address)
+        with self._lock:
+            return int(value) in self._taken.get((location, value.version), ())
+
+    def release(self, location, address):
+        """Return a single address to the location's pool."""
+        self._write_batch()
+        return self._forget(self.store.remove_allocations(location=location, address=address))
+
+    def release_owner(self, owner):
+        """
+        Return every address held by a config, e.g. when it expires or its
+        purchase did not go through.
+
+        Returns:
+            int: Number of addresses released
+        """
+        self._write_batch()
+        return self._forget(self.store.remove_allocations(owner=owner))
+
+    def release_orphans(self, live_owners):
+        """
+        Release the addresses of owners not in live_owners, e.g. configs that
+        were pre-generated by a previous run but never sold.
+
+        Returns:
+            int: Number of addresses released
+        """
+        self._write_batch()
+        released = 0
+        for owner in self.store.allocation_owners():
+            if owner not in live_owners:
+                released += self.release_owner(owner)
+        return released
+
+    def _forget(self, rows):
+        with self._lock:
+            for location, address in rows:
+                value = ipaddress.ip_address(address)
+                taken = self._taken.get((location, value.version))
+                if taken is not None:
+                    taken.discard(int(value))
+        return len(rows)
+
+    def count(self, location, version):
+        with self._lock:
+            return len(self._taken.get((location, version), ()))
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """Return the process-wide allocation registry."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = AllocationRegistry(get_store())
+    return _registry
+
+def allocate(location, version, owner):
+    return get_registry().allocate(location, version, owner)
+
+def batch():
+    """Batch the allocation writes of a block; see AllocationRegistry.batch()."""
+    return get_registry().batch()
+
+def release_owner(owner):
+    return get_registry().release_owner(owner)
+
+def release_orphans(live_owners):
+    return get_registry().release_orphans(live_owners)
+
+def release_expired(now=None):
+    """
+    Release the addresses of sold configs whose expiry_date has passed and
+    mark those configs expired, so each is released once.
+
+    Returns:
+        int: Number of addresses released
+    """
+    now = now or datetime.now()
+    expired = []
+    for user_id, user in repository.snapshot()['users'].items():
+        for key in ('dns_configs', 'wireguard_configs'):
+            for index, config in enumerate(user.get(key, [])):
+                if config.get('expired') or 'expiry_date' not in config:
+                    continue
+                if datetime.strptime(config['expiry_date'], '%Y-%m-%d %H:%M:%S') <= now:
+                    expired.append((user_id, key, index, config.get('id')))
+    if not expired:
+        return 0
+
+    owners = []
+    with repository.transaction() as draft:
+        for user_id, key, index, config_id in expired:
+            configs = draft['users'][user_id][key]
+            # Skip configs that moved or changed since the snapshot
+            if index >= len(configs) or configs[index].get('id') != config_id or configs[index].get('expired'):
+                continue
+            configs[index]['expired'] = True
+            owners.append(config_owner(configs[index]))
+
+    released = sum(release_owner(owner) for owner in owners)
+    if released:
+        logger.info(f"Released {released} addresses of expired configs")
+    return released
@@ -0,0 +1,118 @@
+"""
+Asyncio runtime for the bot.
+
+This is not an async rewrite of the handlers: they stay the synchronous
+telebot handlers and every update runs in one of ASYNC_WORKERS pool
+threads, blocking it for the whole handler. asyncio only long polls
+Telegram and schedules the updates: up to ASYNC_MAX_IN_FLIGHT are accepted
+at once, and updates from the same chat are handled one after another, in
+the order they arrived, so per-user states stay consistent. Throughput is
+therefore that of a thread pool of ASYNC_WORKERS threads, with per-chat
+ordering on top; waiting updates cost a task, not a thread.
+"""
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from config import ASYNC_MAX_IN_FLIGHT, ASYNC_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_key(update):
+    """The chat an update belongs to, or None if it has none we order on."""
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None:
+        return update.callback_query.from_user.id
+    return None
+
+
+class AsyncRuntime:
+    def __init__(self, bot, max_in_flight=ASYNC_MAX_IN_FLIGHT, workers=ASYNC_WORKERS, process=None):
+        self.bot = bot
+        self.max_in_flight = max_in_flight
+        self.workers = workers
+        # Runs one update's handlers in an executor thread
+        self.process = process or (lambda update: bot.process_new_updates([update]))
+        self.executor = None
+        # chat key -> task of the chat's latest update
+        self._tails = {}
+        self._in_flight = None
+
+    async def dispatch(self, update):
+        """Schedule an update, waiting first if max_in_flight updates are already in flight."""
+        await self._in_flight.acquire()
+        key = update_chat_key(update)
+        previous = self._tails.get(key) if key is not None else None
+        task = asyncio.ensure_future(self._handle(update, previous))
+        if key is not None:
+            self._tails[key] = task
+            task.add_done_callback(partial(self._forget_tail, key))
+        return task
+
+    def _forget_tail(self, key, task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def _handle(self, update, previous):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self.process, update)
+        except Exception as e:
+            logger.error(f"Error handling update {update.update_id}: {e}")
+        finally:
+            self._in_flight.release()
+
+    def start(self):
+        # Handlers run inline in our executor threads instead of telebot's own pool
+        self.bot.threaded = False
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='update')
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+    async def drain(self):
+        """Wait for every scheduled update to finish."""
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+    async def _skip_pending(self, loop):
+        updates = await loop.run_in_executor(
+            None, partial(self.bot.get_updates, offset=-1, timeout=10, long_polling_timeout=1))
+        return updates[-1].update_id + 1 if updates else None
+
+    async def poll(self, skip_pending=True, timeout=30, allowed_updates=None):
+        """Long poll Telegram and dispatch every update until cancelled."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        offset = await self._skip_pending(loop) if skip_pending else None
+        try:
+            while True:
+                try:
+                    updates = await loop.run_in_executor(None, partial(
+                        self.bot.get_updates,
+                        offset=offset,
+                        timeout=timeout + 10,
+                        long_polling_timeout=timeout,
+                        allowed_updates=allowed_updates
+                    ))
+                except Exception as e:
+                    logger.error(f"Polling failed: {e}")
+                    await asyncio.sleep(3)
+                    continue
+                for update in updates:
+                    offset = update.update_id + 1
+                    await self.dispatch(update)
+        finally:
+            await self.drain()
+            self.executor.shutdown(wait=False)
+
+
+def run(bot, **kwargs):
+    """Run the bot on the asyncio runtime; see AsyncRuntime.poll() for the arguments."""
+    logger.info(f"Starting asyncio runtime ({ASYNC_MAX_IN_FLIGHT} updates in flight, {ASYNC_WORKERS} workers)")
+    try:
+        asyncio.run(AsyncRuntime(bot).poll(**kwargs))
+    except KeyboardInterrupt:
+        logger.info("Bot stopped")
@@ -0,0 +1,284 @@
+import time
+import uuid
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+from config import BROADCAST_CHECKPOINT_EVERY, BROADCAST_PROGRESS_INTERVAL, BROADCAST_KEEP_FINISHED
+from rate_limit import global_bucket
+import repository
+
+logger = logging.getLogger(__name__)
+
+AUDIENCES = ('all', 'active')
+
+# Running workers by job ID
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def is_recipient(user_id, user, audience, blocked_users=()):
+    """Whether a user gets a broadcast for audience ('all' or 'active'); blocked_users holds int IDs."""
+    if user.get('blocked') or user.get('bot_blocked') or int(user_id) in blocked_users:
+        return False
+    if audience == 'active':
+        return bool(user.get('dns_configs') or user.get('wireguard_configs') or user.get('balance', 0) > 0)
+    return True
+
+def recipients_after(audience, cursor=None):
+    """User IDs of the audience in ascending order, starting after cursor."""
+    data = repository.snapshot()
+    blocked_users = {int(user_id) for user_id in data.get('blocked_users', [])}
+    ids = sorted(int(user_id) for user_id, user in data['users'].items()
+                 if is_recipient(user_id, user, audience, blocked_users))
+    if cursor is None:
+        return ids
+    return ids[bisect_right(ids, cursor):]
+
+# Jobs are kept under the 'broadcasts' key so a restart can pick them up
+def get_job(job_id):
+    jobs = repository.snapshot().get('broadcasts', {})
+    job = jobs.get(job_id)
+    return dict(job) if job is not None else None
+
+def running_jobs():
+    jobs = repository.snapshot().get('broadcasts', {})
+    return [dict(job) for job in jobs.values() if job.get('status') == 'running']
+
+def _save_job(job):
+    with repository.transaction() as draft:
+        if 'broadcasts' not in draft:
+            draft['broadcasts'] = {}
+        jobs = draft['broadcasts']
+        jobs[job['id']] = dict(job)
+        if job['status'] != 'running':
+            # Keep only the latest finished jobs so the blob does not grow forever
+            finished = sorted((other.get('finished_at') or '', job_id) for job_id, other in jobs.items()
+                              if other.get('status') != 'running')
+            for _, job_id in finished[:-BROADCAST_KEEP_FINISHED]:
+                del jobs[job_id]
+
+def mark_bot_blocked(user_id):
+    """Flag a user who blocked the bot (or deleted their account) so no broadcast tries them again."""
+    user_key = str(user_id)
+    with repository.transaction() as draft:
+        if user_key in draft['users']:
+            draft['users'][user_key]['bot_blocked'] = True
+
+def mark_bot_unblocked(user_id):
+    """Clear the flag of mark_bot_blocked() once the user talks to the bot again."""
+    user_key = str(user_id)
+    with repository.transaction() as draft:
+        if user_key in draft['users'] and draft['users'][user_key].get('bot_blocked'):
+            draft['users'][user_key]['bot_blocked'] = False
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+def progress_text(job, rate=None):
+    done = job['sent'] + job['failed'] + job['blocked']
+    total = max(job['total'], done)
+    percent = done * 100 // total if total else 100
+    status = {
+        'running': "⏳ در حال ارسال",
+        'done': "✅ ارسال کامل شد",
+        'cancelled': "🛑 ارسال لغو شد"
+    }.get(job['status'], job['status'])
+
+    text = (
+        f"📩 ارسال پیام گروهی - {status}\n\n"
+        f"📊 پیشرفت: {done}/{total} ({percent}%)\n"
+        f"✅ ارسال شده: {job['sent']}\n"
+        f"⛔️ ربات را مسدود کرده‌اند: {job['blocked']}\n"
+        f"❌ ناموفق: {job['failed']}\n"
+    )
+    if job['status'] == 'running' and rate:
+        text += f"⏱️ زمان باقیمانده: {format_duration((total - done) / rate)}\n"
+    return text
+
+def progress_keyboard(job):
+    if job['status'] != 'running':
+        return None
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🛑 لغو ارسال", callback_data=f"broadcast_cancel_{job['id']}"))
+    return markup
+
+
+class BroadcastWorker(threading.Thread):
+    """
+    Deliver one broadcast job.
+
+    Recipients are walked in ascending user ID order and the last one handled
+    is saved as the job's cursor every BROADCAST_CHECKPOINT_EVERY users, so
+    a restart resumes right after it. Sends go through the shared token
+    bucket; a 429 pauses the bucket for retry_after and the same user is
+    retried.
+    """
+
+    def __init__(self, bot, job, bucket=global_bucket):
+        super().__init__(name=f"broadcast-{job['id']}", daemon=True)
+        self.bot = bot
+        self.job = job
+        self.bucket = bucket
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        job = self.job
+        try:
+            recipients = recipients_after(job['audience'], job.get('cursor'))
+            done_before = job['sent'] + job['failed'] + job['blocked']
+            job['total'] = done_before + len(recipients)
+            _save_job(job)
+
+            started = time.monotonic()
+            last_progress = started
+            unsaved = 0
+            for user_id in recipients:
+                if self._cancel.is_set():
+                    job['status'] = 'cancelled'
+                    break
+                self._deliver(user_id)
+                job['cursor'] = user_id
+                unsaved += 1
+                if unsaved >= BROADCAST_CHECKPOINT_EVERY:
+                    _save_job(job)
+                    unsaved = 0
+
+                now = time.monotonic()
+                if now - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+                    done = job['sent'] + job['failed'] + job['blocked'] - done_before
+                    self._show_progress(done / (now - started))
+                    last_progress = now
+            else:
+                job['status'] = 'done'
+        except Exception as e:
+            logger.error(f"Broadcast {job['id']} stopped: {e}")
+        finally:
+            if job['status'] != 'running':
+                job['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            _save_job(job)
+            self._show_progress()
+            with _workers_lock:
+                _workers.pop(job['id'], None)
+            logger.info(f"Broadcast {job['id']} {job['status']}: {job['sent']} sent, "
+                        f"{job['blocked']} blocked, {job['failed']} failed")
+
+    def _deliver(self, user_id):
+        job = self.job
+        while True:
+            self.bucket.acquire()
+            try:
+                self.bot.copy_message(user_id, job['from_chat_id'], job['message_id'])
+                job['sent'] += 1
+                return
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                    logger.warning(f"Broadcast {job['id']} rate limited, retrying in {retry_after}s")
+                    self.bucket.pause(retry_after)
+                    continue
+                if e.error_code == 403:
+                    job['blocked'] += 1
+                    mark_bot_blocked(user_id)
+                    return
+                logger.warning(f"Broadcast {job['id']} to {user_id} failed: {e.description}")
+                job['failed'] += 1
+                return
+            except Exception as e:
+                logger.warning(f"Broadcast {job['id']} to {user_id} failed: {e}")
+                job['failed'] += 1
+                return
+
+    def _show_progress(self, rate=None):
+        job = self.job
+        if not job.get('progress_message_id'):
+            return
+        try:
+            self.bucket.acquire()
+            self.bot.edit_message_text(
+                progress_text(job, rate),
+                job['admin_chat_id'],
+                job['progress_message_id'],
+                reply_markup=progress_keyboard(job)
+            )
+        except Exception as e:
+            # "message is not modified" and the like must not stop the broadcast
+            logger.debug(f"Broadcast progress update failed: {e}")
+
+
+def _start_worker(bot, job):
+    worker = BroadcastWorker(bot, job)
+    with _workers_lock:
+        _workers[job['id']] = worker
+    worker.start()
+    return worker
+
+def start(bot, audience, from_chat_id, message_id, admin_chat_id):
+    """
+    Start broadcasting a copy of a message.
+
+    Args:
+        bot: Telebot instance
+        audience: 'all' or 'active'
+        from_chat_id, message_id: The message to copy to every recipient
+        admin_chat_id: Chat that gets the progress message
+
+    Returns:
+        dict: The job, or None if another broadcast is still running
+    """
+    with _workers_lock:
+        if _workers:
+            return None
+
+    job = {
+        'id': uuid.uuid4().hex[:8],
+        'audience': audience,
+        'from_chat_id': from_chat_id,
+        'message_id': message_id,
+        'admin_chat_id': admin_chat_id,
+        'progress_message_id': None,
+        'cursor': None,
+        'sent': 0,
+        'failed': 0,
+        'blocked': 0,
+        'total': 0,
+        'status': 'running',
+        'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    progress = bot.send_message(admin_chat_id, progress_text(job), reply_markup=progress_keyboard(job))
+    job['progress_message_id'] = progress.message_id
+    _save_job(job)
+    _start_worker(bot, job)
+    return job
+
+def cancel(job_id):
+    """Ask a running broadcast to stop; returns False if it is not running."""
+    with _workers_lock:
+        worker = _workers.get(job_id)
+    if worker is None:
+        return False
+    worker.cancel()
+    return True
+
+def resume_all(bot):
+    """Restart the broadcasts a previous run left unfinished, from their saved cursors."""
+    resumed = 0
+    for job in running_jobs():
+        with _workers_lock:
+            if job['id'] in _workers:
+                continue
+        logger.info(f"Resuming broadcast {job['id']} after user {job.get('cursor')}")
+        _start_worker(bot, job)
+        resumed += 1
+    return resumed
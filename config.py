@@ -15,8 +15,48 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 # Data storage
-DATA_FILE = 'bot_data.pkl'
-DNS_RANGES_FILE = 'dns_ranges.pkl'
+DATA_FILE = 'bot_data.pkl'  # Legacy pickle, migrated into DB_FILE on first start
+DB_FILE = 'bot_data.db'
+# When a write returns: 'sync' fsyncs the journal in the writing thread, 'grouped'
+# waits for one fsync shared by the writes of all threads that arrived within
+# GROUP_COMMIT_INTERVAL_MS, 'async' returns at once and leaves the fsync to the
+# journal's batching (a power loss can then lose the last batch)
+STORAGE_DURABILITY = 'grouped'
+GROUP_COMMIT_INTERVAL_MS = 20  # How long the writer gathers saves before committing them
+JOURNAL_FILE = 'bot_data.journal'  # Row writes land here first and are folded into DB_FILE
+JOURNAL_FSYNC_BATCH = 32  # fsync after this many appended records...
+JOURNAL_FSYNC_INTERVAL = 0.2  # ...or after this many seconds, whichever comes first
+JOURNAL_COMPACT_INTERVAL = 60  # Seconds between folding the journal into DB_FILE
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024  # Fold early once the journal grows past this size
+DNS_RANGES_FILE = 'dns_ranges.pkl'  # Legacy pickle, converted into DNS_RANGES_DB_FILE on first start
+DNS_RANGES_DB_FILE = 'dns_ranges.bin'
+# Ready-made configs kept per location: refill once fewer than the low
+# watermark are left, up to the high watermark
+CONFIG_POOL_LOW_WATERMARK = 5
+CONFIG_POOL_HIGH_WATERMARK = 20
+CONFIG_POOL_REFILL_INTERVAL = 30  # Seconds between checks when nothing was taken
+EXPIRY_CHECK_INTERVAL = 3600  # Seconds between releasing the addresses of expired configs
+TELEGRAM_GLOBAL_RATE = 25  # Messages per second across all chats, under Telegram's ~30/s limit
+BROADCAST_CHECKPOINT_EVERY = 25  # Save a broadcast's cursor after this many recipients
+BROADCAST_PROGRESS_INTERVAL = 5  # Seconds between progress message edits
+BROADCAST_KEEP_FINISHED = 20  # Finished broadcast jobs kept in the data; older ones are pruned
+TELEGRAM_PER_CHAT_RATE = 1  # Messages per second to a single chat
+OUTBOX_WORKERS = 4  # Threads delivering queued outgoing messages
+OUTBOX_MAX_RETRIES = 3  # Retries of a queued send after a 5xx or network error
+OUTBOX_MAX_RATE_LIMITED = 5  # Retries of a queued send answered 429; then it fails
+BOT_RUNTIME = 'threaded'  # 'threaded' or 'async'; overridden by main.py --runtime
+ASYNC_MAX_IN_FLIGHT = 512  # Updates the async runtime accepts at once; those beyond ASYNC_WORKERS wait without a thread
+ASYNC_WORKERS = 64  # Threads running handlers for the async runtime; bounds how many run at the same time
+# Webhook mode (main.py --mode webhook). Telegram only posts to HTTPS URLs:
+# put the server behind a TLS proxy or set the certificate and key files
+WEBHOOK_URL = ''  # Public URL Telegram posts updates to, e.g. https://example.com/telegram
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8443
+WEBHOOK_SECRET_TOKEN = ''  # Required in webhook mode; Telegram sends it with every update (1-256 of A-Z a-z 0-9 _ -)
+WEBHOOK_SSL_CERT = ''
+WEBHOOK_SSL_KEY = ''
+WEBHOOK_QUEUE_SIZE = 1000  # Updates waiting for a consumer; more are answered 503 for Telegram to retry
+WEBHOOK_CONSUMERS = 8  # Threads running handlers for queued updates
 FILES_DIR = 'uploaded_files'
 TUTORIALS_DIR = 'tutorials'
 
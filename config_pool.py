@@ -0,0 +1,153 @@
+import time
+import logging
+import threading
+from collections import deque
+from config import (
+    CONFIG_POOL_LOW_WATERMARK, CONFIG_POOL_HIGH_WATERMARK, CONFIG_POOL_REFILL_INTERVAL, EXPIRY_CHECK_INTERVAL
+)
+import repository
+import allocations
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigPool(threading.Thread):
+    """
+    Background pre-generator of ready-made configs.
+
+    Keeps a buffer per (kind, location) of configs with their keys,
+    addresses and rendered text, so a purchase only pops one. A buffer is
+    refilled up to the high watermark once it drops below the low one.
+    Buffered configs already hold their address allocations; they are
+    released when the buffers are dropped because the DNS ranges changed.
+    Every EXPIRY_CHECK_INTERVAL seconds the thread also releases the
+    addresses of sold configs that have expired.
+
+    Args:
+        generators: {kind: callable(location, count) -> [(owner, config)]},
+            owner being the allocations owner key the config's addresses are
+            held under; a falsy config means the location cannot produce one
+            right now
+    """
+
+    def __init__(self, generators, low=CONFIG_POOL_LOW_WATERMARK, high=CONFIG_POOL_HIGH_WATERMARK,
+                 interval=CONFIG_POOL_REFILL_INTERVAL):
+        super().__init__(name='config-pool', daemon=True)
+        self.generators = generators
+        self.low = low
+        self.high = high
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._ranges_key = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._next_expiry_check = 0
+
+    def take(self, kind, location):
+        """
+        Pop a ready-made config.
+
+        Returns:
+            tuple: (owner, config), or None if none is ready
+        """
+        self._check_ranges()
+        with self._lock:
+            buffer = self._buffers.get((kind, location))
+            item = buffer.popleft() if buffer else None
+            if buffer is None or len(buffer) < self.low:
+                self._wakeup.set()
+        return item
+
+    def size(self, kind, location):
+        with self._lock:
+            return len(self._buffers.get((kind, location), ()))
+
+    def _check_ranges(self):
+        repository.dns_ranges_db()
+        key = repository.dns_ranges_key()
+        if key != self._ranges_key:
+            self._ranges_key = key
+            self.invalidate()
+
+    def invalidate(self, location=None):
+        """Drop the buffered configs of one location, or of all, and release the addresses they hold."""
+        with self._lock:
+            if location is None:
+                buffers, self._buffers = self._buffers, {}
+            else:
+                buffers = {key: self._buffers.pop(key) for key in list(self._buffers) if key[1] == location}
+        dropped = 0
+        for buffer in buffers.values():
+            for owner, _ in buffer:
+                allocations.release_owner(owner)
+                dropped += 1
+        if dropped:
+            logger.info(f"Dropped {dropped} pre-generated configs")
+        self._wakeup.set()
+
+    def refill(self):
+        """Top up every buffer of an enabled location that is below the low watermark."""
+        self._check_ranges()
+        for location_id, location in repository.get_locations().items():
+            if not location.get('enabled'):
+                continue
+            for kind, generate in self.generators.items():
+                if self.size(kind, location_id) >= self.low:
+                    continue
+                # Generate the whole shortfall in one batch
+                items = [item for item in generate(location_id, self.high - self.size(kind, location_id))
+                         if item[1]]
+                with self._lock:
+                    self._buffers.setdefault((kind, location_id), deque()).extend(items)
+
+    def run(self):
+        while not self._stopped:
+            try:
+                self.refill()
+            except Exception as e:
+                logger.error(f"Config pool refill failed: {e}")
+            if time.monotonic() >= self._next_expiry_check:
+                self._next_expiry_check = time.monotonic() + EXPIRY_CHECK_INTERVAL
+                try:
+                    allocations.release_expired()
+                except Exception as e:
+                    logger.error(f"Releasing expired configs failed: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self.invalidate()
+
+
+_pool = None
+
+def start(generators):
+    """Start the process-wide pool; see ConfigPool for the generators."""
+    global _pool
+    if _pool is None:
+        # Configs buffered by a previous run were lost with it; free their addresses
+        live = set()
+        for user in repository.snapshot()['users'].values():
+            for key in ('dns_configs', 'wireguard_configs'):
+                live.update(allocations.config_owner(config) for config in user.get(key, [])
+                            if not config.get('expired'))
+        released = allocations.release_orphans(live)
+        if released:
+            logger.info(f"Released {released} addresses of unsold configs")
+        _pool = ConfigPool(generators)
+        _pool.start()
+    return _pool
+
+def invalidate(location=None):
+    """Drop ready-made configs built from a location's old settings; see ConfigPool.invalidate()."""
+    if _pool is not None:
+        _pool.invalidate(location)
+
+def take(kind, location):
+    """Pop a ready-made (owner, config), or None if the pool is not running or empty."""
+    if _pool is None:
+        return None
+    return _pool.take(kind, location)
@@ -6,6 +6,7 @@ import uuid
 import base64
 from telebot import types
 from datetime import datetime
+import repository
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -20,7 +21,7 @@ def generate_file_id():
     return str(uuid.uuid4())[:8]
 
 # Function to edit an uploaded file
-def edit_uploaded_file(file_id, new_file_info, new_file_data=None, data_manager=None):
+def edit_uploaded_file(file_id, new_file_info, new_file_data=None):
     """
     Edit uploaded file information or content
 
@@ -28,24 +29,16 @@ def edit_uploaded_file(file_id, new_file_info, new_file_data=None, data_manager=
         file_id: The ID of the file to edit
         new_file_info: Dictionary with new information (title, caption, etc.)
         new_file_data: Binary data for the new file (optional)
-        data_manager: Function to handle data loading/saving
 
     Returns:
         bool: True if successful, False otherwise
     """
-    if data_manager is None:
-        # Default data manager function
-        from main import load_data, save_data
-    else:
-        load_data, save_data = data_manager
-
-    data = load_data()
+    with repository.transaction() as data:
+        if file_id not in data.get('uploaded_files', {}):
+            return False
 
-    if file_id in data.get('uploaded_files', {}):
-        # Update file information (title, caption, etc.)
+        # Update only provided fields (title, caption, etc.)
         current_file_info = data['uploaded_files'][file_id]
-
-        # Update only provided fields
         for key, value in new_file_info.items():
             current_file_info[key] = value
 
@@ -55,15 +48,10 @@ def edit_uploaded_file(file_id, new_file_info, new_file_data=None, data_manager=
             with open(file_path, 'wb') as f:
                 f.write(new_file_data)
 
-        # Save updated data
-        data['uploaded_files'][file_id] = current_file_info
-        save_data(data)
-        return True
-
-    return False
+    return True
 
 # Function to handle file upload
-def handle_file_upload(bot, message, file_type, admin_state, data_manager=None):
+def handle_file_upload(bot, message, file_type, admin_state):
     """
     Handle file upload from admin
 
@@ -72,19 +60,11 @@ def handle_file_upload(bot, message, file_type, admin_state, data_manager=None):
         message: Message object containing the file
         file_type: Type of file (photo, video, document)
         admin_state: Admin state dictionary
-        data_manager: Function to handle data loading/saving
 
     Returns:
         tuple: (success, file_id)
     """
-    if data_manager is None:
-        # Default data manager function
-        from main import load_data, save_data
-    else:
-        load_data, save_data = data_manager
-
-    data = load_data()
-    success = False
+    file_record = None
     file_id = None
 
     try:
@@ -98,14 +78,13 @@ def handle_file_upload(bot, message, file_type, admin_state, data_manager=None):
             downloaded_file = bot.download_file(file_info.file_path)
             with open(file_path, 'wb') as f:
                 f.write(downloaded_file)
-            data['uploaded_files'][file_id] = {
+            file_record = {
                 'type': 'photo', 
                 'title': message.caption or file_id, 
                 'caption': message.caption,
                 'telegram_file_id': telegram_file_id,
                 'uploaded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
-            success = True
 
         elif file_type == 'video' and message.content_type == 'video':
             file_id = generate_file_id()
@@ -115,14 +94,13 @@ def handle_file_upload(bot, message, file_type, admin_state, data_manager=None):
             downloaded_file = bot.download_file(file_info.file_path)
             with open(file_path, 'wb') as f:
                 f.write(downloaded_file)
-            data['uploaded_files'][file_id] = {
+            file_record = {
                 'type': 'video', 
                 'title': message.caption or file_id, 
                 'caption': message.caption,
                 'telegram_file_id': telegram_file_id,
                 'uploaded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
-            success = True
 
         elif file_type == 'document' and message.content_type == 'document':
             file_id = generate_file_id()
@@ -134,7 +112,7 @@ def handle_file_upload(bot, message, file_type, admin_state, data_manager=None):
                 f.write(downloaded_file)
 
             file_name = message.document.file_name
-            data['uploaded_files'][file_id] = {
+            file_record = {
                 'type': 'document', 
                 'title': message.caption or file_name or file_id, 
                 'caption': message.caption,
@@ -142,16 +120,18 @@ def handle_file_upload(bot, message, file_type, admin_state, data_manager=None):
                 'telegram_file_id': telegram_file_id,
                 'uploaded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
-            success = True
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         return False, None
 
-    save_data(data)
-    return success, file_id
+    if file_record is None:
+        return False, file_id
+
+    repository.add_uploaded_file(file_id, file_record)
+    return True, file_id
 
 # Send file to user
-def send_file_to_user(bot, message, file_id, data_manager=None):
+def send_file_to_user(bot, message, file_id):
     """
     Send a file to a user
 
@@ -159,67 +139,12 @@ def send_file_to_user(bot, message, file_id, data_manager=None):
         bot: Telebot instance
         message: Message object
         file_id: ID of the file to send
-        data_manager: Function to handle data loading
 
     Returns:
         bool: True if successful, False otherwise
     """
-    if data_manager is None:
-        # Default data manager function
-        from main import load_data
-    else:
-        load_data = data_manager
-
-    data = load_data()
-    if file_id in data.get('uploaded_files', {}):
-        file_info = data['uploaded_files'][file_id]
-        try:
-            # If it's an external URL file
-            if file_info.get('type') == 'external_url':
-                external_url = file_info.get('external_url')
-                if external_url:
-                    # Send message with the URL
-                    bot.send_message(
-                        message.chat.id,
-                        f"📎 <b>{file_info.get('title', 'فایل خارجی')}</b>\n\n"
-                        f"🔗 <a href='{external_url}'>لینک دانلود مستقیم</a>\n\n"
-                        f"{file_info.get('caption', '')}",
-                        parse_mode="HTML",
-                        disable_web_page_preview=False
-                    )
-                    return True
-            # If Telegram file_id is available, use it (faster method)
-            elif 'telegram_file_id' in file_info:
-                if file_info['type'] == 'photo':
-                    bot.send_photo(message.chat.id, file_info['telegram_file_id'], caption=file_info.get('caption', ''))
-                elif file_info['type'] == 'video':
-                    bot.send_video(message.chat.id, file_info['telegram_file_id'], caption=file_info.get('caption', ''))
-                elif file_info['type'] == 'document':
-                    bot.send_document(message.chat.id, file_info['telegram_file_id'], caption=file_info.get('caption', ''))
-            # Otherwise use the saved file
-            else:
-                file_path = os.path.join(FILES_DIR, file_id)
-                with open(file_path, 'rb') as f:
-                    if file_info['type'] == 'photo':
-                        bot.send_photo(message.chat.id, f, caption=file_info.get('caption', ''))
-                    elif file_info['type'] == 'video':
-                        bot.send_video(message.chat.id, f, caption=file_info.get('caption', ''))
-                    elif file_info['type'] == 'document':
-                        bot.send_document(message.chat.id, f, caption=file_info.get('caption', ''))
-            return True
-        except Exception as e:
-            logger.error(f"Error sending file {file_id}: {e}")
-            bot.send_message(message.chat.id, "متاسفانه در ارسال فایل مورد نظر خطایی رخ داد.")
-            return False
-    else:
-        bot.send_message(message.chat.id, "متاسفانه فایل مورد نظر یافت نشد.")
-        return False
-        
-def send_file_to_user(bot, message, file_id, load_data_func):
-    """Send a file to user using its ID"""
-    data = load_data_func()
-    if file_id in data.get('uploaded_files', {}):
-        file_info = data['uploaded_files'][file_id]
+    file_info = repository.get_uploaded_file(file_id)
+    if file_info is not None:
         try:
             # Handle external URL links
             if file_info.get('type') == 'external_url' and 'external_url' in file_info:
@@ -259,7 +184,7 @@ def send_file_to_user(bot, message, file_id, load_data_func):
         return False
 
 # Create external URL share link
-def create_external_url_link(title, url, caption="", data_manager=None):
+def create_external_url_link(title, url, caption=""):
     """
     Create a shareable link for an external URL
 
@@ -267,36 +192,25 @@ def create_external_url_link(title, url, caption="", data_manager=None):
         title: Title for the external URL
         url: The external URL
         caption: Optional caption for the URL
-        data_manager: Function to handle data loading/saving
 
     Returns:
         str: The generated file_id for sharing
     """
-    if data_manager is None:
-        # Default data manager function
-        from main import load_data, save_data
-    else:
-        load_data, save_data = data_manager
-
-    data = load_data()
-
     # Generate a unique file ID
     file_id = generate_file_id()
 
     # Add to uploaded_files data
-    data['uploaded_files'][file_id] = {
+    repository.add_uploaded_file(file_id, {
         'type': 'external_url',
         'title': title,
         'external_url': url,
         'caption': caption,
         'uploaded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
-
-    save_data(data)
+    })
     return file_id
 
 # Replace an existing file with new content
-def replace_existing_file(file_id, new_file_data, new_file_info=None, data_manager=None):
+def replace_existing_file(file_id, new_file_data, new_file_info=None):
     """
     Replace an existing file with new content while keeping the same file_id
 
@@ -304,20 +218,11 @@ def replace_existing_file(file_id, new_file_data, new_file_info=None, data_manag
         file_id: ID of the file to replace
         new_file_data: Binary data of the new file
         new_file_info: New file information (optional, will only update provided fields)
-        data_manager: Function to handle data loading/saving
 
     Returns:
         bool: True if successful, False otherwise
     """
-    if data_manager is None:
-        # Default data manager function
-        from main import load_data, save_data
-    else:
-        load_data, save_data = data_manager
-
-    data = load_data()
-
-    if file_id not in data.get('uploaded_files', {}):
+    if not repository.get_uploaded_file(file_id):
         return False
 
     try:
@@ -328,16 +233,14 @@ def replace_existing_file(file_id, new_file_data, new_file_info=None, data_manag
 
         # Update file info if provided
         if new_file_info:
-            current_info = data['uploaded_files'][file_id]
-            for key, value in new_file_info.items():
-                if key != 'type':  # Don't change the file type
-                    current_info[key] = value
-
-            # Update the replaced timestamp
-            current_info['replaced_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-            data['uploaded_files'][file_id] = current_info
-            save_data(data)
+            with repository.transaction() as data:
+                current_info = data['uploaded_files'][file_id]
+                for key, value in new_file_info.items():
+                    if key != 'type':  # Don't change the file type
+                        current_info[key] = value
+
+                # Update the replaced timestamp
+                current_info['replaced_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         return True
     except Exception as e:
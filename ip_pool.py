@@ -0,0 +1,134 @@
+import random
+import logging
+import ipaddress
+import threading
+from array import array
+from bisect import bisect_right
+import repository
+
+logger = logging.getLogger(__name__)
+
+
+class AddressPool:
+    """
+    Precompiled set of CIDR prefixes to draw random addresses from.
+
+    Each prefix is kept as the integer of its first usable address plus the
+    running count of usable addresses before it, so a draw is one randrange,
+    one bisect and one integer add. Draws are uniform over addresses: a /10
+    is 1024 times as likely to be picked as a /20.
+
+    Prefixes are expected not to overlap (see range_utils.normalize_ranges());
+    they are kept sorted, so an address's index in the pool grows with the
+    address itself.
+    """
+
+    def __init__(self, cidrs=(), version=4):
+        self.version = version
+        self._address_class = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        networks = []
+        for cidr in cidrs:
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError as e:
+                logger.warning(f"Skipping invalid range {cidr}: {e}")
+                continue
+            if network.version != version:
+                continue
+            networks.append((int(network.network_address), network.prefixlen))
+        self._build(networks)
+
+    @classmethod
+    def from_networks(cls, networks, version=4):
+        """Build a pool from (network as int, prefix length) pairs, e.g. RangeDB.networks()."""
+        pool = cls((), version)
+        pool._build(networks)
+        return pool
+
+    def _build(self, networks):
+        bits = 32 if self.version == 4 else 128
+        spans = []
+        for base, prefixlen in networks:
+            size = 1 << (bits - prefixlen)
+            # Leave out the network address, and the broadcast address for IPv4
+            if size > 2:
+                base += 1
+                size -= 2 if self.version == 4 else 1
+            spans.append((base, size))
+
+        if self.version == 4:
+            self._bases = array('I')
+            self._offsets = array('Q')
+        else:
+            self._bases = []
+            self._offsets = []
+        total = 0
+        self._sizes = []
+        for base, size in sorted(spans):
+            self._bases.append(base)
+            self._offsets.append(total)
+            self._sizes.append(size)
+            total += size
+
+        # Number of addresses a draw can return
+        self.size = total
+
+    def address_at(self, n):
+        """The n-th address of the pool as an integer, counting from 0."""
+        index = bisect_right(self._offsets, n) - 1
+        return self._bases[index] + n - self._offsets[index]
+
+    def index_of(self, value):
+        """Position of an integer address in the pool, or None if it is not in it."""
+        index = bisect_right(self._bases, value) - 1
+        if index < 0 or value - self._bases[index] >= self._sizes[index]:
+            return None
+        return self._offsets[index] + value - self._bases[index]
+
+    def random_int(self, rng=random):
+        """Draw a random address as an integer; the pool must not be empty."""
+        return self.address_at(rng.randrange(self.size))
+
+    def random_address(self, rng=random):
+        """Draw a random address as a string, or None if the pool is empty."""
+        if not self.size:
+            return None
+        return self.format(self.random_int(rng))
+
+    def format(self, value):
+        return str(self._address_class(value))
+
+
+# Pools per (location, version), rebuilt when the DNS ranges change
+_pools = {}
+_pools_key = None
+_lock = threading.Lock()
+
+def get_pool(location, version=4):
+    """
+    Return the address pool of a location's IPv4 or IPv6 ranges.
+
+    Returns:
+        AddressPool: The pool, or None if the location has no ranges
+    """
+    global _pools, _pools_key
+    db = repository.dns_ranges_db()
+    key = repository.dns_ranges_key()
+    with _lock:
+        if key != _pools_key:
+            _pools = {}
+            _pools_key = key
+        pool = _pools.get((location, version))
+        if pool is None:
+            if location not in db:
+                return None
+            family = 'ipv4' if version == 4 else 'ipv6'
+            pool = _pools[(location, version)] = AddressPool.from_networks(db.networks(location, family), version)
+        return pool
+
+def random_address(location, version=4):
+    """Draw a random address from a location's ranges, or None if it has none."""
+    pool = get_pool(location, version)
+    if pool is None:
+        return None
+    return pool.random_address()
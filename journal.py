@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import logging
+import threading
+from config import (JOURNAL_FSYNC_BATCH, JOURNAL_FSYNC_INTERVAL,
+                    JOURNAL_COMPACT_INTERVAL, JOURNAL_COMPACT_BYTES)
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    Append-only write-ahead journal of row writes.
+
+    Each line holds one batch of [table, row_id, record] rows that must be
+    applied together. Lines are flushed to the OS on every append and
+    fsync'ed in batches: after fsync_batch records or fsync_interval
+    seconds, whichever comes first. A process crash loses nothing; a power
+    loss can lose at most the last unsynced batch.
+    """
+
+    def __init__(self, path, fsync_batch=JOURNAL_FSYNC_BATCH, fsync_interval=JOURNAL_FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, rows):
+        """Append one batch of (table, row_id, record) rows."""
+        line = json.dumps([[table, row_id, record] for table, row_id, record in rows],
+                          ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line.encode('utf-8') + b'\n')
+            self._file.flush()
+            self._unsynced += 1
+            if (self._unsynced >= self.fsync_batch
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync_locked()
+
+    def sync(self):
+        """fsync whatever was appended since the last sync."""
+        with self._lock:
+            if self._unsynced:
+                self._sync_locked()
+
+    def _sync_locked(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def batches(self):
+        """
+        Read back every complete batch in the journal.
+
+        A torn or corrupt line (e.g. from a crash mid-write) ends the replay.
+        """
+        with self._lock:
+            self._file.flush()
+            with open(self.path, 'rb') as f:
+                lines = f.read().split(b'\n')
+        # The last element is whatever followed the final newline
+        if lines[-1]:
+            logger.warning(f"Ignoring incomplete record at the end of {self.path}")
+        batches = []
+        for number, line in enumerate(lines[:-1], 1):
+            try:
+                batches.append([tuple(row) for row in json.loads(line)])
+            except ValueError:
+                logger.error(f"Corrupt record on line {number} of {self.path}, stopping replay there")
+                break
+        return batches
+
+    def size(self):
+        with self._lock:
+            return self._file.tell()
+
+    def truncate(self):
+        """Drop every record; call only once they are safely in the snapshot."""
+        with self._lock:
+            self._file.truncate(0)
+            self._file.seek(0)
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._unsynced:
+                self._sync_locked()
+            self._file.close()
+
+
+# Background fsync and compaction
+class JournalWorker(threading.Thread):
+    """
+    Keep a store's journal in check: fsync it on the batching interval even
+    when no new writes arrive, and periodically fold it into the snapshot.
+    """
+
+    def __init__(self, store, compact_interval=JOURNAL_COMPACT_INTERVAL, compact_bytes=JOURNAL_COMPACT_BYTES):
+        super().__init__(name='journal-worker', daemon=True)
+        self.store = store
+        self.compact_interval = compact_interval
+        self.compact_bytes = compact_bytes
+        self._stop_event = threading.Event()
+
+    def run(self):
+        journal = self.store.journal
+        last_compact = time.monotonic()
+        while not self._stop_event.wait(journal.fsync_interval):
+            try:
+                journal.sync()
+                if (time.monotonic() - last_compact >= self.compact_interval
+                        or journal.size() >= self.compact_bytes):
+                    self.store.compact()
+                    last_compact = time.monotonic()
+            except Exception as e:
+                logger.error(f"Journal maintenance failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime
+from storage import get_store
+from snapshot import thaw
+import repository
+
+logger = logging.getLogger(__name__)
+
+# Number of locks user balances are striped over
+LOCK_STRIPES = 64
+
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+# Transaction statuses that mean the balance change was already applied
+APPLIED_STATUSES = ('completed', 'approved')
+
+LedgerResult = namedtuple('LedgerResult', ['ok', 'balance', 'duplicate'])
+
+
+def _lock_for(user_id):
+    return _locks[hash(str(user_id)) % LOCK_STRIPES]
+
+def transaction_id_for(key):
+    """Derive a stable 128-bit transaction ID from an update key (e.g. a callback query ID)."""
+    digest = hashlib.sha256(str(key).encode('utf-8')).hexdigest()
+    return digest[:32].upper()
+
+def debit(user_id, amount, reason, transaction_id=None, mutate=None, **fields):
+    """
+    Atomically take amount from a user's balance and record the transaction.
+
+    Args:
+        user_id: Telegram user ID
+        amount: Amount in Tomans to take
+        reason: What the money is for (dns, vpn, ...)
+        transaction_id: Idempotency key; a transaction already applied under
+            this ID is not applied again
+        mutate: Optional callable run on a copy of the user record before it
+            is written, so related changes (e.g. a new config) land atomically
+        **fields: Extra fields stored on the transaction record
+
+    Returns:
+        LedgerResult: ok is False when the user is unknown or the balance is
+            insufficient
+    """
+    return _apply(user_id, -int(amount), reason, 'purchase', transaction_id, mutate, fields)
+
+def credit(user_id, amount, reason, transaction_id=None, mutate=None, **fields):
+    """Atomically add amount to a user's balance; see debit() for the arguments."""
+    return _apply(user_id, int(amount), reason, 'deposit', transaction_id, mutate, fields)
+
+def _apply(user_id, delta, reason, tx_type, transaction_id, mutate, fields):
+    user_key = str(user_id)
+    if transaction_id is None:
+        transaction_id = repository.generate_record_id()
+
+    result = None
+
+    def build_rows(image):
+        nonlocal result
+        user = image['users'].get(user_key)
+        if user is None:
+            logger.error(f"Ledger: user {user_key} not found")
+            result = LedgerResult(False, None, False)
+            return []
+        balance = int(user.get('balance', 0))
+
+        existing = image.get('transactions', {}).get(transaction_id)
+        if existing and existing.get('user_id') is not None and str(existing['user_id']) != user_key:
+            # Someone else's record; never treat it as ours or overwrite it
+            logger.error(f"Ledger: transaction {transaction_id} belongs to user {existing['user_id']}, not {user_key}")
+            result = LedgerResult(False, balance, False)
+            return []
+        if existing and existing.get('status') in APPLIED_STATUSES:
+            logger.info(f"Ledger: transaction {transaction_id} already applied, skipping")
+            result = LedgerResult(True, balance, True)
+            return []
+
+        if balance + delta < 0:
+            result = LedgerResult(False, balance, False)
+            return []
+
+        # Work on copies so readers never observe a half-applied change
+        new_user = dict(user)
+        new_user['balance'] = balance + delta
+        if mutate is not None:
+            mutate(new_user)
+
+        transaction = dict(existing or {})
+        transaction.update({
+            'user_id': int(user_id),
+            'amount': abs(delta),
+            'type': tx_type,
+            'reason': reason,
+            'status': 'completed'
+        })
+        # A pending record (e.g. a deposit awaiting approval) keeps its original time
+        transaction.setdefault('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        transaction.update(fields)
+
+        result = LedgerResult(True, new_user['balance'], False)
+        return [
+            ('users', user_key, thaw(new_user)),
+            ('transactions', transaction_id, thaw(transaction))
+        ]
+
+    # The stripe lock keeps retries of one user's transactions in line; the
+    # read, the checks and the write happen under the store lock, so no other
+    # write to the user can land in between
+    with _lock_for(user_key):
+        get_store().update(build_rows)
+
+    if result.ok and not result.duplicate:
+        logger.info(f"Ledger: {tx_type} {abs(delta)} for user {user_key} ({reason}), balance {result.balance}")
+    return result
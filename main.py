@@ -1,18 +1,18 @@
+import io
 import os
-import pickle
+import argparse
 import logging
-import ipaddress
 import random
 import string
 import telebot
 import base64
 import uuid
-import subprocess
-import time
 from telebot import types
 from datetime import datetime, timedelta
-from config import TOKEN, DATA_FILE, DNS_RANGES_FILE, FILES_DIR, TUTORIALS_DIR, default_data
-from ranges import default_dns_ranges
+from config import TOKEN, FILES_DIR, TUTORIALS_DIR, BOT_RUNTIME
+import repository
+import ledger
+from repository import RequestScopeMiddleware, load_data
 from file_handlers import (
     send_file_to_user, 
     get_file_uploader_keyboard, 
@@ -30,208 +30,157 @@ if not TOKEN:
     exit(1)
 
 # Initialize bot with optimized request threading
-bot = telebot.TeleBot(TOKEN, threaded=True, num_threads=4)
+bot = telebot.TeleBot(TOKEN, threaded=True, num_threads=4, use_class_middlewares=True)
+# Each update reads the store at most once
+bot.setup_middleware(RequestScopeMiddleware())
 
 # Create directories if they don't exist
 os.makedirs(FILES_DIR, exist_ok=True)
 os.makedirs(TUTORIALS_DIR, exist_ok=True)
 
-# Add simple caching to reduce disk IO
-_data_cache = None
-_last_loaded = 0
-_CACHE_TTL = 30  # Cache time-to-live in seconds
-
 # State storage
 admin_states = {}
 payment_states = {}
 file_editing_states = {}
 
-# Load data from pickle file with caching
-def load_data(force_reload=False):
-    global _data_cache, _last_loaded
-    current_time = time.time()
-
-    # Return cached data if available and not expired
-    if not force_reload and _data_cache is not None and (current_time - _last_loaded) < _CACHE_TTL:
-        return _data_cache.copy()  # برگرداندن یک کپی برای جلوگیری از تغییرات ناخواسته
-
-    try:
-        with open(DATA_FILE, 'rb') as f:
-            data = pickle.load(f)
-            _data_cache = data
-            _last_loaded = current_time
-            logger.info("Data loaded from file successfully")
-            return data
-    except (FileNotFoundError, EOFError) as e:
-        logger.warning(f"Error loading data file: {e}. Creating new data file")
-        with open(DATA_FILE, 'wb') as f:
-            pickle.dump(default_data, f)
-        _data_cache = default_data.copy()
-        _last_loaded = current_time
-        return _data_cache.copy()
-    except Exception as e:
-        logger.error(f"Unexpected error loading data: {e}")
-        # در صورت خطای غیرمنتظره، از داده‌های پیش‌فرض استفاده می‌کنیم
-        _data_cache = default_data.copy()
-        _last_loaded = current_time
-        return _data_cache.copy()
-
-# Save data to pickle file and update cache
-def save_data(data):
-    global _data_cache, _last_loaded
-    try:
-        # ابتدا یک فایل موقت ایجاد می‌کنیم
-        temp_file = f"{DATA_FILE}.temp"
-        with open(temp_file, 'wb') as f:
-            pickle.dump(data, f)
-            f.flush()
-            os.fsync(f.fileno())  # اطمینان از ذخیره فیزیکی داده‌ها
-        
-        # سپس فایل موقت را جایگزین فایل اصلی می‌کنیم
-        if os.path.exists(temp_file):
-            if os.path.exists(DATA_FILE):
-                os.replace(temp_file, DATA_FILE)
-            else:
-                os.rename(temp_file, DATA_FILE)
-        
-        _data_cache = data.copy()  # کپی برای جلوگیری از تغییرات ناخواسته
-        _last_loaded = time.time()
-        logger.info("Data saved successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving data: {e}")
-        return False
-
-# Load DNS ranges
-def load_dns_ranges():
-    try:
-        with open(DNS_RANGES_FILE, 'rb') as f:
-            return pickle.load(f)
-    except (FileNotFoundError, EOFError):
-        logger.info("Creating new DNS ranges file")
-        with open(DNS_RANGES_FILE, 'wb') as f:
-            pickle.dump(default_dns_ranges, f)
-        return default_dns_ranges
-
-# Save DNS ranges
-def save_dns_ranges(ranges):
-    with open(DNS_RANGES_FILE, 'wb') as f:
-        pickle.dump(ranges, f)
-
-# Generate random IP from CIDR
-def generate_random_ip(cidr):
-    try:
-        network = ipaddress.IPv4Network(cidr)
-        # Get a random IP from the network, avoiding network and broadcast addresses
-        max_index = network.num_addresses - 1
-        if max_index > 2:  # If network has more than 2 addresses (network + broadcast)
-            random_ip = str(network[random.randint(1, max_index - 1)])
-        else:
-            random_ip = str(network[1])  # Use the single usable address in a /31 or /32
-        return random_ip
-    except Exception as e:
-        logger.error(f"Error generating random IP from {cidr}: {e}")
-        return None
-
-# Generate random IPv6 from CIDR
-def generate_random_ipv6(cidr):
-    try:
-        network = ipaddress.IPv6Network(cidr)
-        # For IPv6, we use a more sophisticated approach to handle the large address space
-        # Convert network address to integer
-        network_int = int(network.network_address)
-        # Calculate a random offset within the network
-        # For very large networks, we'll limit to a reasonable range to avoid excessive memory usage
-        if network.prefixlen < 64:
-            # For networks larger than /64, generate random addresses within a limited range
-            max_offset = min(1000000, network.num_addresses - 1)
-        else:
-            # For smaller networks, we can use the full range
-            max_offset = network.num_addresses - 1
-
-        if max_offset > 1:
-            offset = random.randint(1, max_offset)
-            random_ip = str(ipaddress.IPv6Address(network_int + offset))
-        else:
-            # For single-address networks (/128)
-            random_ip = str(network.network_address)
-
-        return random_ip
-    except Exception as e:
-        logger.error(f"Error generating random IPv6 from {cidr}: {e}")
-        return None
-
 # Import WireGuard config module
 import WGconfig
+import ip_pool
+import allocations
+import config_pool
+import range_lookup
+import broadcast
+import outbox
+from router import CallbackRouter
 
 # Generate WireGuard keys
 def generate_wireguard_keys():
     # Use the function from the WGconfig module
     return WGconfig.generate_wireguard_keys()
 
-# Generate WireGuard config
-def generate_wireguard_config(location):
-    dns_ranges = load_dns_ranges()
+# Draw an address for a config
+def draw_address(location, version, owner=None):
+    """
+    Allocate an address no other config holds when owner (an allocation key
+    from allocations.new_owner()) is given, otherwise draw any address from
+    the location's ranges.
+    """
+    if owner is None:
+        return ip_pool.random_address(location, version)
+    return allocations.allocate(location, version, owner)
 
-    if location not in dns_ranges:
-        return None
+# Generate WireGuard config
+def generate_wireguard_config(location, owner=None):
+    """
+    Generate a WireGuard config for a location.
+
+    Args:
+        location: Location ID
+        owner: When given (see allocations.new_owner()), the endpoint and
+            client IPv6 address are allocated to it so no other customer gets
+            them; release them with allocations.release_owner(owner)
+
+    Returns:
+        str: The config text, or None if the location is unknown or has no
+            free addresses left
+    """
+    return generate_wireguard_configs(location, [owner])[0]
+
+def generate_wireguard_configs(location, owners):
+    """
+    Generate a batch of WireGuard configs for a location, with one batch of
+    keys and one template; see generate_wireguard_config().
+
+    Returns:
+        list: Config texts in the order of owners, None for any that failed
+    """
+    if location not in repository.dns_ranges_db():
+        return [None] * len(owners)
 
     # Generate keys
-    private_key, public_key = generate_wireguard_keys()
-
-    # Generate endpoint from the location's IP range
-    ipv4_ranges = dns_ranges[location]['ipv4']
-    endpoint = generate_random_ip(random.choice(ipv4_ranges))
-
-    # Generate DNS servers
-    primary_dns = WGconfig.CLIENT_DNS_PRIMARY
-    secondary_ipv4 = generate_random_ip(random.choice(dns_ranges[location]['ipv4']))
-    secondary_ipv6 = generate_random_ipv6(random.choice(dns_ranges[location]['ipv6']))
-    dns_servers = [primary_dns, secondary_ipv4, secondary_ipv6]
-
-    # Generate client addresses
-    client_ipv4 = WGconfig.CLIENT_IPV4_BASE
-    # Additional address
-    client_ipv4_add = f"{WGconfig.CLIENT_IPV4_ADDITIONAL_PREFIX}{random.randint(2, 254)}/32"
-    # Generate random IPv6 from location's IPv6 range
-    ipv6_ranges = dns_ranges[location]['ipv6']
-    client_ipv6_base = generate_random_ipv6(random.choice(ipv6_ranges))
-    # Format it as a client address with subnet
-    client_ipv6 = f"{client_ipv6_base}/64"
-
-    # Create config using the WGconfig module
-    config = WGconfig.create_wireguard_config(
-        private_key, 
-        public_key, 
-        endpoint, 
-        client_ipv4, 
-        client_ipv4_add, 
-        client_ipv6, 
-        dns_servers
-    )
-
-    return config
+    keypairs = WGconfig.generate_wireguard_keypairs(len(owners))
+
+    clients = []
+    # One SQLite transaction for every address the batch allocates
+    with allocations.batch():
+        for owner, (private_key, public_key) in zip(owners, keypairs):
+            # Generate endpoint from the location's IP range
+            endpoint = draw_address(location, 4, owner)
+
+            # Generate DNS servers
+            primary_dns = WGconfig.CLIENT_DNS_PRIMARY
+            secondary_ipv4 = ip_pool.random_address(location, 4)
+            secondary_ipv6 = ip_pool.random_address(location, 6)
+            dns_servers = [primary_dns, secondary_ipv4, secondary_ipv6]
+
+            # Generate client addresses
+            client_ipv4 = WGconfig.CLIENT_IPV4_BASE
+            # Additional address
+            client_ipv4_add = f"{WGconfig.CLIENT_IPV4_ADDITIONAL_PREFIX}{random.randint(2, 254)}/32"
+            # Generate random IPv6 from location's IPv6 range
+            client_ipv6_base = draw_address(location, 6, owner)
+            if endpoint is None or client_ipv6_base is None or None in dns_servers:
+                if owner is not None:
+                    allocations.release_owner(owner)
+                clients.append(None)
+                continue
+
+            clients.append({
+                'private_key': private_key,
+                'public_key': public_key,
+                'endpoint': endpoint,
+                'client_ipv4': client_ipv4,
+                'client_ipv4_add': client_ipv4_add,
+                # Format it as a client address with subnet
+                'client_ipv6': f"{client_ipv6_base}/64",
+                'dns_servers': dns_servers
+            })
+
+    # Render every config from the location's cached template
+    location_info = repository.get_location(location) or {}
+    rendered = iter(WGconfig.render_wireguard_configs(
+        [client for client in clients if client is not None],
+        location,
+        location_info.get('wireguard')
+    ))
+    return [next(rendered) if client is not None else None for client in clients]
 
 # Generate random DNS configuration
-def generate_dns_config(location):
-    data = load_data()
-    dns_ranges = load_dns_ranges()
-
-    if location not in dns_ranges:
+def generate_dns_config(location, allocate=False):
+    """
+    Generate a DNS config for a location.
+
+    Args:
+        location: Location ID
+        allocate: Allocate the addresses to the new config so no other
+            customer gets them; release them with
+            allocations.release_owner(config['allocation_id'])
+
+    Returns:
+        dict: The config, or None if the location is unknown or has no free
+            addresses left
+    """
+    if location not in repository.dns_ranges_db():
         return None
 
-    ipv4_ranges = dns_ranges[location]['ipv4']
-    ipv6_ranges = dns_ranges[location]['ipv6']
+    # Create a config with unique ID
+    config_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+    owner = allocations.new_owner() if allocate else None
 
-    # Generate one random IPv4 address
-    ipv4 = generate_random_ip(random.choice(ipv4_ranges))
+    # Addresses are drawn uniformly over all of the location's ranges,
+    # and written to the allocation table together
+    with allocations.batch():
+        # Generate one random IPv4 address
+        ipv4 = draw_address(location, 4, owner)
 
-    # Generate two random IPv6 addresses
-    ipv6_1 = generate_random_ipv6(random.choice(ipv6_ranges))
-    ipv6_2 = generate_random_ipv6(random.choice(ipv6_ranges))
+        # Generate two random IPv6 addresses
+        ipv6_1 = draw_address(location, 6, owner)
+        ipv6_2 = draw_address(location, 6, owner)
 
-    # Create a config with unique ID
-    config_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        if None in (ipv4, ipv6_1, ipv6_2):
+            if allocate:
+                allocations.release_owner(owner)
+            return None
 
     config = {
         'id': config_id,
@@ -241,14 +190,81 @@ def generate_dns_config(location):
         'location': location,
         'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
+    if allocate:
+        config['allocation_id'] = owner
 
     return config
 
+# Pre-generated configs
+def new_wireguard_config_id():
+    random_letter = random.choice(string.ascii_uppercase)
+    random_digits = ''.join(random.choices(string.digits, k=4))
+    return f"{random_letter}{random_digits}"
+
+# Pool items are (allocation owner, config) so dropped ones can be released
+def pregenerate_dns_config(location):
+    config = generate_dns_config(location, allocate=True)
+    return (config['allocation_id'] if config else None), config
+
+def pregenerate_dns_configs(location, count):
+    with allocations.batch():
+        return [pregenerate_dns_config(location) for _ in range(count)]
+
+def pregenerate_wireguard_configs(location, count):
+    owners = [allocations.new_owner() for _ in range(count)]
+    texts = generate_wireguard_configs(location, owners)
+    return [(owner, {'id': new_wireguard_config_id(), 'text': text} if text else None)
+            for owner, text in zip(owners, texts)]
+
+def take_dns_config(location):
+    """Pop a pre-generated DNS config with allocated addresses, or generate one if none is ready."""
+    item = config_pool.take('dns', location)
+    if item is None:
+        return generate_dns_config(location, allocate=True)
+    return dict(item[1], created_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+def take_wireguard_config(location):
+    """
+    Pop a pre-generated WireGuard config, or generate one if none is ready.
+
+    Returns:
+        tuple: (config_id, config_text, allocation_id); config_text is None
+            on failure
+    """
+    item = config_pool.take('vpn', location)
+    if item is None:
+        owner = allocations.new_owner()
+        return new_wireguard_config_id(), generate_wireguard_config(location, owner), owner
+    owner, config = item
+    return config['id'], config['text'], owner
+
+def start_config_pool():
+    config_pool.start({
+        'dns': pregenerate_dns_configs,
+        'vpn': pregenerate_wireguard_configs
+    })
+
+# Forget what was prepared from a location's old settings
+def location_changed(location_id):
+    """Call after an admin edits a location: its cached template and ready-made configs are dropped."""
+    WGconfig.invalidate_templates(location_id)
+    config_pool.invalidate(location_id)
+
+# Send a config as a .conf document straight from memory
+def send_config_file(chat_id, config_id, config_text, caption=None):
+    config_file = io.BytesIO(config_text.encode('utf-8'))
+    bot.send_document(
+        chat_id,
+        config_file,
+        visible_file_name=f"{config_id}.conf",
+        caption=caption
+    )
+
 # User management functions
 def register_user(user_id, username, first_name):
-    data = load_data()
-    if str(user_id) not in data['users']:
-        data['users'][str(user_id)] = {
+    user = repository.get_user(user_id)
+    if user is None:
+        user = {
             'username': username,
             'first_name': first_name,
             'balance': 0,
@@ -259,41 +275,43 @@ def register_user(user_id, username, first_name):
             'invited_by': None,
             'join_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
-        save_data(data)
-    return data['users'][str(user_id)]
+        repository.put_user(user_id, user)
+        user = repository.get_user(user_id)
+    elif user.get('bot_blocked'):
+        # They are talking to the bot again, so broadcasts may reach them
+        broadcast.mark_bot_unblocked(user_id)
+        user = repository.get_user(user_id)
+    return user
 
 def get_user(user_id):
-    data = load_data()
-    if str(user_id) in data['users']:
-        return data['users'][str(user_id)]
-    return None
+    return repository.get_user(user_id)
 
-def update_user_balance(user_id, amount):
-    data = load_data()
-    if str(user_id) in data['users']:
-        data['users'][str(user_id)]['balance'] += amount
-        save_data(data)
-        return True
-    return False
+def update_user_balance(user_id, amount, reason='admin'):
+    if amount >= 0:
+        result = ledger.credit(user_id, amount, reason)
+    else:
+        result = ledger.debit(user_id, -amount, reason)
+    return result.ok
+
+# Build a ledger mutation that adds a purchased config to the user record
+def append_user_config(key, config):
+    def mutate(user):
+        # Replace the list instead of appending so the previous record stays intact
+        user[key] = user.get(key, []) + [config]
+    return mutate
 
 def check_admin(user_id):
-    data = load_data()
-    # Make sure user_id is converted to integer for comparison
-    user_id_int = int(user_id)
-    # Ensure we're comparing the same data types (integers)
-    admin_ids = [int(admin_id) if isinstance(admin_id, str) else admin_id for admin_id in data['admins']]
-    is_admin = user_id_int in admin_ids
-    logger.info(f"Checking admin for user {user_id_int}: {is_admin}, admins: {admin_ids}")
+    is_admin = repository.is_admin(user_id)
+    logger.debug(f"Checking admin for user {user_id}: {is_admin}")
     return is_admin
 
 def add_admin(user_id):
-    data = load_data()
     user_id_int = int(user_id)
-    if user_id_int not in data['admins']:
+    with repository.transaction() as data:
+        if user_id_int in data['admins']:
+            return False
         data['admins'].append(user_id_int)
-        save_data(data)
-        return True
-    return False
+    return True
 
 # Generate main menu keyboard (inline)
 def get_main_keyboard(user_id=None):
@@ -318,10 +336,8 @@ def get_main_keyboard(user_id=None):
         }
         
         # Save default settings
-        if 'settings' not in data:
-            data['settings'] = {}
-        data['settings']['main_buttons'] = button_settings
-        save_data(data)
+        with repository.transaction() as draft:
+            draft.setdefault('settings', {})['main_buttons'] = button_settings
 
     # Create buttons based on settings
     buttons = []
@@ -392,7 +408,11 @@ from admin_functions import (
     generate_users_excel,
     process_add_new_server,
     get_user_purchase_history,
-    send_expiry_reminders
+    format_transactions_page,
+    get_history_pagination_keyboard,
+    send_expiry_reminders,
+    show_dns_ranges_admin,
+    show_dns_range_detail
 )
 
 # Generate admin menu keyboard
@@ -402,9 +422,8 @@ def get_admin_keyboard():
 # Generate locations keyboard for purchasing DNS or VPN
 def get_locations_keyboard(type_service):
     markup = types.InlineKeyboardMarkup(row_width=1)
-    data = load_data()
 
-    for loc_id, location in data['locations'].items():
+    for loc_id, location in repository.get_locations().items():
         if location['enabled']:
             btn = types.InlineKeyboardButton(
                 f"{location['name']} - {location['price']} تومان", 
@@ -421,8 +440,7 @@ def get_locations_keyboard(type_service):
 @bot.message_handler(commands=['start'])
 def welcome_message(message):
     # Check if user is blocked
-    data = load_data()
-    if message.from_user.id in data.get('blocked_users', []):
+    if repository.is_blocked(message.from_user.id):
         bot.send_message(
             message.chat.id,
             "⛔ حساب کاربری شما مسدود شده است. لطفاً برای اطلاعات بیشتر با پشتیبانی تماس بگیرید."
@@ -452,7 +470,7 @@ def welcome_message(message):
             logger.info(f"🔗 User {message.from_user.id} requested file with ID: {file_id}")
 
             # استفاده از send_file_to_user برای ارسال فایل
-            send_file_to_user(bot, message, file_id, load_data)
+            send_file_to_user(bot, message, file_id)
 
             # ایجاد دکمه برای رفتن به منوی اصلی
             markup = types.InlineKeyboardMarkup(row_width=1)
@@ -471,22 +489,23 @@ def welcome_message(message):
         # Check if it's a referral code
         ref_code = message.text.split()[1]
         if ref_code.startswith('REF') and ref_code != user['referral_code'] and not user['invited_by']:
-            data = load_data()
-            for uid, u_data in data['users'].items():
-                if u_data['referral_code'] == ref_code:
-                    # Add referral
-                    reward = data['settings']['referral_reward']
-                    data['users'][uid]['referrals'].append(str(message.from_user.id))
-                    data['users'][str(message.from_user.id)]['invited_by'] = uid
-                    # Add bonus to referrer
-                    data['users'][uid]['balance'] += reward
-                    save_data(data)
-                    bot.send_message(
-                        int(uid), 
-                        f"🎉 کاربر جدیدی با لینک دعوت شما وارد ربات شد!\n"
-                        f"مبلغ {reward} تومان به حساب شما اضافه شد."
-                    )
-                    break
+            uid = repository.get_user_id_by_referral_code(ref_code)
+            if uid is not None:
+                # Add referral
+                reward = repository.get_setting('referral_reward', 0)
+                repository.put_user(message.from_user.id, dict(user, invited_by=uid))
+                # Add bonus to referrer, at most once per invited user
+                ledger.credit(
+                    uid, reward, 'referral',
+                    transaction_id=f"REF{message.from_user.id}",
+                    mutate=append_user_config('referrals', str(message.from_user.id)),
+                    type='referral'
+                )
+                bot.send_message(
+                    int(uid), 
+                    f"🎉 کاربر جدیدی با لینک دعوت شما وارد ربات شد!\n"
+                    f"مبلغ {reward} تومان به حساب شما اضافه شد."
+                )
 
     welcome_text = (
         f"👋 سلام {message.from_user.first_name} عزیز!\n\n"
@@ -504,144 +523,150 @@ def welcome_message(message):
 
     bot.send_message(message.chat.id, welcome_text, reply_markup=get_main_keyboard(message.from_user.id))
 
+# Callback routes: exact callback data first, then the longest matching prefix.
+# Routes are registered once at import, below and next to the handlers they run
+callback_router = CallbackRouter(
+    is_admin=check_admin,
+    on_denied=lambda call: bot.answer_callback_query(call.id, "⛔️ شما به این بخش دسترسی ندارید!", show_alert=True)
+)
+
 # Main callback query handler
 @bot.callback_query_handler(func=lambda call: True)
 def callback_handler(call):
-    # Main menu actions
-    if call.data == "menu_account":
-        show_account_info(call.message, call.from_user.id)
-    elif call.data == "menu_buy_dns":
-        show_buy_dns_menu(call.message)
-    elif call.data == "menu_buy_vpn":
-        show_buy_vpn_menu(call.message)
-    elif call.data == "menu_referral":
-        show_referral_info(call.message, call.from_user.id)
-    elif call.data == "menu_tutorials":
-        show_tutorial_categories(call.message)
-    elif call.data == "menu_rules":
-        show_rules(call.message)
-    elif call.data == "show_main_menu":
-        welcome_new_user(call.message, call.from_user.id)
-    elif call.data == "back_to_main":
+    if not callback_router.dispatch(call):
+        bot.answer_callback_query(call.id, "⚠️ این قابلیت به زودی فعال خواهد شد.", show_alert=True)
+
+# Main menu actions
+callback_router.add("menu_account", lambda call: show_account_info(call.message, call.from_user.id))
+callback_router.add("menu_buy_dns", lambda call: show_buy_dns_menu(call.message))
+callback_router.add("menu_buy_vpn", lambda call: show_buy_vpn_menu(call.message))
+callback_router.add("menu_referral", lambda call: show_referral_info(call.message, call.from_user.id))
+callback_router.add("menu_tutorials", lambda call: show_tutorial_categories(call.message))
+callback_router.add("menu_rules", lambda call: show_rules(call.message))
+callback_router.add("show_main_menu", lambda call: welcome_new_user(call.message, call.from_user.id))
+callback_router.add("tutorials", lambda call: show_tutorial_categories(call.message))
+callback_router.add("submit_ticket", lambda call: handle_submit_ticket(call))
+callback_router.add("goto_account", lambda call: show_account_info(call.message, call.from_user.id))
+
+@callback_router.route("back_to_main")
+def back_to_main(call):
+    bot.edit_message_text(
+        "🏠 منوی اصلی",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_main_keyboard(call.from_user.id)
+    )
+
+@callback_router.route("tutorial_no_files")
+def tutorial_no_files(call):
+    # فقط پیام خطا نمایش دهیم
+    bot.answer_callback_query(call.id, "هنوز آموزشی برای این پلتفرم ضبط نشده است", show_alert=True)
+
+# Payment approval handlers
+@callback_router.route("approve_payment_", prefix=True, admin=True)
+def approve_payment(call):
+    request_id = call.data.replace("approve_payment_", "")
+    from admin_functions import handle_payment_approval
+    # ارسال پیامی که نشان دهد پردازش در حال انجام است
+    bot.answer_callback_query(call.id, "در حال پردازش درخواست...", show_alert=False)
+    
+    success = handle_payment_approval(bot, request_id, approved=True)
+    
+    if success:
         bot.edit_message_text(
-            "🏠 منوی اصلی",
+            f"✅ درخواست پرداخت با شناسه {request_id} با موفقیت تایید شد.",
             call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_main_keyboard(call.from_user.id)
+            call.message.message_id
         )
-    elif call.data == "tutorials":
-        show_tutorial_categories(call.message)
-    elif call.data == "tutorial_no_files":
-        # فقط پیام خطا نمایش دهیم
-        bot.answer_callback_query(call.id, "هنوز آموزشی برای این پلتفرم ضبط نشده است", show_alert=True)
-    elif call.data == "submit_ticket":
-        handle_submit_ticket(call)
-    # Payment approval handlers
-    elif call.data.startswith("approve_payment_") and check_admin(call.from_user.id):
-        request_id = call.data.replace("approve_payment_", "")
-        from admin_functions import handle_payment_approval
-        # ارسال پیامی که نشان دهد پردازش در حال انجام است
-        bot.answer_callback_query(call.id, "در حال پردازش درخواست...", show_alert=False)
-        
-        success = handle_payment_approval(bot, request_id, approved=True)
+        # بررسی دوباره وضعیت با لاگ کردن
+        payment_request = repository.get_payment_request(request_id)
+        if payment_request:
+            approved_user = repository.get_user(payment_request['user_id'])
+            if approved_user:
+                logging.info(f"After approval - User {payment_request['user_id']} balance: {approved_user.get('balance', 0)}")
         
-        if success:
-            bot.edit_message_text(
-                f"✅ درخواست پرداخت با شناسه {request_id} با موفقیت تایید شد.",
-                call.message.chat.id,
-                call.message.message_id
-            )
-            # بررسی دوباره وضعیت با لاگ کردن
-            data = load_data(force_reload=True)
-            if request_id in data.get('payment_requests', {}):
-                payment_request = data['payment_requests'][request_id]
-                user_id = payment_request['user_id']
-                user_id_str = str(user_id)
-                if user_id_str in data['users']:
-                    logging.info(f"After approval - User {user_id_str} balance: {data['users'][user_id_str].get('balance', 0)}")
-            
-            bot.answer_callback_query(call.id, "✅ پرداخت با موفقیت تایید شد!", show_alert=True)
-        else:
-            bot.answer_callback_query(call.id, "❌ خطا در پردازش درخواست", show_alert=True)
-    # Payment rejection handlers
-    elif call.data.startswith("reject_payment_") and check_admin(call.from_user.id):
-        request_id = call.data.replace("reject_payment_", "")
-        from admin_functions import handle_payment_approval
-        if handle_payment_approval(bot, request_id, approved=False):
-            bot.edit_message_text(
-                f"❌ درخواست پرداخت با شناسه {request_id} رد شد.",
-                call.message.chat.id,
-                call.message.message_id
-            )
-            bot.answer_callback_query(call.id, "❌ پرداخت رد شد!", show_alert=True)
-        else:
-            bot.answer_callback_query(call.id, "❌ خطا در پردازش درخواست", show_alert=True)
-    # Admin panel
-    elif call.data == "admin_panel":
-        if call.from_user.id and check_admin(call.from_user.id):
-            admin_text = (
-                "⚙️ پنل مدیریت\n\n"
-                "👨‍💻 خوش آمدید، ادمین گرامی!\n"
-                "لطفاً گزینه مورد نظر خود را انتخاب کنید:"
-            )
-            bot.edit_message_text(
-                admin_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=get_admin_keyboard()
-            )
-        else:
-            bot.answer_callback_query(call.id, "⛔️ شما به این بخش دسترسی ندارید!", show_alert=True)
-    # Buy services
-    elif call.data.startswith("buy_dns_"):
-        process_buy_dns(call)
-    elif call.data.startswith("buy_vpn_"):
-        process_buy_vpn(call)
-    elif call.data.startswith("confirm_vpn_"):
-        process_confirm_vpn(call)
-    # Payment
-    elif call.data == "add_balance":
-        process_add_balance(call)
-    elif call.data.startswith("payment_plan_"):
-        handle_payment_plan_selection(call)
-    elif call.data == "payment_custom":
-        handle_payment_custom(call)
-    # Admin file management handlers
-    elif call.data in ["list_files", "upload_photo", "upload_video", "upload_document", "create_share_link"] and check_admin(call.from_user.id):
-        process_admin_functions(call)
-    elif call.data.startswith("file_list_page_") and check_admin(call.from_user.id):
-        process_admin_functions(call)
-    # Other admin panel actions
-    elif call.data.startswith("admin_"):
-        process_admin_functions(call)
-    elif call.data.startswith("admin_file_") and check_admin(call.from_user.id):
-        file_id = call.data.replace("admin_file_", "")
-        show_file_management(call.message, file_id)
-    # File management actions
-    elif call.data.startswith("edit_file_") and check_admin(call.from_user.id):
-        process_admin_functions(call)
-    elif call.data.startswith("confirm_delete_file_") and check_admin(call.from_user.id):
-        process_admin_functions(call)
-    elif call.data.startswith("share_file_") and check_admin(call.from_user.id):
-        process_admin_functions(call)
-    # Tutorial actions
-    elif call.data.startswith("tutorial_"):
-        process_tutorial_actions(call)
-    elif call.data.startswith("file_"):
-        file_id = call.data.replace("file_", "")
-        send_file_to_user(bot, call.message, file_id, load_data)
-    elif call.data == "goto_account":
-        show_account_info(call.message, call.from_user.id)
-    elif call.data == "create_external_url":
-        handle_create_external_url(call)
-    # Handle external URL creation in the uploader
-    elif call.data == "create_external_url":
-        handle_create_external_url(call)
-    # Handle file replacement in the uploader
-    elif call.data == "replace_file":
-        handle_replace_file_selection(call)
+        bot.answer_callback_query(call.id, "✅ پرداخت با موفقیت تایید شد!", show_alert=True)
     else:
-        bot.answer_callback_query(call.id, "⚠️ این قابلیت به زودی فعال خواهد شد.", show_alert=True)
+        bot.answer_callback_query(call.id, "❌ خطا در پردازش درخواست", show_alert=True)
+
+# Payment rejection handlers
+@callback_router.route("reject_payment_", prefix=True, admin=True)
+def reject_payment(call):
+    request_id = call.data.replace("reject_payment_", "")
+    from admin_functions import handle_payment_approval
+    if handle_payment_approval(bot, request_id, approved=False):
+        bot.edit_message_text(
+            f"❌ درخواست پرداخت با شناسه {request_id} رد شد.",
+            call.message.chat.id,
+            call.message.message_id
+        )
+        bot.answer_callback_query(call.id, "❌ پرداخت رد شد!", show_alert=True)
+    else:
+        bot.answer_callback_query(call.id, "❌ خطا در پردازش درخواست", show_alert=True)
+
+# Admin panel
+@callback_router.route("admin_panel", admin=True)
+def show_admin_panel(call):
+    admin_text = (
+        "⚙️ پنل مدیریت\n\n"
+        "👨‍💻 خوش آمدید، ادمین گرامی!\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:"
+    )
+    bot.edit_message_text(
+        admin_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_admin_keyboard()
+    )
+
+# Buy services
+callback_router.add("buy_dns_", lambda call: process_buy_dns(call), prefix=True)
+callback_router.add("buy_vpn_", lambda call: process_buy_vpn(call), prefix=True)
+callback_router.add("confirm_vpn_", lambda call: process_confirm_vpn(call), prefix=True)
+# Payment
+callback_router.add("add_balance", lambda call: process_add_balance(call))
+callback_router.add("payment_plan_", lambda call: handle_payment_plan_selection(call), prefix=True)
+callback_router.add("payment_custom", lambda call: handle_payment_custom(call))
+# Admin file management
+callback_router.add("admin_file_", lambda call: show_file_management(call.message, call.data.replace("admin_file_", "")), prefix=True, admin=True)
+# Tutorial actions
+callback_router.add("tutorial_", lambda call: process_tutorial_actions(call), prefix=True)
+callback_router.add("file_", lambda call: send_file_to_user(bot, call.message, call.data.replace("file_", "")), prefix=True)
+# Transaction history
+callback_router.add("my_history_", lambda call: show_my_history(call.message, call.from_user.id, int(call.data.replace("my_history_", ""))), prefix=True)
+
+@callback_router.route("user_history_", prefix=True, admin=True)
+def show_user_history(call):
+    # user_history_<user_id>_<page>
+    target_id, page = call.data.replace("user_history_", "").rsplit("_", 1)
+    bot.edit_message_text(
+        get_user_purchase_history(target_id, int(page)),
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_history_pagination_keyboard(target_id, int(page), f"user_history_{target_id}_{{}}", "admin_users")
+    )
+
+# Broadcasts
+@callback_router.route("broadcast_all", admin=True)
+@callback_router.route("broadcast_active", admin=True)
+def ask_broadcast_message(call):
+    audience = call.data.replace("broadcast_", "")
+    admin_states[call.from_user.id] = {'state': 'waiting_broadcast_message', 'audience': audience}
+    bot.edit_message_text(
+        "📩 پیامی را که می‌خواهید برای " + ("همه کاربران" if audience == 'all' else "کاربران فعال") + " ارسال شود بفرستید.\n"
+        "متن، عکس، ویدیو یا فایل پذیرفته می‌شود. برای لغو /cancel را بزنید.",
+        call.message.chat.id,
+        call.message.message_id
+    )
+
+@callback_router.route("broadcast_cancel_", prefix=True, admin=True)
+def cancel_broadcast(call):
+    if broadcast.cancel(call.data.replace("broadcast_cancel_", "")):
+        bot.answer_callback_query(call.id, "🛑 ارسال در حال توقف است...")
+    else:
+        bot.answer_callback_query(call.id, "این ارسال در جریان نیست.")
+
+callback_router.add("dns_range_detail_", lambda call: show_dns_range_detail(call, call.data.replace("dns_range_detail_", "")), prefix=True, admin=True)
 
 # Function implementations
 def show_account_info(message, user_id):
@@ -649,8 +674,7 @@ def show_account_info(message, user_id):
     if not user:
         user = register_user(user_id, None, None)
 
-    data = load_data()
-    card_number = data['settings']['payment_card']
+    card_number = repository.get_setting('payment_card')
 
     account_text = (
         f"👤 اطلاعات حساب کاربری\n\n"
@@ -678,12 +702,21 @@ def show_account_info(message, user_id):
         for i, vpn in enumerate(user['wireguard_configs']):
             account_text += f"\n{i+1}. {vpn['location_name']} - {vpn['created_at']}\n"
 
+    # Add the latest transactions
+    recent = repository.get_user_transactions(user_id, limit=3)
+    if recent:
+        account_text += "\n\n💰 آخرین تراکنش‌ها:\n"
+        for tx_id, tx in recent:
+            account_text += f"\n• {tx.get('amount', 0)} تومان - {tx.get('timestamp', 'نامشخص')}"
+
     markup = types.InlineKeyboardMarkup(row_width=2)
     payment_btn = types.InlineKeyboardButton("💰 افزایش موجودی", callback_data="add_balance")
     ticket_btn = types.InlineKeyboardButton("🎫 ثبت تیکت", callback_data="submit_ticket")
+    history_btn = types.InlineKeyboardButton("📜 تاریخچه تراکنش‌ها", callback_data="my_history_0")
     back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")
 
     markup.add(payment_btn, ticket_btn)
+    markup.add(history_btn)
     markup.add(back_btn)
 
     bot.edit_message_text(
@@ -694,6 +727,15 @@ def show_account_info(message, user_id):
         parse_mode="HTML"
     )
 
+# Paginated transaction history of the current user
+def show_my_history(message, user_id, page=0):
+    bot.edit_message_text(
+        f"📜 تاریخچه تراکنش‌های شما\n{format_transactions_page(user_id, page)}",
+        message.chat.id,
+        message.message_id,
+        reply_markup=get_history_pagination_keyboard(user_id, page, "my_history_{}", "menu_account")
+    )
+
 # ساختارهای مربوط به سیستم تیکت
 ticket_states = {}
 
@@ -756,8 +798,7 @@ def show_referral_info(message, user_id):
     if not user:
         user = register_user(user_id, None, None)
 
-    data = load_data()
-    reward = data['settings']['referral_reward']
+    reward = repository.get_setting('referral_reward')
 
     bot_username = bot.get_me().username
     ref_link = f"https://t.me/{bot_username}?start={user['referral_code']}"
@@ -786,15 +827,13 @@ def show_referral_info(message, user_id):
 
 def process_buy_dns(call):
     location_id = call.data.replace("buy_dns_", "")
-    user = get_user(call.from_user.id)
-    data = load_data()
+    location = repository.get_location(location_id)
 
-    if location_id in data['locations'] and data['locations'][location_id]['enabled']:
-        location = data['locations'][location_id]
+    if location and location['enabled']:
         
         # پرسیدن کد تخفیف قبل از نهایی کردن خرید
         markup = types.InlineKeyboardMarkup(row_width=2)
-        yes_btn = types.InlineKeyboardButton("بله، کد تخفیف دارم", callback_data=f"has_discount_{location_id}")
+        yes_btn = types.InlineKeyboardButton("بله، کد تخفیف دارم", callback_data=f"has_discount_dns_{location_id}")
         no_btn = types.InlineKeyboardButton("خیر، ادامه خرید", callback_data=f"no_discount_dns_{location_id}")
         back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="menu_buy_dns")
         markup.add(yes_btn, no_btn)
@@ -810,84 +849,18 @@ def process_buy_dns(call):
         )
         return
         
-    # این بخش دیگر اجرا نمی‌شود زیرا تابع در بالا با return پایان می‌یابد
-    price = location['price']
-    if user['balance'] >= price:
-        # Generate DNS configuration
-        dns_config = generate_dns_config(location_id)
-
-        if dns_config:
-            # Deduct balance
-            user['balance'] -= price
-            # Add DNS to user's configs
-            user['dns_configs'].append(dns_config)
-            data['users'][str(call.from_user.id)] = user
-            save_data(data)
-
-            # Notify user about balance reduction
-            bot.send_message(
-                call.from_user.id,
-                f"💸 مبلغ {price} تومان بابت خرید DNS اختصاصی از حساب شما کسر شد.\n"
-                f"💰 موجودی فعلی: {user['balance']} تومان"
-            )
-
-            success_text = (
-                f"✅ خرید DNS اختصاصی با موفقیت انجام شد!\n\n"
-                f"🌏 موقعیت: {location['name']}\n"
-                f"💰 مبلغ پرداخت شده: {price} تومان\n"
-                f"🔢 شناسه پیکربندی: {dns_config['id']}\n\n"
-                f"🔰 اطلاعات DNS شما:\n\n"
-                f"IPv4: <code>{dns_config['ipv4']}</code>\n\n"
-                f"IPv6 اول: <code>{dns_config['ipv6_1']}</code>\n\n"
-                f"IPv6 دوم: <code>{dns_config['ipv6_2']}</code>\n\n"
-                f"📅 تاریخ خرید: {dns_config['created_at']}\n\n"
-                f"💻 آموزش استفاده از DNS را می‌توانید از بخش آموزش‌ها دریافت کنید."
-            )
-
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")
-            markup.add(back_btn)
-
-            bot.edit_message_text(
-                success_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=markup,
-                parse_mode="HTML"
-            )
-        else:
-            bot.answer_callback_query(call.id, "⚠️ خطا در تولید پیکربندی DNS. لطفاً با پشتیبانی تماس بگیرید.")
-    else:
-        insufficient_text = (
-            f"⚠️ موجودی ناکافی\n\n"
-            f"💰 موجودی فعلی شما: {user['balance']} تومان\n"
-            f"💰 مبلغ مورد نیاز: {price} تومان\n\n"
-            f"📝 برای افزایش موجودی به بخش 'حساب کاربری' مراجعه کنید."
-        )
-
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        account_btn = types.InlineKeyboardButton("👤 حساب کاربری", callback_data="goto_account")
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")
-        markup.add(account_btn, back_btn)
-
-        bot.edit_message_text(
-            insufficient_text,
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
+    # Location missing or disabled
+    bot.answer_callback_query(call.id, "⚠️ این سرور در حال حاضر در دسترس نیست.", show_alert=True)
 
 def process_buy_vpn(call):
     location_id = call.data.replace("buy_vpn_", "")
-    user = get_user(call.from_user.id)
-    data = load_data()
+    location = repository.get_location(location_id)
 
-    if location_id in data['locations'] and data['locations'][location_id]['enabled']:
-        location = data['locations'][location_id]
+    if location and location['enabled']:
         
         # پرسیدن کد تخفیف قبل از نهایی کردن خرید
         markup = types.InlineKeyboardMarkup(row_width=2)
-        yes_btn = types.InlineKeyboardButton("بله، کد تخفیف دارم", callback_data=f"has_discount_{location_id}")
+        yes_btn = types.InlineKeyboardButton("بله، کد تخفیف دارم", callback_data=f"has_discount_vpn_{location_id}")
         no_btn = types.InlineKeyboardButton("خیر، ادامه خرید", callback_data=f"no_discount_vpn_{location_id}")
         back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="menu_buy_vpn")
         markup.add(yes_btn, no_btn)
@@ -903,93 +876,53 @@ def process_buy_vpn(call):
         )
         return
         
-    # این بخش دیگر اجرا نمی‌شود زیرا تابع در بالا با return پایان می‌یابد
-    price = location['price']
-    if user['balance'] >= price:
-        # Ask for confirmation before purchase
-        confirm_text = (
-            f"🔰 تأیید خرید VPN اختصاصی\n\n"
-            f"🌏 موقعیت: {location['name']}\n"
-            f"💰 قیمت: {price} تومان\n"
-            f"💰 موجودی شما: {user['balance']} تومان\n\n"
-            f"آیا مطمئن هستید که می‌خواهید این سرویس را خریداری کنید؟"
-        )
-
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        confirm_btn = types.InlineKeyboardButton("✅ بله، خرید شود", callback_data=f"confirm_vpn_{location_id}")
-        cancel_btn = types.InlineKeyboardButton("❌ خیر، انصراف", callback_data="menu_buy_vpn")
-        markup.add(confirm_btn, cancel_btn)
-
-        bot.edit_message_text(
-            confirm_text,
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-    else:
-        insufficient_text = (
-            f"⚠️ موجودی ناکافی\n\n"
-            f"💰 موجودی فعلی شما: {user['balance']} تومان\n"
-            f"💰 مبلغ مورد نیاز: {price} تومان\n\n"
-            f"📝 برای افزایش موجودی به بخش 'حساب کاربری' مراجعه کنید."
-        )
-
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        account_btn = types.InlineKeyboardButton("👤 حساب کاربری", callback_data="goto_account")
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")
-        markup.add(account_btn, back_btn)
-
-        bot.edit_message_text(
-            insufficient_text,
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
+    # Location missing or disabled
+    bot.answer_callback_query(call.id, "⚠️ این سرور در حال حاضر در دسترس نیست.", show_alert=True)
 
 def process_confirm_vpn(call):
     location_id = call.data.replace("confirm_vpn_", "")
     user = get_user(call.from_user.id)
-    data = load_data()
+    location = repository.get_location(location_id)
 
-    if location_id in data['locations'] and data['locations'][location_id]['enabled']:
-        location = data['locations'][location_id]
+    if location and location['enabled']:
         price = location['price']
 
         if user['balance'] >= price:
-            # Generate WireGuard configuration
-            config_text = generate_wireguard_config(location_id)
+            # Take a ready-made WireGuard configuration with its addresses allocated
+            config_id, config_text, allocation_id = take_wireguard_config(location_id)
 
             if config_text:
-                # Create a unique file name with new format
-                random_letter = random.choice(string.ascii_uppercase)
-                random_digits = ''.join(random.choices(string.digits, k=4))
-                config_id = f"{random_letter}{random_digits}"
-                file_name = f"{config_id}.conf"
-
-                # Save config to a temporary file
-                with open(file_name, 'w') as f:
-                    f.write(config_text)
-
-                # Deduct balance
-                user['balance'] -= price
 
-                # Add config to user's wireguard_configs
                 vpn_config = {
                     'id': config_id,
+                    'allocation_id': allocation_id,
                     'location': location_id,
                     'location_name': location['name'],
                     'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 }
 
-                user['wireguard_configs'].append(vpn_config)
-                data['users'][str(call.from_user.id)] = user
-                save_data(data)
+                # Deduct balance and add config to user's wireguard_configs in one step
+                result = ledger.debit(
+                    call.from_user.id, price, 'vpn',
+                    transaction_id=ledger.transaction_id_for(call.id),
+                    mutate=append_user_config('wireguard_configs', vpn_config),
+                    item='vpn',
+                    location=location_id
+                )
+                if result.duplicate or not result.ok:
+                    # The purchase did not go through; free the addresses drawn for it
+                    allocations.release_owner(allocation_id)
+                if result.duplicate:
+                    return
+                if not result.ok:
+                    bot.answer_callback_query(call.id, "⚠️ موجودی ناکافی!")
+                    return
 
                 # Notify user about balance reduction
                 bot.send_message(
                     call.from_user.id,
                     f"💸 مبلغ {price} تومان بابت خرید VPN اختصاصی از حساب شما کسر شد.\n"
-                    f"💰 موجودی فعلی: {user['balance']} تومان"
+                    f"💰 موجودی فعلی: {result.balance} تومان"
                 )
 
                 # Success message
@@ -1015,15 +948,12 @@ def process_confirm_vpn(call):
                 )
 
                 # Then send the config file
-                with open(file_name, 'rb') as f:
-                    bot.send_document(
-                        call.message.chat.id,
-                        f,
-                        caption=f"🔒 فایل پیکربندی VPN اختصاصی - {location['name']}"
-                    )
-
-                # Remove temporary file
-                os.remove(file_name)
+                send_config_file(
+                    call.message.chat.id,
+                    config_id,
+                    config_text,
+                    caption=f"🔒 فایل پیکربندی VPN اختصاصی - {location['name']}"
+                )
             else:
                 bot.answer_callback_query(call.id, "⚠️ خطا در تولید پیکربندی VPN. لطفاً با پشتیبانی تماس بگیرید.")
         else:
@@ -1063,8 +993,7 @@ def handle_payment_plan_selection(call):
     amount = int(call.data.replace("payment_plan_", ""))
     payment_states[call.from_user.id] = {'state': 'waiting_receipt', 'amount': amount}
 
-    data = load_data()
-    card_number = data['settings']['payment_card']
+    card_number = repository.get_setting('payment_card')
 
     markup = types.InlineKeyboardMarkup(row_width=1)
     cancel_btn = types.InlineKeyboardButton("❌ انصراف", callback_data="back_to_main")
@@ -1142,9 +1071,9 @@ def show_tutorial_files(message, category_id, admin_mode=False):
         )
 
 def get_tutorial_category_title(category_id):
-    data = load_data()
-    if category_id in data['tutorials']:
-        return data['tutorials'][category_id]['title']
+    category = repository.get_tutorial(category_id)
+    if category:
+        return category['title']
     return "دسته‌بندی نامشخص"
 
 def get_tutorial_device_keyboard(category_id):
@@ -1291,6 +1220,102 @@ def admin_panel(message):
 
     bot.send_message(message.chat.id, admin_text, reply_markup=get_admin_keyboard())
 
+# Admin enters a user ID to see their purchase history
+@bot.message_handler(func=lambda message: message.from_user.id in admin_states and admin_states[message.from_user.id].get('state') == 'waiting_user_id_for_history')
+def handle_history_user_id(message):
+    if not check_admin(message.from_user.id) or message.text == '/cancel':
+        return cancel_command(message)
+
+    target_id = message.text.strip()
+    if not target_id.isdigit():
+        bot.send_message(message.chat.id, "❌ شناسه کاربر باید عددی باشد. دوباره وارد کنید یا /cancel را بزنید.")
+        return
+
+    del admin_states[message.from_user.id]
+    bot.send_message(
+        message.chat.id,
+        get_user_purchase_history(target_id),
+        reply_markup=get_history_pagination_keyboard(target_id, 0, f"user_history_{target_id}_{{}}", "admin_users")
+    )
+
+# Admin IP lookup: which location and range an address belongs to
+@bot.message_handler(commands=['iplookup'])
+def iplookup_command(message):
+    if not check_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "⛔️ شما به این دستور دسترسی ندارید!")
+        return
+
+    addresses = range_lookup.parse_addresses(message.text.partition(' ')[2])
+    if addresses:
+        send_iplookup_results(message.chat.id, addresses)
+        return
+
+    admin_states[message.from_user.id] = {'state': 'waiting_iplookup_addresses'}
+    bot.send_message(
+        message.chat.id,
+        "🔎 آدرس‌های IP را ارسال کنید (هر خط یک آدرس، یا جدا شده با فاصله).\n"
+        "برای لغو /cancel را بزنید."
+    )
+
+@bot.message_handler(func=lambda message: message.from_user.id in admin_states and admin_states[message.from_user.id].get('state') == 'waiting_iplookup_addresses')
+def handle_iplookup_addresses(message):
+    if not check_admin(message.from_user.id) or message.text == '/cancel':
+        return cancel_command(message)
+
+    del admin_states[message.from_user.id]
+    send_iplookup_results(message.chat.id, range_lookup.parse_addresses(message.text or ''))
+
+def send_iplookup_results(chat_id, addresses):
+    lines = []
+    found = 0
+    for address, result in range_lookup.lookup_many(addresses):
+        if result is False:
+            lines.append(f"{address} → ❌ آدرس نامعتبر")
+        elif result is None:
+            lines.append(f"{address} → ❔ در هیچ رنجی نیست")
+        else:
+            found += 1
+            lines.append(f"{address} → {result[0]} ({result[1]})")
+
+    summary = f"🔎 نتیجه جستجو: {found} از {len(addresses)} آدرس پیدا شد."
+    text = summary + "\n\n" + "\n".join(lines)
+    # Long results (e.g. thousands of pasted addresses) go out as a file
+    if len(text) > 4000:
+        bot.send_document(
+            chat_id,
+            io.BytesIO("\n".join(lines).encode('utf-8')),
+            visible_file_name="iplookup.txt",
+            caption=summary
+        )
+    else:
+        bot.send_message(chat_id, text)
+
+# Admin debugging: the callback route table
+@bot.message_handler(commands=['routes'])
+def routes_command(message):
+    if not check_admin(message.from_user.id):
+        bot.send_message(message.chat.id, "⛔️ شما به این دستور دسترسی ندارید!")
+        return
+
+    bot.send_document(
+        message.chat.id,
+        io.BytesIO(callback_router.dump().encode('utf-8')),
+        visible_file_name="routes.txt",
+        caption=f"🧭 {len(callback_router.routes())} مسیر دکمه ثبت شده است."
+    )
+
+# Admin sends the message to broadcast
+@bot.message_handler(content_types=['text', 'photo', 'video', 'document', 'audio', 'voice', 'animation'],
+                     func=lambda message: message.from_user.id in admin_states and admin_states[message.from_user.id].get('state') == 'waiting_broadcast_message')
+def handle_broadcast_message(message):
+    if not check_admin(message.from_user.id) or message.text == '/cancel':
+        return cancel_command(message)
+
+    audience = admin_states.pop(message.from_user.id)['audience']
+    job = broadcast.start(bot, audience, message.chat.id, message.message_id, message.chat.id)
+    if job is None:
+        bot.send_message(message.chat.id, "⚠️ یک ارسال گروهی دیگر در جریان است. لطفاً تا پایان آن صبر کنید.")
+
 # Cancel command for state handlers
 @bot.message_handler(commands=['cancel'])
 def cancel_command(message):
@@ -1310,589 +1335,623 @@ def cancel_command(message):
 
     bot.send_message(message.chat.id, "❌ عملیاتی برای لغو کردن وجود ندارد.")
 
-# Process admin functions - complete version
-def process_admin_functions(call):
-    admin_actions = {
-        # Menu navigation actions
-        "admin_back": lambda: bot.edit_message_text(
-            "⚙️ پنل مدیریت\n\n"
-            "👨‍💻 خوش آمدید، ادمین گرامی!\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_admin_keyboard()
-        ),
-        "admin_file_uploader": lambda: bot.edit_message_text(
-            "📤 آپلودر فایل\n\n"
-            "لطفاً نوع فایل برای آپلود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_file_uploader_keyboard()
-        ),
-        "create_external_url": lambda: handle_create_external_url(call),
-        "replace_file": lambda: handle_replace_file_selection(call),
-        # User management
-        "admin_users": lambda: bot.edit_message_text(
-            "👥 مدیریت کاربران\n\n"
-            "از طریق این بخش می‌توانید کاربران را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_advanced_users_management_keyboard()
-        ),
-        # Server management
-        "admin_servers": lambda: bot.edit_message_text(
-            "🌐 مدیریت سرورها\n\n"
-            "از طریق این بخش می‌توانید سرورها را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_advanced_server_management_keyboard()
-        ),
-        # Payment settings
-        "admin_payment_settings": lambda: bot.edit_message_text(
-            "💳 تنظیمات پرداخت\n\n"
-            "از طریق این بخش می‌توانید تنظیمات پرداخت را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
-                types.InlineKeyboardButton("💳 تغییر شماره کارت", callback_data="change_card_number"),
-                types.InlineKeyboardButton("💰 تنظیم مبلغ رفرال", callback_data="set_referral_amount"),
-                types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
-            )
-        ),
-        # Stats and reports
-        "admin_stats": lambda: bot.edit_message_text(
-            "📈 آمار و گزارش\n\n"
-            "از طریق این بخش می‌توانید آمار و گزارش‌ها را مشاهده کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
-                types.InlineKeyboardButton("👥 آمار کاربران", callback_data="user_stats"),
-                types.InlineKeyboardButton("💰 آمار مالی", callback_data="financial_stats"),
-                types.InlineKeyboardButton("📊 نمودار فروش", callback_data="sales_chart"),
-                types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
-            )
-        ),
-        # Ticket management
-        "admin_tickets": lambda: bot.edit_message_text(
-            "🎫 مدیریت تیکت‌ها\n\n"
-            "از طریق این بخش می‌توانید تیکت‌ها را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_ticket_management_keyboard()
-        ),
-        # Broadcast messages
-        "admin_broadcast": lambda: bot.edit_message_text(
-            "📩 ارسال پیام گروهی\n\n"
-            "از طریق این بخش می‌توانید به تمامی کاربران پیام ارسال کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
-                types.InlineKeyboardButton("📩 ارسال پیام به همه", callback_data="broadcast_all"),
-                types.InlineKeyboardButton("📩 ارسال پیام به کاربران فعال", callback_data="broadcast_active"),
-                types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
-            )
-        ),
-        # Discount codes
-        "admin_discount": lambda: bot.edit_message_text(
-            "🏷️ کدهای تخفیف\n\n"
-            "از طریق این بخش می‌توانید کدهای تخفیف را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_enhanced_discount_keyboard()
-        ),
-        # Referral settings
-        "admin_referral": lambda: bot.edit_message_text(
-            "🔄 تنظیم رفرال\n\n"
-            "از طریق این بخش می‌توانید سیستم دعوت از دوستان را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
-                types.InlineKeyboardButton("💰 تنظیم پاداش دعوت", callback_data="set_referral_reward"),
-                types.InlineKeyboardButton("📊 آمار رفرال‌ها", callback_data="referral_stats"),
-                types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
-            )
-        ),
-        # Transactions
-        "admin_transactions": lambda: bot.edit_message_text(
-            "💹 تراکنش‌ها\n\n"
-            "از طریق این بخش می‌توانید تراکنش‌ها را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_transaction_management_keyboard()
-        ),
-        # Service management
-        "admin_services": lambda: bot.edit_message_text(
-            "⏱️ مدیریت سرویس‌ها\n\n"
-            "از طریق این بخش می‌توانید سرویس‌ها را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_service_management_keyboard()
-        ),
-        # Add admin
-        "admin_add_admin": lambda: handle_add_admin(call),
-        # Blocked users
-        "admin_blocked_users": lambda: bot.edit_message_text(
-            "🚫 کاربران مسدود\n\n"
-            "از طریق این بخش می‌توانید کاربران مسدود را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
-                types.InlineKeyboardButton("🚫 مسدودسازی کاربر", callback_data="block_user"),
-                types.InlineKeyboardButton("✅ رفع مسدودیت کاربر", callback_data="unblock_user"),
-                types.InlineKeyboardButton("📋 لیست کاربران مسدود", callback_data="list_blocked_users"),
-                types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
-            )
-        ),
-        # Export Excel
-        "admin_export_excel": lambda: bot.edit_message_text(
-            "📊 گزارش اکسل\n\n"
-            "از طریق این بخش می‌توانید گزارش‌های اکسل دریافت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_excel_export_keyboard()
-        ),
-        # Tutorials
-        "admin_tutorials": lambda: show_tutorial_categories(call.message, admin_mode=True),
-        # Button management
-        "admin_buttons": lambda: bot.edit_message_text(
-            "🔘 مدیریت دکمه‌ها\n\n"
-            "از طریق این بخش می‌توانید دکمه‌های منوها را مدیریت کنید.\n"
-            "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=get_buttons_management_keyboard()
-        ),
-        # File Listing and Management
-        "list_files": lambda: show_file_list(call.message),
-        # Upload handlers
-        "upload_photo": lambda: handle_upload_request(call, "photo"),
-        "upload_video": lambda: handle_upload_request(call, "video"),
-        "upload_document": lambda: handle_upload_request(call, "document"),
-        # Create share link
-        "create_share_link": lambda: handle_create_share_link(call),
-    }
-
-    # آپلودر فایل و مدیریت فایل‌ها
-    if call.data in ["list_files", "upload_photo", "upload_video", "upload_document", "create_share_link"]:
-        admin_actions[call.data]()
-        return
-
-    # Handle file page navigation
-    if call.data.startswith("file_list_page_"):
-        page = int(call.data.replace("file_list_page_", ""))
-        data = load_data()
-        file_ids = list(data['uploaded_files'].keys())
-        files_per_page = 5
-        markup = get_file_list_keyboard(file_ids, page, files_per_page)
-        bot.edit_message_text(
-            "📋 لیست فایل‌ها\n\n"
-            "فایل‌های آپلود شده:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
+# Admin panel screens and actions, all admin only
+admin_actions = {
+    # Menu navigation actions
+    "admin_back": lambda call: bot.edit_message_text(
+        "⚙️ پنل مدیریت\n\n"
+        "👨‍💻 خوش آمدید، ادمین گرامی!\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_admin_keyboard()
+    ),
+    "admin_file_uploader": lambda call: bot.edit_message_text(
+        "📤 آپلودر فایل\n\n"
+        "لطفاً نوع فایل برای آپلود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_file_uploader_keyboard()
+    ),
+    "create_external_url": lambda call: handle_create_external_url(call),
+    "replace_file": lambda call: handle_replace_file_selection(call),
+    # DNS ranges
+    "admin_dns_ranges": lambda call: show_dns_ranges_admin(call),
+    # User management
+    "admin_users": lambda call: bot.edit_message_text(
+        "👥 مدیریت کاربران\n\n"
+        "از طریق این بخش می‌توانید کاربران را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_advanced_users_management_keyboard()
+    ),
+    # Server management
+    "admin_servers": lambda call: bot.edit_message_text(
+        "🌐 مدیریت سرورها\n\n"
+        "از طریق این بخش می‌توانید سرورها را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_advanced_server_management_keyboard()
+    ),
+    # Payment settings
+    "admin_payment_settings": lambda call: bot.edit_message_text(
+        "💳 تنظیمات پرداخت\n\n"
+        "از طریق این بخش می‌توانید تنظیمات پرداخت را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
+            types.InlineKeyboardButton("💳 تغییر شماره کارت", callback_data="change_card_number"),
+            types.InlineKeyboardButton("💰 تنظیم مبلغ رفرال", callback_data="set_referral_amount"),
+            types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
         )
-        return
-
-    # Handle user list pagination
-    if call.data.startswith("user_list_page_"):
-        page = int(call.data.replace("user_list_page_", ""))
-        show_user_list(call.message, page)
-        return
-
-    # Process edit file requests
-    if call.data.startswith("admin_edit_file_"):
-        file_id = call.data.replace("admin_edit_file_", "")
-        handle_edit_file_request(call, file_id)
-        return
-
-    # Process delete file requests
-    if call.data.startswith("admin_delete_file_"):
-        file_id = call.data.replace("admin_delete_file_", "")
-        handle_delete_file_request(call, file_id)
-        return
-
-    # Process share file requests
-    if call.data.startswith("share_file_"):
-        file_id = call.data.replace("share_file_", "")
-        handle_share_file_request(call, file_id)
-        return
-
-    # Confirm delete file
-    if call.data.startswith("confirm_delete_file_"):
-        file_id = call.data.replace("confirm_delete_file_", "")
-        data = load_data()
-        if file_id in data.get('uploaded_files', {}):
-            # Delete file from filesystem
-            file_path = os.path.join(FILES_DIR, file_id)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-
-            # Delete file from data
-            del data['uploaded_files'][file_id]
-            save_data(data)
+    ),
+    # Stats and reports
+    "admin_stats": lambda call: bot.edit_message_text(
+        "📈 آمار و گزارش\n\n"
+        "از طریق این بخش می‌توانید آمار و گزارش‌ها را مشاهده کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
+            types.InlineKeyboardButton("👥 آمار کاربران", callback_data="user_stats"),
+            types.InlineKeyboardButton("💰 آمار مالی", callback_data="financial_stats"),
+            types.InlineKeyboardButton("📊 نمودار فروش", callback_data="sales_chart"),
+            types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
+        )
+    ),
+    # Ticket management
+    "admin_tickets": lambda call: bot.edit_message_text(
+        "🎫 مدیریت تیکت‌ها\n\n"
+        "از طریق این بخش می‌توانید تیکت‌ها را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_ticket_management_keyboard()
+    ),
+    # Broadcast messages
+    "admin_broadcast": lambda call: bot.edit_message_text(
+        "📩 ارسال پیام گروهی\n\n"
+        "از طریق این بخش می‌توانید به تمامی کاربران پیام ارسال کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
+            types.InlineKeyboardButton("📩 ارسال پیام به همه", callback_data="broadcast_all"),
+            types.InlineKeyboardButton("📩 ارسال پیام به کاربران فعال", callback_data="broadcast_active"),
+            types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
+        )
+    ),
+    # Discount codes
+    "admin_discount": lambda call: bot.edit_message_text(
+        "🏷️ کدهای تخفیف\n\n"
+        "از طریق این بخش می‌توانید کدهای تخفیف را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_enhanced_discount_keyboard()
+    ),
+    # Referral settings
+    "admin_referral": lambda call: bot.edit_message_text(
+        "🔄 تنظیم رفرال\n\n"
+        "از طریق این بخش می‌توانید سیستم دعوت از دوستان را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
+            types.InlineKeyboardButton("💰 تنظیم پاداش دعوت", callback_data="set_referral_reward"),
+            types.InlineKeyboardButton("📊 آمار رفرال‌ها", callback_data="referral_stats"),
+            types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
+        )
+    ),
+    # Transactions
+    "admin_transactions": lambda call: bot.edit_message_text(
+        "💹 تراکنش‌ها\n\n"
+        "از طریق این بخش می‌توانید تراکنش‌ها را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_transaction_management_keyboard()
+    ),
+    # Service management
+    "admin_services": lambda call: bot.edit_message_text(
+        "⏱️ مدیریت سرویس‌ها\n\n"
+        "از طریق این بخش می‌توانید سرویس‌ها را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_service_management_keyboard()
+    ),
+    # Add admin
+    "admin_add_admin": lambda call: handle_add_admin(call),
+    # Blocked users
+    "admin_blocked_users": lambda call: bot.edit_message_text(
+        "🚫 کاربران مسدود\n\n"
+        "از طریق این بخش می‌توانید کاربران مسدود را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=types.InlineKeyboardMarkup(row_width=1).add(
+            types.InlineKeyboardButton("🚫 مسدودسازی کاربر", callback_data="block_user"),
+            types.InlineKeyboardButton("✅ رفع مسدودیت کاربر", callback_data="unblock_user"),
+            types.InlineKeyboardButton("📋 لیست کاربران مسدود", callback_data="list_blocked_users"),
+            types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")
+        )
+    ),
+    # Export Excel
+    "admin_export_excel": lambda call: bot.edit_message_text(
+        "📊 گزارش اکسل\n\n"
+        "از طریق این بخش می‌توانید گزارش‌های اکسل دریافت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_excel_export_keyboard()
+    ),
+    # Tutorials
+    "admin_tutorials": lambda call: show_tutorial_categories(call.message, admin_mode=True),
+    # Button management
+    "admin_buttons": lambda call: bot.edit_message_text(
+        "🔘 مدیریت دکمه‌ها\n\n"
+        "از طریق این بخش می‌توانید دکمه‌های منوها را مدیریت کنید.\n"
+        "لطفاً گزینه مورد نظر خود را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=get_buttons_management_keyboard()
+    ),
+    # File Listing and Management
+    "list_files": lambda call: show_file_list(call.message),
+    # Upload handlers
+    "upload_photo": lambda call: handle_upload_request(call, "photo"),
+    "upload_video": lambda call: handle_upload_request(call, "video"),
+    "upload_document": lambda call: handle_upload_request(call, "document"),
+    # Create share link
+    "create_share_link": lambda call: handle_create_share_link(call),
+}
+for data, handler in admin_actions.items():
+    callback_router.add(data, handler, admin=True)
+
+# Handle file page navigation
+@callback_router.route("file_list_page_", prefix=True, admin=True)
+def show_file_list_page(call):
+    page = int(call.data.replace("file_list_page_", ""))
+    data = load_data()
+    file_ids = list(data['uploaded_files'].keys())
+    files_per_page = 5
+    markup = get_file_list_keyboard(file_ids, page, files_per_page)
+    bot.edit_message_text(
+        "📋 لیست فایل‌ها\n\n"
+        "فایل‌های آپلود شده:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
 
-            bot.edit_message_text(
-                "✅ فایل با موفقیت حذف شد.",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=types.InlineKeyboardMarkup().add(
-                    types.InlineKeyboardButton("🔙 بازگشت به لیست", callback_data="list_files")
-                )
-            )
-        else:
-            bot.answer_callback_query(call.id, "فایل مورد نظر یافت نشد!", show_alert=True)
-        return
+# Handle user list pagination
+@callback_router.route("user_list_page_", prefix=True, admin=True)
+def show_user_list_page(call):
+    page = int(call.data.replace("user_list_page_", ""))
+    show_user_list(call.message, page)
+
+# Process edit file requests
+@callback_router.route("admin_edit_file_", prefix=True, admin=True)
+def admin_edit_file(call):
+    file_id = call.data.replace("admin_edit_file_", "")
+    handle_edit_file_request(call, file_id)
+
+# Process delete file requests
+@callback_router.route("admin_delete_file_", prefix=True, admin=True)
+def admin_delete_file(call):
+    file_id = call.data.replace("admin_delete_file_", "")
+    handle_delete_file_request(call, file_id)
+
+# Process share file requests
+@callback_router.route("share_file_", prefix=True, admin=True)
+def share_file(call):
+    file_id = call.data.replace("share_file_", "")
+    handle_share_file_request(call, file_id)
+
+# Confirm delete file
+@callback_router.route("confirm_delete_file_", prefix=True, admin=True)
+def confirm_delete_file(call):
+    file_id = call.data.replace("confirm_delete_file_", "")
+    data = load_data()
+    if file_id in data.get('uploaded_files', {}):
+        # Delete file from filesystem
+        file_path = os.path.join(FILES_DIR, file_id)
+        if os.path.exists(file_path):
+            os.remove(file_path)
 
-    # Process Edit file title
-    if call.data.startswith("edit_file_title_"):
-        file_id = call.data.replace("edit_file_title_", "")
-        admin_states[call.from_user.id] = {'state': 'editing_file_title', 'file_id': file_id}
+        # Delete file from data
+        with repository.transaction() as draft:
+            del draft['uploaded_files'][file_id]
 
         bot.edit_message_text(
-            "✏️ ویرایش عنوان فایل\n\n"
-            "لطفاً عنوان جدید را وارد کنید:",
+            "✅ فایل با موفقیت حذف شد.",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=types.InlineKeyboardMarkup().add(
-                types.InlineKeyboardButton("🔙 بازگشت", callback_data=f"admin_file_{file_id}")
+                types.InlineKeyboardButton("🔙 بازگشت به لیست", callback_data="list_files")
             )
         )
-        return
+    else:
+        bot.answer_callback_query(call.id, "فایل مورد نظر یافت نشد!", show_alert=True)
 
-    # Process Edit file content
-    if call.data.startswith("edit_file_content_"):
-        file_id = call.data.replace("edit_file_content_", "")
-        admin_states[call.from_user.id] = {'state': 'editing_file_content', 'file_id': file_id}
+# Process Edit file title
+@callback_router.route("edit_file_title_", prefix=True, admin=True)
+def edit_file_title(call):
+    file_id = call.data.replace("edit_file_title_", "")
+    admin_states[call.from_user.id] = {'state': 'editing_file_title', 'file_id': file_id}
 
-        bot.edit_message_text(
-            "📝 ویرایش محتوای فایل\n\n"
-            "لطفاً فایل جدید را ارسال کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=types.InlineKeyboardMarkup().add(
-                types.InlineKeyboardButton("🔙 بازگشت", callback_data=f"admin_file_{file_id}")
-            )
+    bot.edit_message_text(
+        "✏️ ویرایش عنوان فایل\n\n"
+        "لطفاً عنوان جدید را وارد کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=types.InlineKeyboardMarkup().add(
+            types.InlineKeyboardButton("🔙 بازگشت", callback_data=f"admin_file_{file_id}")
         )
-        return
-
-    # Process Excel export requests
-    if call.data == "export_users_excel":
-        generate_users_excel(bot, call.message.chat.id)
-        bot.answer_callback_query(call.id, "✅ گزارش کاربران تولید شد و به زودی ارسال می‌شود.", show_alert=True)
-        return
+    )
 
-    if call.data == "export_transactions_excel":
-        generate_transactions_excel(bot, call.message.chat.id)
-        bot.answer_callback_query(call.id, "✅ گزارش تراکنش‌ها تولید شد و به زودی ارسال می‌شود.", show_alert=True)
-        return
+# Process Edit file content
+@callback_router.route("edit_file_content_", prefix=True, admin=True)
+def edit_file_content(call):
+    file_id = call.data.replace("edit_file_content_", "")
+    admin_states[call.from_user.id] = {'state': 'editing_file_content', 'file_id': file_id}
 
-    # Check if the action is defined
-    if call.data in admin_actions:
-        admin_actions[call.data]()
-    # Handle buttons management
-    elif call.data == "admin_buttons":
-        markup = get_buttons_management_keyboard()
-        bot.edit_message_text(
-            "🔘 مدیریت دکمه‌ها\n\n"
-            "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
+    bot.edit_message_text(
+        "📝 ویرایش محتوای فایل\n\n"
+        "لطفاً فایل جدید را ارسال کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=types.InlineKeyboardMarkup().add(
+            types.InlineKeyboardButton("🔙 بازگشت", callback_data=f"admin_file_{file_id}")
         )
-        return
-    elif call.data == "manage_main_buttons":
+    )
+
+# Process Excel export requests
+@callback_router.route("export_users_excel", admin=True)
+def export_users_excel(call):
+    generate_users_excel(bot, call.message.chat.id)
+    bot.answer_callback_query(call.id, "✅ گزارش کاربران تولید شد و به زودی ارسال می‌شود.", show_alert=True)
+
+@callback_router.route("export_transactions_excel", admin=True)
+def export_transactions_excel(call):
+    generate_transactions_excel(bot, call.message.chat.id)
+    bot.answer_callback_query(call.id, "✅ گزارش تراکنش‌ها تولید شد و به زودی ارسال می‌شود.", show_alert=True)
+
+@callback_router.route("manage_main_buttons", admin=True)
+def manage_main_buttons(call):
+    markup = get_main_buttons_management_keyboard()
+    bot.edit_message_text(
+        "🔘 مدیریت دکمه‌های منوی اصلی\n\n"
+        "با کلیک روی هر دکمه، وضعیت نمایش آن را تغییر دهید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("manage_tutorial_buttons", admin=True)
+def manage_tutorial_buttons(call):
+    markup = get_tutorial_buttons_management_keyboard()
+    bot.edit_message_text(
+        "🔘 مدیریت دکمه‌های آموزش‌ها\n\n"
+        "با کلیک روی هر دکمه، وضعیت نمایش آن را تغییر دهید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("toggle_main_button_", prefix=True, admin=True)
+def toggle_main_button(call):
+    button_id = call.data.replace("toggle_main_button_", "")
+    if toggle_button_visibility('main', button_id):
         markup = get_main_buttons_management_keyboard()
         bot.edit_message_text(
             "🔘 مدیریت دکمه‌های منوی اصلی\n\n"
+            "✅ وضعیت دکمه با موفقیت تغییر کرد.\n"
             "با کلیک روی هر دکمه، وضعیت نمایش آن را تغییر دهید:",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=markup
         )
-        return
-    elif call.data == "manage_tutorial_buttons":
+
+@callback_router.route("toggle_tutorial_", prefix=True, admin=True)
+def toggle_tutorial_button(call):
+    category_id = call.data.replace("toggle_tutorial_", "")
+    if toggle_button_visibility('tutorial', category_id):
         markup = get_tutorial_buttons_management_keyboard()
         bot.edit_message_text(
             "🔘 مدیریت دکمه‌های آموزش‌ها\n\n"
+            "✅ وضعیت دکمه با موفقیت تغییر کرد.\n"
             "با کلیک روی هر دکمه، وضعیت نمایش آن را تغییر دهید:",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=markup
         )
-        return
-    elif call.data.startswith("toggle_main_button_"):
-        button_id = call.data.replace("toggle_main_button_", "")
-        if toggle_button_visibility('main', button_id):
-            markup = get_main_buttons_management_keyboard()
-            bot.edit_message_text(
-                "🔘 مدیریت دکمه‌های منوی اصلی\n\n"
-                "✅ وضعیت دکمه با موفقیت تغییر کرد.\n"
-                "با کلیک روی هر دکمه، وضعیت نمایش آن را تغییر دهید:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=markup
-            )
-        return
-    elif call.data.startswith("toggle_tutorial_"):
-        category_id = call.data.replace("toggle_tutorial_", "")
-        if toggle_button_visibility('tutorial', category_id):
-            markup = get_tutorial_buttons_management_keyboard()
-            bot.edit_message_text(
-                "🔘 مدیریت دکمه‌های آموزش‌ها\n\n"
-                "✅ وضعیت دکمه با موفقیت تغییر کرد.\n"
-                "با کلیک روی هر دکمه، وضعیت نمایش آن را تغییر دهید:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=markup
-            )
-        return
-    # User management functions
-    elif call.data == "search_user":
-        admin_states[call.from_user.id] = {'state': 'waiting_user_id_search'}
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
-        markup.add(back_btn)
 
-        bot.edit_message_text(
-            "🔍 جستجوی کاربر\n\n"
-            "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-        return
-    elif call.data == "add_user_balance":
-        admin_states[call.from_user.id] = {'state': 'waiting_user_id_for_balance'}
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
-        markup.add(back_btn)
+# User management functions
+@callback_router.route("search_user", admin=True)
+def search_user(call):
+    admin_states[call.from_user.id] = {'state': 'waiting_user_id_search'}
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
+    markup.add(back_btn)
 
-        bot.edit_message_text(
-            "💰 افزایش موجودی کاربر\n\n"
-            "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-        return
-    elif call.data == "list_users":
-        data = load_data()
-        user_count = len(data['users'])
+    bot.edit_message_text(
+        "🔍 جستجوی کاربر\n\n"
+        "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
 
-        if user_count == 0:
-            bot.edit_message_text(
-                "📊 لیست کاربران\n\n"
-                "هیچ کاربری یافت نشد!",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=types.InlineKeyboardMarkup().add(
-                    types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
-                )
-            )
-            return
+@callback_router.route("add_user_balance", admin=True)
+def add_user_balance(call):
+    admin_states[call.from_user.id] = {'state': 'waiting_user_id_for_balance'}
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
+    markup.add(back_btn)
 
-        # Show first page of users
-        show_user_list(call.message, 0)
-        return
-    elif call.data == "block_user":
-        admin_states[call.from_user.id] = {'state': 'waiting_user_id_for_block'}
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
-        markup.add(back_btn)
+    bot.edit_message_text(
+        "💰 افزایش موجودی کاربر\n\n"
+        "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
 
-        bot.edit_message_text(
-            "🚫 مسدودسازی کاربر\n\n"
-            "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-        return
-    elif call.data == "message_user":
-        admin_states[call.from_user.id] = {'state': 'waiting_user_id_for_message'}
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
-        markup.add(back_btn)
+@callback_router.route("list_users", admin=True)
+def list_users(call):
+    data = load_data()
+    user_count = len(data['users'])
 
+    if user_count == 0:
         bot.edit_message_text(
-            "📨 ارسال پیام به کاربر\n\n"
-            "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
+            "📊 لیست کاربران\n\n"
+            "هیچ کاربری یافت نشد!",
             call.message.chat.id,
             call.message.message_id,
-            reply_markup=markup
+            reply_markup=types.InlineKeyboardMarkup().add(
+                types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
+            )
         )
         return
-    elif call.data == "user_purchase_history":
-        admin_states[call.from_user.id] = {'state': 'waiting_user_id_for_history'}
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
-        markup.add(back_btn)
 
-        bot.edit_message_text(
-            "📜 تاریخچه خرید کاربر\n\n"
-            "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-        return
-    # Server management functions
-    elif call.data == "add_new_server":
-        admin_states[call.from_user.id] = {'state': 'waiting_server_type'}
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        location_btn = types.InlineKeyboardButton("🌍 لوکیشن جدید", callback_data="new_server_location")
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
-        markup.add(location_btn, back_btn)
+    # Show first page of users
+    show_user_list(call.message, 0)
 
-        bot.edit_message_text(
-            "➕ افزودن سرور جدید\n\n"
-            "چه نوع سروری می‌خواهید اضافه کنید؟",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-        return
-    elif call.data == "list_servers":
-        data = load_data()
+@callback_router.route("block_user", admin=True)
+def block_user(call):
+    admin_states[call.from_user.id] = {'state': 'waiting_user_id_for_block'}
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
+    markup.add(back_btn)
 
-        locations_text = "📋 لیست لوکیشن‌های فعال:\n\n"
-        for loc_id, loc_info in data['locations'].items():
-            status = "✅" if loc_info.get('enabled', True) else "❌"
-            locations_text += f"{status} {loc_info['name']} - {loc_info['price']} تومان\n"
+    bot.edit_message_text(
+        "🚫 مسدودسازی کاربر\n\n"
+        "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
 
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
-        markup.add(back_btn)
+@callback_router.route("message_user", admin=True)
+def message_user(call):
+    admin_states[call.from_user.id] = {'state': 'waiting_user_id_for_message'}
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
+    markup.add(back_btn)
 
-        bot.edit_message_text(
-            locations_text,
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
+    bot.edit_message_text(
+        "📨 ارسال پیام به کاربر\n\n"
+        "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("user_purchase_history", admin=True)
+def user_purchase_history(call):
+    admin_states[call.from_user.id] = {'state': 'waiting_user_id_for_history'}
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_users")
+    markup.add(back_btn)
+
+    bot.edit_message_text(
+        "📜 تاریخچه خرید کاربر\n\n"
+        "لطفاً شناسه عددی کاربر مورد نظر را وارد کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+# Server management functions
+@callback_router.route("add_new_server", admin=True)
+def add_new_server(call):
+    admin_states[call.from_user.id] = {'state': 'waiting_server_type'}
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    location_btn = types.InlineKeyboardButton("🌍 لوکیشن جدید", callback_data="new_server_location")
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
+    markup.add(location_btn, back_btn)
+
+    bot.edit_message_text(
+        "➕ افزودن سرور جدید\n\n"
+        "چه نوع سروری می‌خواهید اضافه کنید؟",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("list_servers", admin=True)
+def list_servers(call):
+    data = load_data()
+
+    locations_text = "📋 لیست لوکیشن‌های فعال:\n\n"
+    for loc_id, loc_info in data['locations'].items():
+        status = "✅" if loc_info.get('enabled', True) else "❌"
+        locations_text += f"{status} {loc_info['name']} - {loc_info['price']} تومان\n"
+
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
+    markup.add(back_btn)
+
+    bot.edit_message_text(
+        locations_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("edit_server", admin=True)
+def edit_server(call):
+    data = load_data()
+    
+    if not data.get('locations'):
+        bot.answer_callback_query(call.id, "❌ هیچ سروری برای ویرایش وجود ندارد!", show_alert=True)
         return
-    elif call.data == "edit_server":
-        data = load_data()
         
-        if not data.get('locations'):
-            bot.answer_callback_query(call.id, "❌ هیچ سروری برای ویرایش وجود ندارد!", show_alert=True)
-            return
-            
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        for loc_id, loc_info in data['locations'].items():
-            btn = types.InlineKeyboardButton(loc_info['name'], callback_data=f"edit_server_{loc_id}")
-            markup.add(btn)
-            
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
-        markup.add(back_btn)
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for loc_id, loc_info in data['locations'].items():
+        btn = types.InlineKeyboardButton(loc_info['name'], callback_data=f"edit_server_{loc_id}")
+        markup.add(btn)
         
-        bot.edit_message_text(
-            "🔄 ویرایش سرور\n\n"
-            "لطفاً سرور مورد نظر برای ویرایش را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
+    markup.add(back_btn)
+    
+    bot.edit_message_text(
+        "🔄 ویرایش سرور\n\n"
+        "لطفاً سرور مورد نظر برای ویرایش را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("edit_server_", prefix=True, admin=True)
+def show_edit_server(call):
+    server_id = call.data.replace("edit_server_", "")
+    data = load_data()
+    
+    if server_id not in data.get('locations', {}):
+        bot.answer_callback_query(call.id, "❌ سرور مورد نظر یافت نشد!", show_alert=True)
         return
-    elif call.data.startswith("edit_server_"):
-        server_id = call.data.replace("edit_server_", "")
-        data = load_data()
-        
-        if server_id not in data.get('locations', {}):
-            bot.answer_callback_query(call.id, "❌ سرور مورد نظر یافت نشد!", show_alert=True)
-            return
-            
-        server_info = data['locations'][server_id]
         
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        edit_name_btn = types.InlineKeyboardButton("✏️ ویرایش نام", callback_data=f"edit_server_name_{server_id}")
-        edit_price_btn = types.InlineKeyboardButton("💰 ویرایش قیمت", callback_data=f"edit_server_price_{server_id}")
-        toggle_status_btn = types.InlineKeyboardButton(
-            "🚦 غیرفعال کردن" if server_info.get('enabled', True) else "🚦 فعال کردن", 
-            callback_data=f"toggle_server_{server_id}"
-        )
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="edit_server")
-        
-        markup.add(edit_name_btn, edit_price_btn, toggle_status_btn, back_btn)
-        
-        status = "✅ فعال" if server_info.get('enabled', True) else "❌ غیرفعال"
-        
-        bot.edit_message_text(
-            f"🔧 ویرایش سرور: {server_info['name']}\n\n"
-            f"🆔 شناسه: {server_id}\n"
-            f"💰 قیمت: {server_info['price']} تومان\n"
-            f"📊 وضعیت: {status}\n\n"
-            f"لطفاً گزینه مورد نظر برای ویرایش را انتخاب کنید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-        return
-    elif call.data == "server_pricing":
-        data = load_data()
+    server_info = data['locations'][server_id]
+    
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    edit_name_btn = types.InlineKeyboardButton("✏️ ویرایش نام", callback_data=f"edit_server_name_{server_id}")
+    edit_price_btn = types.InlineKeyboardButton("💰 ویرایش قیمت", callback_data=f"edit_server_price_{server_id}")
+    toggle_status_btn = types.InlineKeyboardButton(
+        "🚦 غیرفعال کردن" if server_info.get('enabled', True) else "🚦 فعال کردن", 
+        callback_data=f"toggle_server_{server_id}"
+    )
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="edit_server")
+    
+    markup.add(edit_name_btn, edit_price_btn, toggle_status_btn, back_btn)
+    
+    status = "✅ فعال" if server_info.get('enabled', True) else "❌ غیرفعال"
+    
+    bot.edit_message_text(
+        f"🔧 ویرایش سرور: {server_info['name']}\n\n"
+        f"🆔 شناسه: {server_id}\n"
+        f"💰 قیمت: {server_info['price']} تومان\n"
+        f"📊 وضعیت: {status}\n\n"
+        f"لطفاً گزینه مورد نظر برای ویرایش را انتخاب کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("server_pricing", admin=True)
+def server_pricing(call):
+    data = load_data()
+    
+    pricing_text = "💰 قیمت سرورها\n\n"
+    for loc_id, loc_info in data['locations'].items():
+        status = "✅" if loc_info.get('enabled', True) else "❌"
+        pricing_text += f"{status} {loc_info['name']}: {loc_info['price']} تومان\n"
         
-        pricing_text = "💰 قیمت سرورها\n\n"
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    update_btn = types.InlineKeyboardButton("✏️ به‌روزرسانی قیمت‌ها", callback_data="update_server_prices")
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
+    
+    markup.add(update_btn, back_btn)
+    
+    bot.edit_message_text(
+        pricing_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("manage_locations", admin=True)
+def manage_locations(call):
+    data = load_data()
+    
+    if not data.get('locations'):
+        location_text = "❌ هیچ لوکیشنی یافت نشد!"
+    else:
+        location_text = "🌍 مدیریت لوکیشن‌ها\n\n"
         for loc_id, loc_info in data['locations'].items():
             status = "✅" if loc_info.get('enabled', True) else "❌"
-            pricing_text += f"{status} {loc_info['name']}: {loc_info['price']} تومان\n"
+            location_text += f"{status} {loc_info['name']} ({loc_id})\n"
             
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        update_btn = types.InlineKeyboardButton("✏️ به‌روزرسانی قیمت‌ها", callback_data="update_server_prices")
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
-        
-        markup.add(update_btn, back_btn)
-        
-        bot.edit_message_text(
-            pricing_text,
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-        return
-    elif call.data == "manage_locations":
-        data = load_data()
-        
-        if not data.get('locations'):
-            location_text = "❌ هیچ لوکیشنی یافت نشد!"
-        else:
-            location_text = "🌍 مدیریت لوکیشن‌ها\n\n"
-            for loc_id, loc_info in data['locations'].items():
-                status = "✅" if loc_info.get('enabled', True) else "❌"
-                location_text += f"{status} {loc_info['name']} ({loc_id})\n"
-                
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        add_btn = types.InlineKeyboardButton("➕ افزودن لوکیشن", callback_data="add_new_location")
-        remove_btn = types.InlineKeyboardButton("❌ حذف لوکیشن", callback_data="remove_location")
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
-        
-        markup.add(add_btn, remove_btn, back_btn)
-        
-        bot.edit_message_text(
-            location_text,
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    add_btn = types.InlineKeyboardButton("➕ افزودن لوکیشن", callback_data="add_new_location")
+    remove_btn = types.InlineKeyboardButton("❌ حذف لوکیشن", callback_data="remove_location")
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
+    
+    markup.add(add_btn, remove_btn, back_btn)
+    
+    bot.edit_message_text(
+        location_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("toggle_server_status", admin=True)
+def toggle_server_status(call):
+    data = load_data()
+    
+    if not data.get('locations'):
+        bot.answer_callback_query(call.id, "❌ هیچ سروری برای تغییر وضعیت وجود ندارد!", show_alert=True)
         return
-    elif call.data == "toggle_server_status":
+        
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for loc_id, loc_info in data['locations'].items():
+        status = "✅" if loc_info.get('enabled', True) else "❌"
+        btn = types.InlineKeyboardButton(f"{status} {loc_info['name']}", callback_data=f"toggle_server_{loc_id}")
+        markup.add(btn)
+        
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
+    markup.add(back_btn)
+    
+    bot.edit_message_text(
+        "🚦 تغییر وضعیت سرورها\n\n"
+        "برای تغییر وضعیت فعال/غیرفعال، روی سرور مورد نظر کلیک کنید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
+
+@callback_router.route("toggle_server_", prefix=True, admin=True)
+def toggle_server(call):
+    server_id = call.data.replace("toggle_server_", "")
+    data = load_data()
+    
+    if server_id in data.get('locations', {}):
+        current_status = data['locations'][server_id].get('enabled', True)
+        with repository.transaction() as draft:
+            draft['locations'][server_id]['enabled'] = not current_status
+        location_changed(server_id)
         data = load_data()
         
-        if not data.get('locations'):
-            bot.answer_callback_query(call.id, "❌ هیچ سروری برای تغییر وضعیت وجود ندارد!", show_alert=True)
-            return
-            
+        new_status = "فعال" if not current_status else "غیرفعال"
+        bot.answer_callback_query(call.id, f"✅ سرور {data['locations'][server_id]['name']} {new_status} شد.", show_alert=True)
+        
+        # Refresh the toggle server status page
         markup = types.InlineKeyboardMarkup(row_width=1)
         for loc_id, loc_info in data['locations'].items():
             status = "✅" if loc_info.get('enabled', True) else "❌"
@@ -1909,56 +1968,24 @@ def process_admin_functions(call):
             call.message.message_id,
             reply_markup=markup
         )
-        return
-    elif call.data.startswith("toggle_server_"):
-        server_id = call.data.replace("toggle_server_", "")
-        data = load_data()
-        
-        if server_id in data.get('locations', {}):
-            current_status = data['locations'][server_id].get('enabled', True)
-            data['locations'][server_id]['enabled'] = not current_status
-            save_data(data)
-            
-            new_status = "فعال" if not current_status else "غیرفعال"
-            bot.answer_callback_query(call.id, f"✅ سرور {data['locations'][server_id]['name']} {new_status} شد.", show_alert=True)
-            
-            # Refresh the toggle server status page
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            for loc_id, loc_info in data['locations'].items():
-                status = "✅" if loc_info.get('enabled', True) else "❌"
-                btn = types.InlineKeyboardButton(f"{status} {loc_info['name']}", callback_data=f"toggle_server_{loc_id}")
-                markup.add(btn)
-                
-            back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
-            markup.add(back_btn)
-            
-            bot.edit_message_text(
-                "🚦 تغییر وضعیت سرورها\n\n"
-                "برای تغییر وضعیت فعال/غیرفعال، روی سرور مورد نظر کلیک کنید:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=markup
-            )
-        else:
-            bot.answer_callback_query(call.id, "❌ سرور مورد نظر یافت نشد!", show_alert=True)
-        return
-    elif call.data == "server_status":
-        # نمایش وضعیت فنی سرورها
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        check_btn = types.InlineKeyboardButton("🔄 بررسی وضعیت سرورها", callback_data="check_server_status")
-        back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
-        markup.add(check_btn, back_btn)
-        
-        bot.edit_message_text(
-            "🔍 وضعیت سرورها\n\n"
-            "برای بررسی وضعیت آنلاین بودن و پینگ سرورها، دکمه زیر را فشار دهید:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
-        return
     else:
-        bot.answer_callback_query(call.id, "⚠️ این قابلیت در حال پیاده‌سازی است.", show_alert=True)
+        bot.answer_callback_query(call.id, "❌ سرور مورد نظر یافت نشد!", show_alert=True)
+
+@callback_router.route("server_status", admin=True)
+def server_status(call):
+    # نمایش وضعیت فنی سرورها
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    check_btn = types.InlineKeyboardButton("🔄 بررسی وضعیت سرورها", callback_data="check_server_status")
+    back_btn = types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_servers")
+    markup.add(check_btn, back_btn)
+    
+    bot.edit_message_text(
+        "🔍 وضعیت سرورها\n\n"
+        "برای بررسی وضعیت آنلاین بودن و پینگ سرورها، دکمه زیر را فشار دهید:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup
+    )
 
 def get_excel_export_keyboard():
     markup = types.InlineKeyboardMarkup(row_width=1)
@@ -1989,23 +2016,20 @@ def get_main_buttons_management_keyboard():
     markup = types.InlineKeyboardMarkup(row_width=1)
     data = load_data()
     
-    # Initialize settings if needed
-    if 'settings' not in data:
-        data['settings'] = {}
-        
     # Initialize main buttons if needed
-    if 'main_buttons' not in data['settings']:
-        data['settings']['main_buttons'] = {
-            'buy_dns': {'title': '🌐 خرید DNS اختصاصی', 'enabled': True},
-            'buy_vpn': {'title': '🔒 خرید کانفیگ اختصاصی', 'enabled': True},
-            'account': {'title': '💼 حساب کاربری', 'enabled': True},
-            'referral': {'title': '👥 دعوت از دوستان', 'enabled': True},
-            'support': {'title': '💬 پشتیبانی', 'enabled': True},
-            'add_balance': {'title': '💰 افزایش موجودی', 'enabled': True},
-            'tutorials': {'title': '📚 آموزش‌ها', 'enabled': True},
-            'rules': {'title': '📜 قوانین و مقررات', 'enabled': True}
-        }
-        save_data(data)
+    if 'main_buttons' not in data.get('settings', {}):
+        with repository.transaction() as draft:
+            draft.setdefault('settings', {})['main_buttons'] = {
+                'buy_dns': {'title': '🌐 خرید DNS اختصاصی', 'enabled': True},
+                'buy_vpn': {'title': '🔒 خرید کانفیگ اختصاصی', 'enabled': True},
+                'account': {'title': '💼 حساب کاربری', 'enabled': True},
+                'referral': {'title': '👥 دعوت از دوستان', 'enabled': True},
+                'support': {'title': '💬 پشتیبانی', 'enabled': True},
+                'add_balance': {'title': '💰 افزایش موجودی', 'enabled': True},
+                'tutorials': {'title': '📚 آموزش‌ها', 'enabled': True},
+                'rules': {'title': '📜 قوانین و مقررات', 'enabled': True}
+            }
+        data = load_data()
 
     # Create buttons for each main menu item
     for button_id, button_info in data['settings']['main_buttons'].items():
@@ -2028,12 +2052,11 @@ def get_tutorial_buttons_management_keyboard():
     data = load_data()
     
     # Ensure all tutorial categories have the 'enabled' property
-    for category_id, category in data['tutorials'].items():
-        if 'enabled' not in category:
-            category['enabled'] = True
-    
-    # Save changes to data
-    save_data(data)
+    with repository.transaction() as draft:
+        for category_id, category in draft['tutorials'].items():
+            if 'enabled' not in category:
+                category['enabled'] = True
+    data = load_data()
     
     # Add buttons for each tutorial category
     for category_id, category in data['tutorials'].items():
@@ -2227,8 +2250,7 @@ def handle_payment_amount(message):
             payment_states[message.from_user.id]['amount'] = amount
             payment_states[message.from_user.id]['state'] = 'waiting_receipt'
 
-            data = load_data()
-            card_number = data['settings']['payment_card']
+            card_number = repository.get_setting('payment_card')
 
             bot.send_message(
                 message.chat.id,
@@ -2259,23 +2281,16 @@ def handle_payment_receipt(message):
     # Get photo file_id
     photo_id = message.photo[-1].file_id
 
-    # Create payment request record
-    data = load_data()
-    if 'payment_requests' not in data:
-        data['payment_requests'] = {}
-
     # Update discount code usage if applied
-    if discount_code and discount_code in data['discount_codes']:
-        data['discount_codes'][discount_code]['uses'] += 1
+    if discount_code:
+        use_discount_code(discount_code)
 
-    # Create transaction record
-    if 'transactions' not in data:
-        data['transactions'] = {}
+    transaction_id = repository.generate_record_id()
+    request_id = repository.generate_record_id()
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    transaction_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-
-    request_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-    data['payment_requests'][request_id] = {
+    # Create payment request record
+    repository.add_payment_request(request_id, {
         'user_id': user_id,
         'amount': amount,
         'photo_id': photo_id,
@@ -2283,12 +2298,12 @@ def handle_payment_receipt(message):
         'discount_code': discount_code,
         'discount_amount': discount_amount,
         'original_amount': amount + discount_amount,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'timestamp': timestamp,
         'transaction_id': transaction_id
-    }
+    })
 
     # Record transaction
-    data['transactions'][transaction_id] = {
+    repository.append_transaction({
         'user_id': user_id,
         'amount': amount,
         'type': 'deposit',
@@ -2296,11 +2311,9 @@ def handle_payment_receipt(message):
         'discount_code': discount_code,
         'discount_amount': discount_amount,
         'original_amount': amount + discount_amount,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'timestamp': timestamp,
         'request_id': request_id
-    }
-
-    save_data(data)
+    }, transaction_id)
 
     # Notify user
     bot.send_message(
@@ -2311,34 +2324,26 @@ def handle_payment_receipt(message):
         parse_mode="HTML"
     )
 
-    # Notify all admins
-    for admin_id in data['admins']:
-        try:
-            # Forward the photo
-            forwarded = bot.forward_message(
-                admin_id,
-                message.chat.id,
-                message.message_id
-            )
-
-            # Send payment request info
-            markup = types.InlineKeyboardMarkup(row_width=2)
-            approve_btn = types.InlineKeyboardButton("✅ تایید", callback_data=f"approve_payment_{request_id}")
-            reject_btn = types.InlineKeyboardButton("❌ رد", callback_data=f"reject_payment_{request_id}")
-            markup.add(approve_btn, reject_btn)
-
-            bot.send_message(
-                admin_id,
-                f"💰 درخواست افزایش موجودی جدید\n\n"
-                f"👤 کاربر: <code>{user_id}</code>\n"
-                f"💲 مبلغ: {amount} تومان\n"
-                f"🔢 شناسه: {request_id}\n"
-                f"📅 تاریخ: {data['payment_requests'][request_id]['timestamp']}",
-                reply_markup=markup,
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify admin {admin_id}: {e}")
+    # Notify all admins through the outbox so a slow admin chat doesn't hold up this update
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    approve_btn = types.InlineKeyboardButton("✅ تایید", callback_data=f"approve_payment_{request_id}")
+    reject_btn = types.InlineKeyboardButton("❌ رد", callback_data=f"reject_payment_{request_id}")
+    markup.add(approve_btn, reject_btn)
+
+    for admin_id in repository.get_admins():
+        # Forward the photo, then the payment request info (kept in order per chat)
+        outbox.submit(bot.forward_message, admin_id, message.chat.id, message.message_id)
+        outbox.submit(
+            bot.send_message,
+            admin_id,
+            f"💰 درخواست افزایش موجودی جدید\n\n"
+            f"👤 کاربر: <code>{user_id}</code>\n"
+            f"💲 مبلغ: {amount} تومان\n"
+            f"🔢 شناسه: {request_id}\n"
+            f"📅 تاریخ: {timestamp}",
+            reply_markup=markup,
+            parse_mode="HTML"
+        )
 
     # Clear payment state
     del payment_states[user_id]
@@ -2409,10 +2414,9 @@ def handle_edit_file_title(message):
     new_title = message.text
 
     # Update file title
-    data = load_data()
-    if file_id in data.get('uploaded_files', {}):
-        data['uploaded_files'][file_id]['title'] = new_title
-        save_data(data)
+    if repository.get_uploaded_file(file_id):
+        with repository.transaction() as data:
+            data['uploaded_files'][file_id]['title'] = new_title
 
         bot.reply_to(
             message,
@@ -2496,7 +2500,7 @@ def handle_external_url(message):
     )
 
 # Skip caption for external URL
-@bot.callback_query_handler(func=lambda call: call.data == "skip_external_url_caption")
+@callback_router.route("skip_external_url_caption", admin=True)
 def skip_external_url_caption(call):
     if call.from_user.id in admin_states and admin_states[call.from_user.id].get('state') == 'waiting_external_url_caption':
         create_external_url_final(call.from_user.id, "")
@@ -2571,7 +2575,7 @@ def handle_replace_file_selection(call):
     )
 
 # Handler for selecting file to replace
-@bot.callback_query_handler(func=lambda call: call.data.startswith("replace_file_"))
+@callback_router.route("replace_file_", prefix=True, admin=True)
 def select_file_to_replace(call):
     file_id = call.data.replace("replace_file_", "")
     data = load_data()
@@ -2680,18 +2684,6 @@ def handle_replacement_file(message):
             "❌ خطایی در پردازش فایل رخ داد. لطفاً مجدداً تلاش کنید."
         )
 
-# Start the bot
-if __name__ == "__main__":
-    logger.info("Bot has deployed successfully✅")
-    # Initialize data files if they don't exist
-    data = load_data()
-    load_dns_ranges()
-    # Log admins for debugging
-    logger.info(f"Current admins: {data['admins']}")
-    # Start bot polling with skip_pending to avoid conflict and timeout parameter
-    # Add allowed_updates to optimize requests and prevent conflicts
-    bot.polling(none_stop=True, skip_pending=True, timeout=30, allowed_updates=["message", "callback_query"])
-
 def show_file_management(message, file_id):
     data = load_data()
     if file_id in data.get('uploaded_files', {}):
@@ -2699,9 +2691,8 @@ def show_file_management(message, file_id):
 
         # Check if uploaded_at exists, if not add it
         if 'uploaded_at' not in file_info:
-            file_info['uploaded_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            data['uploaded_files'][file_id] = file_info
-            save_data(data)
+            with repository.transaction() as draft:
+                draft['uploaded_files'][file_id]['uploaded_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         # Get emoji based on file type
         type_emoji = {
@@ -2814,18 +2805,11 @@ def handle_ticket_text(message):
 
     subject = ticket_states[user_id]['subject']
 
-    # ایجاد تیکت در دیتابیس
-    data = load_data()
-
-    # بررسی وجود ساختار تیکت‌ها
-    if 'tickets' not in data:
-        data['tickets'] = {}
-
     # ایجاد شناسه یکتا برای تیکت
-    ticket_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+    ticket_id = repository.generate_record_id()
 
     # ذخیره اطلاعات تیکت
-    data['tickets'][ticket_id] = {
+    repository.add_ticket(ticket_id, {
         'user_id': user_id,
         'subject': subject,
         'text': ticket_text,
@@ -2838,9 +2822,7 @@ def handle_ticket_text(message):
                 'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
         ]
-    }
-
-    save_data(data)
+    })
 
     # ارسال تایید ثبت تیکت به کاربر
     markup = types.InlineKeyboardMarkup(row_width=1)
@@ -2871,17 +2853,9 @@ def handle_ticket_text(message):
         f"📝 متن پیام:\n{ticket_text}"
     )
 
-    # ارسال پیام به تمام ادمین‌ها
-    for admin_id in data['admins']:
-        try:
-            bot.send_message(
-                admin_id,
-                admin_text,
-                reply_markup=admin_markup,
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify admin {admin_id} about new ticket: {e}")
+    # ارسال پیام به تمام ادمین‌ها از طریق صف ارسال
+    for admin_id in repository.get_admins():
+        outbox.submit(bot.send_message, admin_id, admin_text, reply_markup=admin_markup, parse_mode="HTML")
 
     # پاک کردن حالت تیکت کاربر
     del ticket_states[user_id]
@@ -2940,7 +2914,7 @@ def handle_share_file_request(call, file_id):
         parse_mode="HTML"
     )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("copy_link_"))
+@callback_router.route("copy_link_", prefix=True, admin=True)
 def copy_file_link(call):
     file_id = call.data.replace("copy_link_", "")
     bot_username = bot.get_me().username
@@ -3048,17 +3022,18 @@ def get_main_buttons_management_keyboard():
 
     if 'main_buttons' not in data.get('settings', {}):
         # Initialize default button settings if they don't exist
-        data['settings']['main_buttons'] = {
-            'buy_dns': {'title': '🌐 خرید DNS اختصاصی', 'enabled': True},
-            'buy_vpn': {'title': '🔒 خرید کانفیگ اختصاصی', 'enabled': True},
-            'account': {'title': '💼 حساب کاربری', 'enabled': True},
-            'referral': {'title': '👥 دعوت از دوستان', 'enabled': True},
-            'support': {'title': '💬 پشتیبانی', 'enabled': True},
-            'add_balance': {'title': '💰 افزایش موجودی', 'enabled': True},
-            'tutorials': {'title': '📚 آموزش‌ها', 'enabled': True},
-            'rules': {'title': '📜 قوانین و مقررات', 'enabled': True}
-        }
-        save_data(data)
+        with repository.transaction() as draft:
+            draft.setdefault('settings', {})['main_buttons'] = {
+                'buy_dns': {'title': '🌐 خرید DNS اختصاصی', 'enabled': True},
+                'buy_vpn': {'title': '🔒 خرید کانفیگ اختصاصی', 'enabled': True},
+                'account': {'title': '💼 حساب کاربری', 'enabled': True},
+                'referral': {'title': '👥 دعوت از دوستان', 'enabled': True},
+                'support': {'title': '💬 پشتیبانی', 'enabled': True},
+                'add_balance': {'title': '💰 افزایش موجودی', 'enabled': True},
+                'tutorials': {'title': '📚 آموزش‌ها', 'enabled': True},
+                'rules': {'title': '📜 قوانین و مقررات', 'enabled': True}
+            }
+        data = load_data()
 
     # Create buttons for each main menu item
     for button_id, button_info in data['settings']['main_buttons'].items():
@@ -3082,8 +3057,9 @@ def get_tutorial_buttons_management_keyboard():
     
     # Temporarily disable 'general' (آموزش عمومی) category
     if 'general' in data['tutorials'] and 'enabled' not in data['tutorials']['general']:
-        data['tutorials']['general']['enabled'] = False
-        save_data(data)
+        with repository.transaction() as draft:
+            draft['tutorials']['general']['enabled'] = False
+        data = load_data()
 
     for category_id, category in data['tutorials'].items():
         status = "✅" if category.get('enabled', True) else "❌"
@@ -3101,57 +3077,97 @@ def get_tutorial_buttons_management_keyboard():
 
 # Toggle button visibility function
 def toggle_button_visibility(button_type, button_id):
-    data = load_data()
-
-    # Initialize settings if needed
-    if 'settings' not in data:
-        data['settings'] = {}
-    
-    if button_type == 'main':
-        # Initialize main buttons if needed
-        if 'main_buttons' not in data['settings']:
-            data['settings']['main_buttons'] = {
-                'buy_dns': {'title': '🌐 خرید DNS اختصاصی', 'enabled': True},
-                'buy_vpn': {'title': '🔒 خرید کانفیگ اختصاصی', 'enabled': True},
-                'account': {'title': '💼 حساب کاربری', 'enabled': True},
-                'referral': {'title': '👥 دعوت از دوستان', 'enabled': True},
-                'support': {'title': '💬 پشتیبانی', 'enabled': True},
-                'add_balance': {'title': '💰 افزایش موجودی', 'enabled': True},
-                'tutorials': {'title': '📚 آموزش‌ها', 'enabled': True},
-                'rules': {'title': '📜 قوانین و مقررات', 'enabled': True}
-            }
-            
-        if button_id in data['settings']['main_buttons']:
-            # Toggle the current state
-            current_state = data['settings']['main_buttons'][button_id].get('enabled', True)
-            data['settings']['main_buttons'][button_id]['enabled'] = not current_state
-            save_data(data)
-            return True
-    elif button_type == 'tutorial':
-        if button_id in data['tutorials']:
-            # Initialize enabled property if it doesn't exist
-            if 'enabled' not in data['tutorials'][button_id]:
-                data['tutorials'][button_id]['enabled'] = True
+    with repository.transaction() as data:
+        # Initialize settings if needed
+        if 'settings' not in data:
+            data['settings'] = {}
+        
+        if button_type == 'main':
+            # Initialize main buttons if needed
+            if 'main_buttons' not in data['settings']:
+                data['settings']['main_buttons'] = {
+                    'buy_dns': {'title': '🌐 خرید DNS اختصاصی', 'enabled': True},
+                    'buy_vpn': {'title': '🔒 خرید کانفیگ اختصاصی', 'enabled': True},
+                    'account': {'title': '💼 حساب کاربری', 'enabled': True},
+                    'referral': {'title': '👥 دعوت از دوستان', 'enabled': True},
+                    'support': {'title': '💬 پشتیبانی', 'enabled': True},
+                    'add_balance': {'title': '💰 افزایش موجودی', 'enabled': True},
+                    'tutorials': {'title': '📚 آموزش‌ها', 'enabled': True},
+                    'rules': {'title': '📜 قوانین و مقررات', 'enabled': True}
+                }
                 
-            # Toggle the current state
-            current_state = data['tutorials'][button_id].get('enabled', True)
-            data['tutorials'][button_id]['enabled'] = not current_state
-            save_data(data)
-            return True
+            if button_id in data['settings']['main_buttons']:
+                # Toggle the current state
+                current_state = data['settings']['main_buttons'][button_id].get('enabled', True)
+                data['settings']['main_buttons'][button_id]['enabled'] = not current_state
+                return True
+        elif button_type == 'tutorial':
+            if button_id in data['tutorials']:
+                # Toggle the current state
+                current_state = data['tutorials'][button_id].get('enabled', True)
+                data['tutorials'][button_id]['enabled'] = not current_state
+                return True
 
     return False
 
+# Count one more use of a discount code
+def use_discount_code(discount_code):
+    with repository.transaction() as data:
+        if discount_code in data.get('discount_codes', {}):
+            data['discount_codes'][discount_code]['uses'] += 1
+
+# Price of a location after a discount code, worked out from stored data only
+def price_with_discount(location_id, discount_code):
+    """
+    Check a discount code against a location and apply it.
+
+    Returns:
+        tuple: ((original_price, discount_amount, final_price), None), or
+            (None, error_text) if the location or the code can't be used
+    """
+    location = repository.get_location(location_id)
+    if not location or not location['enabled']:
+        return None, "⚠️ این سرور در حال حاضر در دسترس نیست."
+
+    discount_info = repository.snapshot().get('discount_codes', {}).get(discount_code)
+    if discount_info is None:
+        return None, "❌ کد تخفیف وارد شده معتبر نیست."
+
+    # بررسی تاریخ انقضا
+    if 'expires_at' in discount_info:
+        expiry_date = datetime.strptime(discount_info['expires_at'], '%Y-%m-%d %H:%M:%S')
+        if datetime.now() > expiry_date:
+            return None, "❌ این کد تخفیف منقضی شده است."
+
+    # بررسی محدودیت استفاده
+    if 'max_uses' in discount_info and discount_info['uses'] >= discount_info['max_uses']:
+        return None, "❌ این کد تخفیف به حداکثر تعداد استفاده رسیده است."
+
+    # محاسبه تخفیف
+    original_price = location['price']
+    if discount_info['type'] == 'percentage':
+        discount_amount = int(original_price * discount_info['value'] / 100)
+    else:  # fixed amount
+        discount_amount = discount_info['value']
+    discount_amount = min(discount_amount, original_price)
+
+    return (original_price, discount_amount, original_price - discount_amount), None
+
 # توابع مدیریت کد تخفیف
-@bot.callback_query_handler(func=lambda call: call.data.startswith("has_discount_"))
+@callback_router.route("has_discount_", prefix=True)
 def handle_has_discount(call):
-    location_id = call.data.replace("has_discount_", "")
+    # has_discount_<dns|vpn>_<location_id>
+    service_type, _, location_id = call.data.replace("has_discount_", "").partition("_")
+    if service_type not in ('dns', 'vpn') or not location_id:
+        bot.answer_callback_query(call.id, "❌ اطلاعات خرید یافت نشد. لطفاً دوباره تلاش کنید.")
+        return
     
     # ذخیره اطلاعات در وضعیت کاربر
-    if call.from_user.id not in payment_states:
-        payment_states[call.from_user.id] = {}
-    
-    payment_states[call.from_user.id]['state'] = 'waiting_discount_code'
-    payment_states[call.from_user.id]['location_id'] = location_id
+    payment_states[call.from_user.id] = {
+        'state': 'waiting_discount_code',
+        'service_type': service_type,
+        'location_id': location_id
+    }
     
     markup = types.InlineKeyboardMarkup(row_width=1)
     cancel_btn = types.InlineKeyboardButton("❌ انصراف", callback_data="back_to_main")
@@ -3165,49 +3181,42 @@ def handle_has_discount(call):
         reply_markup=markup
     )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("no_discount_dns_"))
+@callback_router.route("no_discount_dns_", prefix=True)
 def process_without_discount_dns(call):
     location_id = call.data.replace("no_discount_dns_", "")
     user = get_user(call.from_user.id)
-    data = load_data()
+    location = repository.get_location(location_id)
     
-    if location_id in data['locations'] and data['locations'][location_id]['enabled']:
-        location = data['locations'][location_id]
+    if location and location['enabled']:
         price = location['price']
         
         if user['balance'] >= price:
-            # Generate DNS configuration
-            dns_config = generate_dns_config(location_id)
+            # Take a ready-made DNS configuration with its addresses allocated
+            dns_config = take_dns_config(location_id)
             
             if dns_config:
-                # Deduct balance
-                user['balance'] -= price
-                # Add DNS to user's configs
-                user['dns_configs'].append(dns_config)
-                data['users'][str(call.from_user.id)] = user
-                
-                # Record transaction
-                transaction_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-                if 'transactions' not in data:
-                    data['transactions'] = {}
-                    
-                data['transactions'][transaction_id] = {
-                    'user_id': call.from_user.id,
-                    'amount': price,
-                    'type': 'purchase',
-                    'item': 'dns',
-                    'location': location_id,
-                    'status': 'completed',
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                
-                save_data(data)
+                # Deduct balance, add DNS to user's configs and record the transaction
+                result = ledger.debit(
+                    call.from_user.id, price, 'dns',
+                    transaction_id=ledger.transaction_id_for(call.id),
+                    mutate=append_user_config('dns_configs', dns_config),
+                    item='dns',
+                    location=location_id
+                )
+                if result.duplicate or not result.ok:
+                    # The purchase did not go through; free the addresses drawn for it
+                    allocations.release_owner(dns_config['allocation_id'])
+                if result.duplicate:
+                    return
+                if not result.ok:
+                    bot.answer_callback_query(call.id, "⚠️ موجودی ناکافی!", show_alert=True)
+                    return
                 
                 # Notify user about balance reduction
                 bot.send_message(
                     call.from_user.id,
                     f"💸 مبلغ {price} تومان بابت خرید DNS اختصاصی از حساب شما کسر شد.\n"
-                    f"💰 موجودی فعلی: {user['balance']} تومان"
+                    f"💰 موجودی فعلی: {result.balance} تومان"
                 )
                 
                 success_text = (
@@ -3256,7 +3265,7 @@ def process_without_discount_dns(call):
                 reply_markup=markup
             )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("no_discount_vpn_"))
+@callback_router.route("no_discount_vpn_", prefix=True)
 def process_without_discount_vpn(call):
     location_id = call.data.replace("no_discount_vpn_", "")
     user = get_user(call.from_user.id)
@@ -3320,56 +3329,19 @@ def handle_discount_code(message):
     location_id = payment_states[user_id]['location_id']
     
     # بررسی اعتبار کد تخفیف
-    data = load_data()
-    user = get_user(user_id)
-    
-    if 'discount_codes' not in data:
-        bot.reply_to(message, "❌ کد تخفیف وارد شده معتبر نیست.")
-        return
-        
-    if discount_code not in data['discount_codes']:
-        bot.reply_to(message, "❌ کد تخفیف وارد شده معتبر نیست.")
-        return
-        
-    discount_info = data['discount_codes'][discount_code]
-    
-    # بررسی تاریخ انقضا
-    if 'expires_at' in discount_info:
-        expiry_date = datetime.strptime(discount_info['expires_at'], '%Y-%m-%d %H:%M:%S')
-        if datetime.now() > expiry_date:
-            bot.reply_to(message, "❌ این کد تخفیف منقضی شده است.")
-            return
-            
-    # بررسی محدودیت استفاده
-    if 'max_uses' in discount_info and discount_info['uses'] >= discount_info['max_uses']:
-        bot.reply_to(message, "❌ این کد تخفیف به حداکثر تعداد استفاده رسیده است.")
+    pricing, error = price_with_discount(location_id, discount_code)
+    if error:
+        bot.reply_to(message, error)
         return
-        
-    # محاسبه تخفیف
-    location = data['locations'][location_id]
-    original_price = location['price']
-    
-    if discount_info['type'] == 'percentage':
-        discount_amount = int(original_price * discount_info['value'] / 100)
-    else:  # fixed amount
-        discount_amount = discount_info['value']
-        
-    final_price = max(0, original_price - discount_amount)
+    original_price, discount_amount, final_price = pricing
+    location = repository.get_location(location_id)
+    user = get_user(user_id)
     
-    # ذخیره اطلاعات تخفیف
+    # ذخیره کد تخفیف؛ مبلغ هنگام خرید دوباره محاسبه می‌شود
     payment_states[user_id]['discount_code'] = discount_code
-    payment_states[user_id]['discount_amount'] = discount_amount
-    payment_states[user_id]['final_price'] = final_price
     
     # ارسال تاییدیه به کاربر و پرسیدن تایید نهایی
-    if 'service_type' not in payment_states[user_id]:
-        # تشخیص نوع سرویس براساس کالبک آخر
-        if 'no_discount_dns_' in bot.callback_data_cache.get(user_id, {'last': ''})['last']:
-            payment_states[user_id]['service_type'] = 'dns'
-        else:
-            payment_states[user_id]['service_type'] = 'vpn'
-    
-    service_type = payment_states[user_id].get('service_type', 'dns')  # پیش‌فرض DNS
+    service_type = payment_states[user_id]['service_type']
     
     markup = types.InlineKeyboardMarkup(row_width=2)
     
@@ -3397,63 +3369,62 @@ def handle_discount_code(message):
         reply_markup=markup
     )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_discount_dns_"))
+@callback_router.route("confirm_discount_dns_", prefix=True)
 def process_dns_with_discount(call):
     location_id = call.data.replace("confirm_discount_dns_", "")
     user_id = call.from_user.id
     
-    if user_id not in payment_states or 'discount_code' not in payment_states[user_id]:
+    state = payment_states.get(user_id, {})
+    if 'discount_code' not in state or state.get('location_id') != location_id:
         bot.answer_callback_query(call.id, "❌ اطلاعات تخفیف یافت نشد. لطفاً دوباره تلاش کنید.")
         return
         
     user = get_user(user_id)
     data = load_data()
     
+    # The price comes from the location and the stored code, never from the callback
     discount_code = payment_states[user_id]['discount_code']
-    discount_amount = payment_states[user_id]['discount_amount']
-    final_price = payment_states[user_id]['final_price']
+    pricing, error = price_with_discount(location_id, discount_code)
+    if error:
+        bot.answer_callback_query(call.id, error, show_alert=True)
+        return
+    original_price, discount_amount, final_price = pricing
     
     if location_id in data['locations'] and data['locations'][location_id]['enabled']:
         if user['balance'] >= final_price:
-            # Generate DNS configuration
-            dns_config = generate_dns_config(location_id)
+            # Take a ready-made DNS configuration with its addresses allocated
+            dns_config = take_dns_config(location_id)
             
             if dns_config:
-                # Deduct balance
-                user['balance'] -= final_price
-                # Add DNS to user's configs
-                user['dns_configs'].append(dns_config)
+                # Deduct balance, add DNS to user's configs and record the transaction with discount info
+                result = ledger.debit(
+                    call.from_user.id, final_price, 'dns',
+                    transaction_id=ledger.transaction_id_for(call.id),
+                    mutate=append_user_config('dns_configs', dns_config),
+                    original_amount=data['locations'][location_id]['price'],
+                    discount_code=discount_code,
+                    discount_amount=discount_amount,
+                    item='dns',
+                    location=location_id
+                )
+                if result.duplicate or not result.ok:
+                    # The purchase did not go through; free the addresses drawn for it
+                    allocations.release_owner(dns_config['allocation_id'])
+                if result.duplicate:
+                    return
+                if not result.ok:
+                    bot.answer_callback_query(call.id, "⚠️ موجودی ناکافی!", show_alert=True)
+                    return
                 
                 # Update discount code usage
-                data['discount_codes'][discount_code]['uses'] += 1
-                
-                # Record transaction with discount info
-                transaction_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-                if 'transactions' not in data:
-                    data['transactions'] = {}
-                    
-                data['transactions'][transaction_id] = {
-                    'user_id': call.from_user.id,
-                    'amount': final_price,
-                    'original_amount': data['locations'][location_id]['price'],
-                    'discount_code': discount_code,
-                    'discount_amount': discount_amount,
-                    'type': 'purchase',
-                    'item': 'dns',
-                    'location': location_id,
-                    'status': 'completed',
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                
-                data['users'][str(call.from_user.id)] = user
-                save_data(data)
+                use_discount_code(discount_code)
                 
                 # Notify user about balance reduction
                 bot.send_message(
                     call.from_user.id,
                     f"💸 مبلغ {final_price} تومان بابت خرید DNS اختصاصی از حساب شما کسر شد.\n"
                     f"🏷️ تخفیف اعمال شده: {discount_amount} تومان (کد: {discount_code})\n"
-                    f"💰 موجودی فعلی: {user['balance']} تومان"
+                    f"💰 موجودی فعلی: {result.balance} تومان"
                 )
                 
                 success_text = (
@@ -3507,12 +3478,13 @@ def process_dns_with_discount(call):
                 reply_markup=markup
             )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_discount_vpn_"))
+@callback_router.route("confirm_discount_vpn_", prefix=True)
 def process_vpn_with_discount(call):
     location_id = call.data.replace("confirm_discount_vpn_", "")
     user_id = call.from_user.id
     
-    if user_id not in payment_states or 'discount_code' not in payment_states[user_id]:
+    state = payment_states.get(user_id, {})
+    if 'discount_code' not in state or state.get('location_id') != location_id:
         bot.answer_callback_query(call.id, "❌ اطلاعات تخفیف یافت نشد. لطفاً دوباره تلاش کنید.")
         return
         
@@ -3520,8 +3492,11 @@ def process_vpn_with_discount(call):
     data = load_data()
     
     discount_code = payment_states[user_id]['discount_code']
-    discount_amount = payment_states[user_id]['discount_amount']
-    final_price = payment_states[user_id]['final_price']
+    pricing, error = price_with_discount(location_id, discount_code)
+    if error:
+        bot.answer_callback_query(call.id, error, show_alert=True)
+        return
+    original_price, discount_amount, final_price = pricing
     
     if location_id in data['locations'] and data['locations'][location_id]['enabled']:
         if user['balance'] >= final_price:
@@ -3536,11 +3511,9 @@ def process_vpn_with_discount(call):
                 f"آیا مطمئن هستید که می‌خواهید این سرویس را خریداری کنید؟"
             )
             
-            # ذخیره اطلاعات تخفیف در callback_data
-            discount_info = f"{discount_code}_{discount_amount}_{final_price}"
-            
+            # کد تخفیف در وضعیت پرداخت می‌ماند و مبلغ هنگام خرید دوباره محاسبه می‌شود
             markup = types.InlineKeyboardMarkup(row_width=2)
-            confirm_btn = types.InlineKeyboardButton("✅ بله، خرید شود", callback_data=f"confirm_vpn_discount_{location_id}_{discount_info}")
+            confirm_btn = types.InlineKeyboardButton("✅ بله، خرید شود", callback_data=f"confirm_vpn_discount_{location_id}")
             cancel_btn = types.InlineKeyboardButton("❌ خیر، انصراف", callback_data="menu_buy_vpn")
             markup.add(confirm_btn, cancel_btn)
             
@@ -3570,80 +3543,71 @@ def process_vpn_with_discount(call):
                 reply_markup=markup
             )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_vpn_discount_"))
+@callback_router.route("confirm_vpn_discount_", prefix=True)
 def process_confirm_vpn_with_discount(call):
-    # جداسازی اطلاعات از callback_data
-    parts = call.data.replace("confirm_vpn_discount_", "").split("_")
-    location_id = parts[0]
-    discount_code = parts[1]
-    discount_amount = int(parts[2])
-    final_price = int(parts[3])
+    location_id = call.data.replace("confirm_vpn_discount_", "")
+    user_id = call.from_user.id
     
-    user = get_user(call.from_user.id)
-    data = load_data()
+    # The price comes from the location and the stored code, never from the callback
+    state = payment_states.get(user_id, {})
+    if 'discount_code' not in state or state.get('location_id') != location_id:
+        bot.answer_callback_query(call.id, "❌ اطلاعات تخفیف یافت نشد. لطفاً دوباره تلاش کنید.")
+        return
+    discount_code = state['discount_code']
+    pricing, error = price_with_discount(location_id, discount_code)
+    if error:
+        bot.answer_callback_query(call.id, error, show_alert=True)
+        return
+    original_price, discount_amount, final_price = pricing
     
-    if location_id in data['locations'] and data['locations'][location_id]['enabled']:
-        location = data['locations'][location_id]
-        original_price = location['price']
-        
+    user = get_user(user_id)
+    location = repository.get_location(location_id)
+    
+    if location and location['enabled']:
         if user['balance'] >= final_price:
-            # Generate WireGuard configuration
-            config_text = generate_wireguard_config(location_id)
+            # Take a ready-made WireGuard configuration with its addresses allocated
+            config_id, config_text, allocation_id = take_wireguard_config(location_id)
             
             if config_text:
-                # Create a unique file name with new format
-                random_letter = random.choice(string.ascii_uppercase)
-                random_digits = ''.join(random.choices(string.digits, k=4))
-                config_id = f"{random_letter}{random_digits}"
-                file_name = f"{config_id}.conf"
-                
-                # Save config to a temporary file
-                with open(file_name, 'w') as f:
-                    f.write(config_text)
-                
-                # Deduct balance
-                user['balance'] -= final_price
-                
-                # Update discount code usage
-                data['discount_codes'][discount_code]['uses'] += 1
                 
                 # Add config to user's wireguard_configs
                 vpn_config = {
                     'id': config_id,
+                    'allocation_id': allocation_id,
                     'location': location_id,
                     'location_name': location['name'],
                     'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 }
                 
-                user['wireguard_configs'].append(vpn_config)
-                
-                # Record transaction with discount info
-                transaction_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-                if 'transactions' not in data:
-                    data['transactions'] = {}
-                    
-                data['transactions'][transaction_id] = {
-                    'user_id': call.from_user.id,
-                    'amount': final_price,
-                    'original_amount': original_price,
-                    'discount_code': discount_code,
-                    'discount_amount': discount_amount,
-                    'type': 'purchase',
-                    'item': 'vpn',
-                    'location': location_id,
-                    'status': 'completed',
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
+                # Deduct balance and record transaction with discount info
+                result = ledger.debit(
+                    call.from_user.id, final_price, 'vpn',
+                    transaction_id=ledger.transaction_id_for(call.id),
+                    mutate=append_user_config('wireguard_configs', vpn_config),
+                    original_amount=original_price,
+                    discount_code=discount_code,
+                    discount_amount=discount_amount,
+                    item='vpn',
+                    location=location_id
+                )
+                if result.duplicate or not result.ok:
+                    # The purchase did not go through; free the addresses drawn for it
+                    allocations.release_owner(allocation_id)
+                if result.duplicate:
+                    return
+                if not result.ok:
+                    bot.answer_callback_query(call.id, "⚠️ موجودی ناکافی!", show_alert=True)
+                    return
                 
-                data['users'][str(call.from_user.id)] = user
-                save_data(data)
+                # Update discount code usage
+                use_discount_code(discount_code)
                 
                 # Notify user about balance reduction
                 bot.send_message(
                     call.from_user.id,
                     f"💸 مبلغ {final_price} تومان بابت خرید VPN اختصاصی از حساب شما کسر شد.\n"
                     f"🏷️ تخفیف اعمال شده: {discount_amount} تومان (کد: {discount_code})\n"
-                    f"💰 موجودی فعلی: {user['balance']} تومان"
+                    f"💰 موجودی فعلی: {result.balance} تومان"
                 )
                 
                 # Success message
@@ -3671,15 +3635,12 @@ def process_confirm_vpn_with_discount(call):
                 )
                 
                 # Then send the config file
-                with open(file_name, 'rb') as f:
-                    bot.send_document(
-                        call.message.chat.id,
-                        f,
-                        caption=f"🔒 فایل پیکربندی VPN اختصاصی - {location['name']}"
-                    )
-                
-                # Remove temporary file
-                os.remove(file_name)
+                send_config_file(
+                    call.message.chat.id,
+                    config_id,
+                    config_text,
+                    caption=f"🔒 فایل پیکربندی VPN اختصاصی - {location['name']}"
+                )
                 
                 # پاک کردن وضعیت پرداخت
                 if call.from_user.id in payment_states:
@@ -3687,4 +3648,33 @@ def process_confirm_vpn_with_discount(call):
             else:
                 bot.answer_callback_query(call.id, "⚠️ خطا در تولید پیکربندی VPN. لطفاً با پشتیبانی تماس بگیرید.")
         else:
-            bot.answer_callback_query(call.id, "⚠️ موجودی ناکافی!", show_alert=True)
\ No newline at end of file
+            bot.answer_callback_query(call.id, "⚠️ موجودی ناکافی!", show_alert=True)
+
+# Start the bot
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runtime', choices=['threaded', 'async'], default=BOT_RUNTIME,
+                        help="threaded: telebot's polling thread pool; async: asyncio polling feeding a larger "
+                             "handler thread pool with per-chat ordering (polling mode only)")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling',
+                        help="polling: long poll Telegram; webhook: serve updates from webhook.py's HTTP server")
+    args = parser.parse_args()
+
+    logger.info("Bot has deployed successfully✅")
+    # Initialize data files if they don't exist
+    data = load_data()
+    repository.dns_ranges_db()
+    start_config_pool()
+    broadcast.resume_all(bot)
+    # Log admins for debugging
+    logger.info(f"Current admins: {data['admins']}")
+    # Start bot polling with skip_pending to avoid conflict and timeout parameter
+    # Add allowed_updates to optimize requests and prevent conflicts
+    if args.mode == 'webhook':
+        import webhook
+        webhook.run(bot, allowed_updates=["message", "callback_query"])
+    elif args.runtime == 'async':
+        import async_runtime
+        async_runtime.run(bot, skip_pending=True, timeout=30, allowed_updates=["message", "callback_query"])
+    else:
+        bot.polling(none_stop=True, skip_pending=True, timeout=30, allowed_updates=["message", "callback_query"])
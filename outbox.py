@@ -0,0 +1,144 @@
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from telebot.apihelper import ApiTelegramException
+from config import TELEGRAM_PER_CHAT_RATE, OUTBOX_WORKERS, OUTBOX_MAX_RETRIES, OUTBOX_MAX_RATE_LIMITED
+from rate_limit import TokenBucket, global_bucket
+
+logger = logging.getLogger(__name__)
+
+# Short bursts to one chat (e.g. a forwarded receipt and its buttons) go out together
+PER_CHAT_BURST = 3
+# Forget the rate state of chats idle for this many seconds
+CHAT_IDLE_SECONDS = 60
+
+
+class Outbox:
+    """
+    Queue of outgoing Telegram calls, delivered by worker threads.
+
+    Calls to one chat are made in submission order, one at a time, paced by
+    a per-chat token bucket; every call also takes a token from the global
+    bucket shared with broadcasts. A 429 pauses both buckets for
+    retry_after, as Telegram's flood limit covers the whole bot, and is
+    retried up to max_rate_limited times; a 5xx or network error is retried
+    up to max_retries times with backoff.
+    """
+
+    def __init__(self, workers=OUTBOX_WORKERS, max_retries=OUTBOX_MAX_RETRIES, bucket=global_bucket,
+                 max_rate_limited=OUTBOX_MAX_RATE_LIMITED):
+        self.max_retries = max_retries
+        self.max_rate_limited = max_rate_limited
+        self.bucket = bucket
+        # chat_id -> deque of (future, fn, args, kwargs); a chat is in _ready
+        # (or being served) exactly while it has an entry here
+        self._chats = {}
+        self._chat_buckets = {}
+        self._last_used = {}
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        for n in range(workers):
+            thread = threading.Thread(target=self._work, name=f"outbox-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, chat_id, *args, **kwargs):
+        """
+        Queue fn(chat_id, *args, **kwargs), e.g. submit(bot.send_message, chat_id, text).
+
+        Returns:
+            Future: Resolves to fn's result, or to the exception of the last
+                attempt. Callers may ignore it; failures are logged either way.
+        """
+        future = Future()
+        with self._lock:
+            pending = self._chats.get(chat_id)
+            if pending is None:
+                self._chats[chat_id] = deque([(future, fn, args, kwargs)])
+                self._ready.put(chat_id)
+            else:
+                pending.append((future, fn, args, kwargs))
+        return future
+
+    def pending(self):
+        with self._lock:
+            return sum(len(pending) for pending in self._chats.values())
+
+    def _work(self):
+        while True:
+            chat_id = self._ready.get()
+            with self._lock:
+                future, fn, args, kwargs = self._chats[chat_id].popleft()
+                chat_bucket = self._chat_buckets.get(chat_id)
+                if chat_bucket is None:
+                    chat_bucket = self._chat_buckets[chat_id] = TokenBucket(TELEGRAM_PER_CHAT_RATE, PER_CHAT_BURST)
+
+            if future.set_running_or_notify_cancel():
+                self._deliver(future, chat_bucket, fn, chat_id, args, kwargs)
+
+            with self._lock:
+                self._last_used[chat_id] = time.monotonic()
+                if self._chats[chat_id]:
+                    self._ready.put(chat_id)
+                else:
+                    del self._chats[chat_id]
+                    self._forget_idle_chats()
+
+    def _forget_idle_chats(self):
+        # Called with the lock held
+        cutoff = time.monotonic() - CHAT_IDLE_SECONDS
+        for chat_id in [chat_id for chat_id, used in self._last_used.items() if used < cutoff]:
+            if chat_id not in self._chats:
+                del self._last_used[chat_id]
+                self._chat_buckets.pop(chat_id, None)
+
+    def _deliver(self, future, chat_bucket, fn, chat_id, args, kwargs):
+        attempt = 0
+        rate_limited = 0
+        while True:
+            chat_bucket.acquire()
+            self.bucket.acquire()
+            try:
+                future.set_result(fn(chat_id, *args, **kwargs))
+                return
+            except ApiTelegramException as e:
+                if e.error_code == 429 and rate_limited < self.max_rate_limited:
+                    retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                    logger.warning(f"Rate limited sending to {chat_id}, retrying in {retry_after}s")
+                    chat_bucket.pause(retry_after)
+                    self.bucket.pause(retry_after)
+                    rate_limited += 1
+                    continue
+                error = e
+                retryable = e.error_code >= 500
+            except Exception as e:
+                # Network errors from requests and the like
+                error = e
+                retryable = True
+
+            if not retryable or attempt >= self.max_retries:
+                logger.error(f"Failed to send to {chat_id}: {error}")
+                future.set_exception(error)
+                return
+            attempt += 1
+            time.sleep(min(2 ** attempt, 30))
+
+
+# Shared outbox, started on first use
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
+
+def submit(fn, chat_id, *args, **kwargs):
+    """Queue a call on the shared outbox; see Outbox.submit()."""
+    return get_outbox().submit(fn, chat_id, *args, **kwargs)
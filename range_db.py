@@ -0,0 +1,193 @@
+"""
+Compact binary file of the DNS ranges, read through mmap.
+
+Layout (little-endian):
+
+    header    magic b'XRDB', format version (u16), location count (u16)
+    index     per location: name length (u8), name (UTF-8), then for IPv4
+              and IPv6 each: data offset (u32), prefix count (u32)
+    data      IPv4 prefixes as (network u32, prefix length u8) and IPv6
+              prefixes as (network high u64, network low u64, prefix
+              length u8), each list sorted by network
+
+The file is mapped read-only, so every process using it shares the same
+pages and nothing is parsed until a location's list is asked for.
+"""
+import os
+import sys
+import mmap
+import struct
+import pickle
+import hashlib
+import importlib.util
+import logging
+import ipaddress
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'XRDB'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHH')
+SECTION = struct.Struct('<II')
+IPV4_ENTRY = struct.Struct('<IB')
+IPV6_ENTRY = struct.Struct('<QQB')
+FAMILIES = ('ipv4', 'ipv6')
+_ENTRIES = {'ipv4': IPV4_ENTRY, 'ipv6': IPV6_ENTRY}
+
+
+class RangeDB:
+    """Read-only view of a range file; see the module docstring for the layout."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} range file")
+
+        # location -> {family: (offset, count)}
+        self._index = {}
+        position = HEADER.size
+        for _ in range(count):
+            length = self._map[position]
+            name = self._map[position + 1:position + 1 + length].decode('utf-8')
+            position += 1 + length
+            sections = {}
+            for family in FAMILIES:
+                sections[family] = SECTION.unpack_from(self._map, position)
+                position += SECTION.size
+            self._index[name] = sections
+
+    def locations(self):
+        return list(self._index)
+
+    def __contains__(self, location):
+        return location in self._index
+
+    def count(self, location, family):
+        return self._index[location][family][1]
+
+    def fingerprint(self, location):
+        """
+        Digest of a location's prefixes, hashed straight from the raw bytes
+        without decoding them; equal digests mean equal lists.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for family in FAMILIES:
+            offset, count = self._index[location][family]
+            digest.update(SECTION.pack(0, count))
+            digest.update(self._map[offset:offset + count * _ENTRIES[family].size])
+        return digest.digest()
+
+    def networks(self, location, family):
+        """Yield (network as int, prefix length) pairs, sorted by network."""
+        offset, count = self._index[location][family]
+        entry = _ENTRIES[family]
+        if family == 'ipv4':
+            for network, prefixlen in entry.iter_unpack(self._map[offset:offset + count * entry.size]):
+                yield network, prefixlen
+        else:
+            for high, low, prefixlen in entry.iter_unpack(self._map[offset:offset + count * entry.size]):
+                yield (high << 64) | low, prefixlen
+
+    def ranges(self, location, family):
+        """A location's prefixes as CIDR strings."""
+        address_class = ipaddress.IPv4Address if family == 'ipv4' else ipaddress.IPv6Address
+        return [f"{address_class(network)}/{prefixlen}" for network, prefixlen in self.networks(location, family)]
+
+    def to_dict(self):
+        """The ranges in the shape of ranges.default_dns_ranges."""
+        return {location: {family: self.ranges(location, family) for family in FAMILIES}
+                for location in self._index}
+
+    def close(self):
+        self._map.close()
+
+
+def pack(dns_ranges):
+    """
+    Serialize a ranges dict into the binary format.
+
+    Each list is sorted; run range_utils.normalize_ranges() first to also
+    drop overlaps.
+    """
+    locations = []
+    for location, families in dns_ranges.items():
+        sections = {}
+        for family in FAMILIES:
+            version = 4 if family == 'ipv4' else 6
+            networks = sorted(
+                (int(network.network_address), network.prefixlen)
+                for network in (ipaddress.ip_network(cidr, strict=False) for cidr in families.get(family, []))
+                if network.version == version
+            )
+            sections[family] = networks
+        locations.append((location.encode('utf-8'), sections))
+
+    index_size = sum(1 + len(name) + SECTION.size * len(FAMILIES) for name, _ in locations)
+    offset = HEADER.size + index_size
+    index = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, len(locations)))
+    data = bytearray()
+    for name, sections in locations:
+        index.append(len(name))
+        index.extend(name)
+        for family in FAMILIES:
+            networks = sections[family]
+            index.extend(SECTION.pack(offset + len(data), len(networks)))
+            for network, prefixlen in networks:
+                if family == 'ipv4':
+                    data.extend(IPV4_ENTRY.pack(network, prefixlen))
+                else:
+                    data.extend(IPV6_ENTRY.pack(network >> 64, network & 0xFFFFFFFFFFFFFFFF, prefixlen))
+    return bytes(index + data)
+
+def write(path, dns_ranges):
+    """
+    Write a range file atomically: readers see the old file or the new one,
+    never a mix. Readers trust the file to be normalized, so pass ranges
+    through range_utils.normalize_ranges() first.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(pack(dns_ranges))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_source(source):
+    """Load ranges from a legacy pickle or from the default_dns_ranges literal of a .py file like ranges.py."""
+    if source.endswith('.py'):
+        # Load the given file, not whatever 'ranges' module is importable
+        spec = importlib.util.spec_from_file_location('_dns_ranges_source', source)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.default_dns_ranges
+    with open(source, 'rb') as f:
+        return pickle.load(f)
+
+def convert(source, target):
+    """
+    Convert a pickle or ranges.py into a range file, normalizing on the way.
+
+    Returns:
+        int: Number of prefixes written
+    """
+    from range_utils import normalize_ranges, log_report
+    dns_ranges, report = normalize_ranges(read_source(source))
+    log_report(report)
+    write(target, dns_ranges)
+    return sum(len(families.get(family, [])) for families in dns_ranges.values() for family in FAMILIES)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'convert':
+        from config import DNS_RANGES_FILE, DNS_RANGES_DB_FILE
+        source = sys.argv[2] if len(sys.argv) > 2 else DNS_RANGES_FILE
+        target = sys.argv[3] if len(sys.argv) > 3 else DNS_RANGES_DB_FILE
+        logging.basicConfig(level=logging.INFO)
+        print(f"Wrote {convert(source, target)} ranges to {target}")
+        sys.exit(0)
+    print("Usage: python range_db.py convert [dns_ranges.pkl|ranges.py] [target]")
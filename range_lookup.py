@@ -0,0 +1,143 @@
+import re
+import logging
+import ipaddress
+import threading
+from array import array
+import repository
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixTrie:
+    """
+    Binary trie over the prefixes of one IP version for longest-prefix match.
+
+    Nodes live in flat arrays (two child arrays and a value array), so a
+    lookup walks at most one node per prefix bit: O(prefix length).
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.bits = 32 if version == 4 else 128
+        self._zero = array('i', [0])
+        self._one = array('i', [0])
+        # Index into self.values, -1 for none
+        self._value = array('i', [-1])
+        self.values = []
+
+    def insert(self, network, value):
+        """Store value under an ipaddress network."""
+        self.insert_prefix(int(network.network_address), network.prefixlen, value)
+
+    def insert_prefix(self, address, prefixlen, value):
+        """Store value under the prefix of an integer address."""
+        node = 0
+        for shift in range(self.bits - 1, self.bits - 1 - prefixlen, -1):
+            children = self._one if (address >> shift) & 1 else self._zero
+            child = children[node]
+            if not child:
+                child = len(self._value)
+                self._zero.append(0)
+                self._one.append(0)
+                self._value.append(-1)
+                children[node] = child
+            node = child
+        self._value[node] = len(self.values)
+        self.values.append(value)
+
+    def lookup(self, address):
+        """Return the value of the longest prefix containing an integer address, or None."""
+        node = 0
+        best = self._value[0]
+        for shift in range(self.bits - 1, -1, -1):
+            node = (self._one if (address >> shift) & 1 else self._zero)[node]
+            if not node:
+                break
+            if self._value[node] >= 0:
+                best = self._value[node]
+        return self.values[best] if best >= 0 else None
+
+
+class RangeIndex:
+    """Which location and range every address of the DNS ranges belongs to."""
+
+    def __init__(self, dns_ranges=None):
+        self.tries = {4: PrefixTrie(4), 6: PrefixTrie(6)}
+        for location, families in (dns_ranges or {}).items():
+            for family in ('ipv4', 'ipv6'):
+                for cidr in families.get(family, []):
+                    try:
+                        network = ipaddress.ip_network(cidr, strict=False)
+                    except ValueError:
+                        continue
+                    self.tries[network.version].insert(network, (location, str(network)))
+
+    @classmethod
+    def from_db(cls, db):
+        """Build the index straight from a RangeDB's prefixes."""
+        index = cls()
+        for location in db.locations():
+            for family, version, address_class in (('ipv4', 4, ipaddress.IPv4Address),
+                                                   ('ipv6', 6, ipaddress.IPv6Address)):
+                trie = index.tries[version]
+                for network, prefixlen in db.networks(location, family):
+                    trie.insert_prefix(network, prefixlen, (location, f"{address_class(network)}/{prefixlen}"))
+        return index
+
+    def lookup(self, address):
+        """
+        Args:
+            address: An IPv4 or IPv6 address string
+
+        Returns:
+            tuple: (location, cidr), or None if no range contains it
+
+        Raises:
+            ValueError: If address is not an IP address
+        """
+        parsed = ipaddress.ip_address(address.strip())
+        return self.tries[parsed.version].lookup(int(parsed))
+
+    def lookup_many(self, addresses):
+        """
+        Look up a batch of addresses.
+
+        Returns:
+            list: (address, result) pairs in input order; result is
+                (location, cidr), None if no range contains it, or False if
+                the address is invalid
+        """
+        results = []
+        for address in addresses:
+            try:
+                results.append((address, self.lookup(address)))
+            except ValueError:
+                results.append((address, False))
+        return results
+
+
+# Index of the current DNS ranges, rebuilt when they change
+_index = None
+_index_key = None
+_lock = threading.Lock()
+
+def get_index():
+    global _index, _index_key
+    db = repository.dns_ranges_db()
+    key = repository.dns_ranges_key()
+    with _lock:
+        if _index is None or key != _index_key:
+            _index = RangeIndex.from_db(db)
+            _index_key = key
+        return _index
+
+def lookup(address):
+    """Return (location, cidr) of the range containing address, or None; see RangeIndex.lookup()."""
+    return get_index().lookup(address)
+
+def lookup_many(addresses):
+    return get_index().lookup_many(addresses)
+
+def parse_addresses(text):
+    """Split pasted text (one address per line, or separated by spaces or commas) into tokens."""
+    return [token for token in re.split(r'[\s,;]+', text) if token]
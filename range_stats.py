@@ -0,0 +1,82 @@
+import logging
+import threading
+import repository
+
+logger = logging.getLogger(__name__)
+
+# Summary as of the DNS ranges with this key
+_summary = {}
+_summary_key = None
+# location -> (fingerprint of its prefixes, their stats), to recompute only what changed
+_location_stats = {}
+_lock = threading.Lock()
+
+
+def compute_location_stats(ipv4_networks, ipv6_networks):
+    """
+    Count what a location's prefixes cover.
+
+    Args:
+        ipv4_networks, ipv6_networks: (network as int, prefix length) pairs
+            as RangeDB.networks() yields them. They are expected to be
+            normalized (see range_utils), so address counts can simply be
+            added up.
+
+    Returns:
+        dict: ipv4_ranges, estimated_ipv4_ips, ipv6_ranges and ipv6_slash64s
+    """
+    ipv4_ips = 0
+    for _, prefixlen in ipv4_networks:
+        ipv4_ips += 1 << (32 - prefixlen)
+
+    # Prefixes longer than /64 count once per /64 they fall into
+    slash64s = 0
+    partial = set()
+    for network, prefixlen in ipv6_networks:
+        if prefixlen <= 64:
+            slash64s += 1 << (64 - prefixlen)
+        else:
+            partial.add(network >> 64)
+
+    return {
+        'ipv4_ranges': len(ipv4_networks),
+        'estimated_ipv4_ips': ipv4_ips,
+        'ipv6_ranges': len(ipv6_networks),
+        'ipv6_slash64s': slash64s + len(partial)
+    }
+
+def get_dns_ranges_summary():
+    """
+    Return the stats of every location, keyed by location.
+
+    The summary is rebuilt only when the DNS ranges change, and then only
+    for the locations whose lists changed.
+    """
+    global _summary, _summary_key
+    db = repository.dns_ranges_db()
+    key = repository.dns_ranges_key()
+    with _lock:
+        if key == _summary_key:
+            return _summary
+
+        summary = {}
+        recomputed = 0
+        for location in db.locations():
+            # Only locations whose prefixes changed are decoded
+            fingerprint = db.fingerprint(location)
+            cached = _location_stats.get(location)
+            if cached is None or cached[0] != fingerprint:
+                lists = (tuple(db.networks(location, 'ipv4')), tuple(db.networks(location, 'ipv6')))
+                cached = _location_stats[location] = (fingerprint, compute_location_stats(*lists))
+                recomputed += 1
+            summary[location] = cached[1]
+        for location in set(_location_stats) - set(summary):
+            del _location_stats[location]
+
+        _summary, _summary_key = summary, key
+        logger.debug(f"Range stats refreshed ({recomputed} of {len(summary)} locations recomputed)")
+        return summary
+
+def get_location_stats(location):
+    """Stats of one location, or None if it has no ranges."""
+    return get_dns_ranges_summary().get(location)
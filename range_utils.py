@@ -0,0 +1,66 @@
+import logging
+import ipaddress
+
+logger = logging.getLogger(__name__)
+
+FAMILIES = (('ipv4', 4), ('ipv6', 6))
+
+
+def collapse_ranges(cidrs, version):
+    """
+    Merge a list of CIDR prefixes into the minimal set of non-overlapping ones.
+
+    Args:
+        cidrs: CIDR strings
+        version: 4 or 6; prefixes of the other family are dropped as invalid
+
+    Returns:
+        tuple: (collapsed CIDR strings, stats dict)
+    """
+    networks = []
+    invalid = 0
+    for cidr in cidrs:
+        try:
+            network = ipaddress.ip_network(cidr, strict=False)
+        except ValueError:
+            network = None
+        if network is None or network.version != version:
+            logger.warning(f"Dropping invalid IPv{version} range {cidr!r}")
+            invalid += 1
+            continue
+        networks.append(network)
+
+    collapsed = list(ipaddress.collapse_addresses(networks))
+    stats = {
+        'before': len(cidrs),
+        'after': len(collapsed),
+        'invalid': invalid,
+        # Addresses that were counted more than once across overlapping prefixes
+        'overlap_addresses': (sum(n.num_addresses for n in networks)
+                              - sum(n.num_addresses for n in collapsed))
+    }
+    return [str(network) for network in collapsed], stats
+
+def normalize_ranges(dns_ranges):
+    """
+    Collapse every location's IPv4 and IPv6 lists; other keys are kept as is.
+
+    Returns:
+        tuple: (normalized ranges dict, report dict keyed by location and family)
+    """
+    normalized = {}
+    report = {}
+    for location, families in dns_ranges.items():
+        normalized[location] = dict(families)
+        for family, version in FAMILIES:
+            if family not in families:
+                continue
+            normalized[location][family], stats = collapse_ranges(list(families[family]), version)
+            report[(location, family)] = stats
+    return normalized, report
+
+def log_report(report):
+    for (location, family), stats in report.items():
+        if stats['before'] != stats['after']:
+            logger.info(f"{location} {family}: {stats['before']} -> {stats['after']} ranges "
+                        f"({stats['invalid']} invalid, {stats['overlap_addresses']} overlapping addresses)")
@@ -0,0 +1,56 @@
+import time
+import threading
+from config import TELEGRAM_GLOBAL_RATE
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: rate tokens per second, bursts of up to
+    capacity. acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate, self._paused_until - now)
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """Take a token only if one is available right now."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1 and now >= self._paused_until:
+                self._tokens -= 1
+                return True
+            return False
+
+    def pause(self, seconds):
+        """Hold every caller back for seconds, e.g. after a 429 retry_after."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0.0)
+
+
+# Telegram allows about 30 messages per second per bot across all chats
+global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
@@ -0,0 +1,298 @@
+import os
+import random
+import string
+import logging
+import threading
+from contextlib import contextmanager
+from telebot.handler_backends import BaseMiddleware
+from storage import get_store, ROW_TABLES
+from snapshot import Draft, DELETED, freeze, thaw
+from config import default_data, DNS_RANGES_FILE, DNS_RANGES_DB_FILE
+import range_db
+
+logger = logging.getLogger(__name__)
+
+# Per-thread state of the update currently being handled
+_scope = threading.local()
+
+# Request-scoped cache
+def begin_request():
+    _scope.active = True
+    _scope.data = None
+    _scope.version = None
+
+def end_request():
+    _scope.active = False
+    _scope.data = None
+    _scope.version = None
+
+@contextmanager
+def request_scope():
+    """Serve every data read inside the block from a single load of the store."""
+    begin_request()
+    try:
+        yield
+    finally:
+        end_request()
+
+def scoped_data():
+    """Return the data already loaded for the current update, if nothing was written since."""
+    if getattr(_scope, 'active', False) and _scope.version == get_store().version:
+        return _scope.data
+    return None
+
+def remember_data(data, version=None):
+    """Keep data, taken at the given store version, as the working copy for the rest of the current update."""
+    if getattr(_scope, 'active', False):
+        _scope.data = data
+        _scope.version = version
+
+class RequestScopeMiddleware(BaseMiddleware):
+    """Open a request scope around every message and callback query handler."""
+
+    def __init__(self):
+        self.update_types = ['message', 'callback_query']
+
+    def pre_process(self, message, data):
+        begin_request()
+
+    def post_process(self, message, data, exception):
+        end_request()
+
+def _current():
+    return get_store().image()
+
+def snapshot():
+    """
+    Read-only view of all data; nothing is copied.
+
+    The view never changes: later writes publish new tables instead of
+    changing the ones it wraps, so it can be iterated while other threads
+    write. The store's image is reloaded first only if another process
+    changed the database, so repeated calls never re-read unchanged data.
+    """
+    store = get_store()
+    store.refresh()
+    return freeze(store.image())
+
+# Shared load/save entry points for every module
+def load_data(force_reload=False):
+    """
+    Return a read-only view of the bot data.
+
+    The view wraps the store's in-memory image as of this call, so nothing
+    is copied; call again to see later writes. Change data with transaction().
+    """
+    # Reuse the data already loaded while handling the current update
+    scoped = scoped_data()
+    if scoped is not None and not force_reload:
+        return scoped
+
+    # The store only re-reads the database when its version changed
+    version = None
+    try:
+        if force_reload:
+            get_store().load()
+            logger.info("Data loaded from store successfully")
+        # Read before the snapshot, so a write in between only costs a reload
+        version = get_store().refresh()
+        data = snapshot()
+    except Exception as e:
+        logger.error(f"Unexpected error loading data: {e}")
+        data = freeze(default_data)
+
+    remember_data(data, version)
+    return data
+
+# DNS ranges as last read, keyed on the range file's identity and modification time
+_dns_ranges_cache = None
+_dns_ranges_key = None
+_dns_ranges_db = None
+_dns_ranges_lock = threading.Lock()
+# Ranges shipped with the bot, used when there is no range file or pickle yet
+_BUNDLED_RANGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ranges.py')
+
+def _file_key(path):
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+# Open the DNS ranges
+def dns_ranges_db():
+    """
+    Return the mapped range file (see range_db.RangeDB), reopened when the
+    file changed. Pools, stats and lookups read their prefixes straight from
+    it through RangeDB.networks().
+
+    The first run converts the legacy pickle, or ranges.py if there is none,
+    into the binary range file.
+    """
+    global _dns_ranges_cache, _dns_ranges_key, _dns_ranges_db
+    with _dns_ranges_lock:
+        try:
+            key = _file_key(DNS_RANGES_DB_FILE)
+        except FileNotFoundError:
+            source = DNS_RANGES_FILE if os.path.exists(DNS_RANGES_FILE) else _BUNDLED_RANGES
+            logger.info(f"Creating {DNS_RANGES_DB_FILE} from {source}")
+            range_db.convert(source, DNS_RANGES_DB_FILE)
+            key = _file_key(DNS_RANGES_DB_FILE)
+        if key != _dns_ranges_key:
+            # The old map is left to the garbage collector, so readers still
+            # walking it are not cut off
+            _dns_ranges_db = range_db.RangeDB(DNS_RANGES_DB_FILE)
+            _dns_ranges_cache = None
+            _dns_ranges_key = key
+        return _dns_ranges_db
+
+# Load DNS ranges
+def load_dns_ranges():
+    """
+    Return a read-only view of the DNS ranges as CIDR lists, decoded from
+    the range file the first time they are asked for after it changed.
+
+    range_db.convert(), which writes the file, normalizes the ranges first,
+    so they are not normalized again here.
+    """
+    global _dns_ranges_cache
+    dns_ranges_db()
+    with _dns_ranges_lock:
+        if _dns_ranges_cache is None:
+            _dns_ranges_cache = _dns_ranges_db.to_dict()
+        return freeze(_dns_ranges_cache)
+
+def dns_ranges_key():
+    """Identity of the cached DNS ranges; changes whenever they do."""
+    return _dns_ranges_key
+
+# Row-level readers, all returning read-only views
+def get_user(user_id):
+    return freeze(_current()['users'].get(str(user_id)))
+
+def get_user_id_by_referral_code(referral_code):
+    """Resolve a REF... code to the owning user ID (as stored, a string), or None."""
+    return get_store().user_id_for_referral_code(referral_code)
+
+def get_location(location_id):
+    return freeze(_current().get('locations', {}).get(location_id))
+
+def get_locations():
+    return freeze(_current().get('locations', {}))
+
+def get_admins():
+    return freeze(_current().get('admins', []))
+
+def is_admin(user_id):
+    user_id_int = int(user_id)
+    return any(int(admin_id) == user_id_int for admin_id in _current().get('admins', []))
+
+def is_blocked(user_id):
+    return user_id in _current().get('blocked_users', [])
+
+def get_setting(key, default=None):
+    return freeze(_current().get('settings', {}).get(key, default))
+
+def get_tutorial(category_id):
+    return freeze(_current().get('tutorials', {}).get(category_id))
+
+def get_transaction(transaction_id):
+    return freeze(_current().get('transactions', {}).get(transaction_id))
+
+def get_user_transactions(user_id, limit=None, offset=0):
+    """
+    Return a user's transactions newest first, from the per-user index.
+
+    Returns:
+        list: (transaction_id, transaction) tuples
+    """
+    transactions = _current().get('transactions', {})
+    ids = get_store().user_transaction_ids(user_id, limit, offset)
+    return [(tx_id, freeze(transactions[tx_id])) for tx_id in ids if tx_id in transactions]
+
+def count_user_transactions(user_id):
+    return get_store().count_user_transactions(user_id)
+
+def get_payment_request(request_id):
+    return freeze(_current().get('payment_requests', {}).get(request_id))
+
+def get_uploaded_file(file_id):
+    return freeze(_current().get('uploaded_files', {}).get(file_id))
+
+# Row-level writers
+def generate_record_id(length=8):
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+def append_transaction(transaction, transaction_id=None):
+    """
+    Store a single transaction record.
+
+    Returns:
+        str: The transaction ID
+    """
+    if transaction_id is None:
+        transaction_id = generate_record_id()
+    _put('transactions', transaction_id, transaction)
+    return transaction_id
+
+def add_payment_request(request_id, payment_request):
+    _put('payment_requests', request_id, payment_request)
+    return request_id
+
+def add_ticket(ticket_id, ticket):
+    _put('tickets', ticket_id, ticket)
+    return ticket_id
+
+def add_uploaded_file(file_id, file_info):
+    _put('uploaded_files', file_id, file_info)
+    return file_id
+
+def put_user(user_id, user):
+    _put('users', str(user_id), user)
+
+def put_rows(rows):
+    """Write several (table, row_id, record) rows atomically."""
+    get_store().put_rows([(table, row_id, thaw(record)) for table, row_id, record in rows])
+
+def _put(table, row_id, record):
+    put_rows([(table, row_id, record)])
+
+# Write transactions
+@contextmanager
+def transaction():
+    """
+    Open a write transaction over all data.
+
+    The block gets a copy-on-write draft that reads like the data dict, and
+    holds the store's write lock until it exits, so nothing written by
+    another thread can slip in between its reads and its writes. Its
+    changes are written on exit as the rows that actually changed. Nothing
+    is written if the block raises. Keep network calls out of the block.
+
+    Usage:
+        with repository.transaction() as data:
+            data['users'][user_id]['invited_by'] = referrer_id
+    """
+    store = get_store()
+    with store.exclusive():
+        draft = Draft(store.image())
+        yield draft
+        store.update(lambda image: _changed_rows(draft, image))
+
+def _changed_rows(draft, image):
+    rows = []
+    for key in draft.changed_keys():
+        table = draft.child(key)
+        if key in ROW_TABLES and table is not None:
+            # Row by row, so only the records that changed are written
+            current = image.get(key, {})
+            for row_id in table.changed_keys():
+                record = table.resolve(row_id, current.get(row_id))
+                rows.append((key, row_id, None if record is DELETED else record))
+        elif key in ROW_TABLES:
+            # The whole table was replaced
+            records = draft.resolve(key, image.get(key))
+            records = {} if records is DELETED else records
+            rows.extend((key, row_id, record) for row_id, record in records.items())
+            rows.extend((key, row_id, None) for row_id in image.get(key, {}) if row_id not in records)
+        else:
+            value = draft.resolve(key, image.get(key))
+            rows.append(('meta', key, None if value is DELETED else value))
+    return rows
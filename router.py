@@ -0,0 +1,107 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackRouter:
+    """
+    Dispatch callback queries by their data.
+
+    Exact routes live in a dict; prefix routes (buy_dns_<location>,
+    approve_payment_<id>, ...) in a character trie where the longest
+    matching prefix wins. An exact match is tried first, so a lookup costs
+    one dict probe plus at most one trie step per character of the data.
+    Routes marked admin only run for users that pass is_admin; others get
+    on_denied instead.
+    """
+
+    def __init__(self, is_admin, on_denied=None):
+        self.is_admin = is_admin
+        self.on_denied = on_denied
+        self._exact = {}
+        # Trie nodes are dicts of character -> child; a route sits under the None key
+        self._prefixes = {}
+
+    def add(self, pattern, handler, prefix=False, admin=False):
+        """
+        Register handler(call) for callback data equal to pattern, or starting with it if prefix.
+
+        Raises:
+            ValueError: If the pattern already has a route
+        """
+        route = (handler, admin)
+        if not prefix:
+            if pattern in self._exact:
+                raise ValueError(f"Duplicate callback route: {pattern}")
+            self._exact[pattern] = route
+            return handler
+
+        node = self._prefixes
+        for char in pattern:
+            node = node.setdefault(char, {})
+        if None in node:
+            raise ValueError(f"Duplicate callback route: {pattern}*")
+        node[None] = route
+        return handler
+
+    def route(self, pattern, prefix=False, admin=False):
+        """Decorator form of add()."""
+        return lambda handler: self.add(pattern, handler, prefix, admin)
+
+    def resolve(self, data):
+        """
+        Returns:
+            tuple: (handler, admin) of the route for data, or None
+        """
+        route = self._exact.get(data)
+        if route is not None:
+            return route
+
+        node = self._prefixes
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            route = node.get(None, route)
+        return route
+
+    def dispatch(self, call):
+        """
+        Run the route for a callback query.
+
+        Returns:
+            bool: False if no route matches the query's data
+        """
+        route = self.resolve(call.data or '')
+        if route is None:
+            return False
+        handler, admin = route
+        if admin and not self.is_admin(call.from_user.id):
+            if self.on_denied:
+                self.on_denied(call)
+            return True
+        handler(call)
+        return True
+
+    def routes(self):
+        """All routes as (pattern, is_prefix, handler, admin), sorted by pattern."""
+        routes = [(pattern, False, handler, admin) for pattern, (handler, admin) in self._exact.items()]
+        stack = [('', self._prefixes)]
+        while stack:
+            pattern, node = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    routes.append((pattern, True, *child))
+                else:
+                    stack.append((pattern + char, child))
+        return sorted(routes, key=lambda route: route[0])
+
+    def dump(self):
+        """The route table as text, one route per line."""
+        lines = []
+        for pattern, prefix, handler, admin in self.routes():
+            name = handler.__name__
+            if name == '<lambda>':
+                name = f"<lambda> line {handler.__code__.co_firstlineno}"
+            lines.append(f"{pattern + '*' if prefix else pattern:<32} {'admin' if admin else '':<6} {name}")
+        return "\n".join(lines)
@@ -0,0 +1,186 @@
+from collections.abc import Mapping, Sequence, MutableMapping
+
+# Marks a key removed inside a Draft
+DELETED = object()
+
+
+class FrozenDict(Mapping):
+    """
+    Read-only view of a dict.
+
+    Nothing is copied: nested dicts and lists are wrapped on access, so
+    handing out a view of the whole data set costs O(1).
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return freeze(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __eq__(self, other):
+        return thaw(self) == thaw(other)
+
+    def __repr__(self):
+        return f"FrozenDict({self._data!r})"
+
+
+class FrozenList(Sequence):
+    """Read-only view of a list; see FrozenDict."""
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FrozenList(self._data[index])
+        return freeze(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, value):
+        return value in self._data
+
+    def __add__(self, other):
+        return list(self._data) + list(other)
+
+    def __eq__(self, other):
+        return thaw(self) == thaw(other)
+
+    def __repr__(self):
+        return f"FrozenList({self._data!r})"
+
+
+def freeze(value):
+    """Wrap dicts and lists in read-only views; other values pass through."""
+    if isinstance(value, dict):
+        return FrozenDict(value)
+    if isinstance(value, list):
+        return FrozenList(value)
+    return value
+
+def thaw(value):
+    """Return a plain, independent copy of a value that may contain views."""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (FrozenList, list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+class Draft(MutableMapping):
+    """
+    Copy-on-write overlay over a dict, used by write transactions.
+
+    Writes are recorded instead of applied, so the underlying data is never
+    touched and nobody else sees a half-done change. Reading back through the
+    draft returns the new values. Lists are copied the first time they are
+    read so they can be changed in place (e.g. with append).
+    """
+
+    def __init__(self, base):
+        self._base = base if base is not None else {}
+        self._changes = {}
+        self._children = {}
+        self._lists = {}
+
+    def __getitem__(self, key):
+        if key in self._changes:
+            value = self._changes[key]
+            if value is DELETED:
+                raise KeyError(key)
+            return value
+        if key in self._children:
+            return self._children[key]
+        if key in self._lists:
+            return self._lists[key][1]
+
+        value = self._base[key]
+        if isinstance(value, dict):
+            child = self._children[key] = Draft(value)
+            return child
+        if isinstance(value, list):
+            copied = thaw(value)
+            self._lists[key] = (value, copied)
+            return copied
+        return value
+
+    def __setitem__(self, key, value):
+        self._children.pop(key, None)
+        self._lists.pop(key, None)
+        # A view read elsewhere becomes a private, writable copy
+        if isinstance(value, (FrozenDict, FrozenList, Draft)):
+            value = thaw(value)
+        self._changes[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self[key] = DELETED
+
+    def __contains__(self, key):
+        if key in self._changes:
+            return self._changes[key] is not DELETED
+        return key in self._base
+
+    def __iter__(self):
+        for key in self._base:
+            if self._changes.get(key) is not DELETED:
+                yield key
+        for key, value in self._changes.items():
+            if key not in self._base and value is not DELETED:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def child(self, key):
+        """The nested draft under key, if it was read through this draft."""
+        return self._children.get(key)
+
+    def changed_keys(self):
+        """Keys with a pending change at this level or below."""
+        keys = set(self._changes)
+        keys.update(key for key, child in self._children.items() if child.is_dirty())
+        keys.update(key for key, (original, copied) in self._lists.items() if copied != original)
+        return keys
+
+    def is_dirty(self):
+        return bool(self.changed_keys())
+
+    def resolve(self, key, current):
+        """
+        Return the new value of key rebased onto current, the latest value
+        stored under it, or DELETED.
+        """
+        if key in self._changes:
+            value = self._changes[key]
+            return value if value is DELETED else thaw(value)
+        if key in self._lists:
+            return list(self._lists[key][1])
+        return self._children[key].apply_to(current)
+
+    def apply_to(self, current):
+        """Return a new dict holding current with this draft's changes applied."""
+        result = dict(current) if isinstance(current, dict) else {}
+        for key in self.changed_keys():
+            value = self.resolve(key, result.get(key))
+            if value is DELETED:
+                result.pop(key, None)
+            else:
+                result[key] = value
+        return result
@@ -0,0 +1,728 @@
+import os
+import sys
+import time
+import copy
+import json
+import pickle
+import bisect
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+from config import (DB_FILE, DATA_FILE, JOURNAL_FILE, JOURNAL_FSYNC_BATCH,
+                    STORAGE_DURABILITY, GROUP_COMMIT_INTERVAL_MS, default_data)
+from journal import Journal, JournalWorker
+
+logger = logging.getLogger(__name__)
+
+# Collections that get one SQLite row per record instead of one blob
+ROW_TABLES = ('users', 'transactions', 'payment_requests', 'tickets', 'uploaded_files')
+
+# Tables whose records carry a user_id field worth indexing
+USER_KEYED_TABLES = ('transactions', 'payment_requests', 'tickets')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, referral_code TEXT, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS transactions (id TEXT PRIMARY KEY, user_id TEXT, timestamp TEXT, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS payment_requests (id TEXT PRIMARY KEY, user_id TEXT, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS tickets (id TEXT PRIMARY KEY, user_id TEXT, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS uploaded_files (id TEXT PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS allocations (location TEXT NOT NULL, address TEXT NOT NULL, owner TEXT,
+                                        allocated_at TEXT, PRIMARY KEY (location, address));
+"""
+
+# Secondary indexes, created after the columns they need exist
+INDEXES = """
+CREATE INDEX IF NOT EXISTS users_referral_code ON users (referral_code);
+CREATE INDEX IF NOT EXISTS transactions_user_time ON transactions (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS allocations_owner ON allocations (owner);
+"""
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class Store:
+    """
+    SQLite (WAL mode) backend for the bot data.
+
+    load() returns the same nested dict the pickle file used to hold, and
+    save() diffs the dict against what was last written so only changed
+    rows hit the disk.
+
+    With a journal attached, put_rows() only appends to the journal and the
+    rows reach SQLite later through compact(), so a single write costs the
+    same no matter how much history the store holds.
+    """
+
+    def __init__(self, path=DB_FILE, durability=STORAGE_DURABILITY):
+        self.path = path
+        self.durability = durability
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        self._upgrade_schema()
+        self._conn.executescript(INDEXES)
+        # Serialized body of every row as last written, per table
+        self._written = {table: {} for table in ROW_TABLES}
+        self._written['meta'] = {}
+        # In-memory image of the data as last loaded or saved
+        self._image = None
+        # Whether the image was handed out since the last write; a shared
+        # image is copied before it is written to, never changed in place
+        self._shared = False
+        # Bumped on every change to the image; lets callers tell whether
+        # anything changed without looking at the data
+        self.version = 0
+        # SQLite's data_version when the image was loaded; it changes only
+        # when another connection commits
+        self._data_version = None
+        self.journal = None
+        # Journaled rows not yet folded into SQLite, keyed by (table, row_id)
+        self._pending = {}
+        # referral_code -> user ID, and the reverse to drop stale codes
+        self._referral_index = {}
+        self._referral_codes = {}
+        # user ID -> sorted [(timestamp, transaction ID)], and the reverse
+        self._user_transactions = {}
+        self._transaction_keys = {}
+        # Futures of flush() calls waiting on the next group commit
+        self._submit_lock = threading.Lock()
+        self._waiters = []
+        self.writer = None
+        # Per-thread depth of exclusive() blocks, and whether one wrote
+        self._exclusive = threading.local()
+
+    def attach_journal(self, journal):
+        """Replay whatever a previous run left in the journal, then route row writes to it."""
+        with self._lock:
+            replayed = journal.batches()
+            for rows in replayed:
+                self._write_rows([(table, row_id, record, _dumps(record)) for table, row_id, record in rows])
+            if replayed:
+                logger.info(f"Replayed {len(replayed)} journal records from {journal.path}")
+                self._image = None
+            journal.truncate()
+            self.journal = journal
+
+    def compact(self):
+        """
+        Fold the journal into SQLite and empty it.
+
+        Returns:
+            int: Number of rows folded
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+            rows = [(table, row_id, record, _dumps(record))
+                    for (table, row_id), record in self._pending.items()]
+            self._write_rows(rows)
+            self.journal.truncate()
+            self._pending = {}
+            logger.debug(f"Compacted {len(rows)} journaled rows")
+            return len(rows)
+
+    def _upgrade_schema(self):
+        """Add columns introduced after a database was created and backfill them."""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(users)")]
+        if 'referral_code' not in columns:
+            self._conn.execute("ALTER TABLE users ADD COLUMN referral_code TEXT")
+            self._conn.execute("UPDATE users SET referral_code = json_extract(body, '$.referral_code')")
+            logger.info("Added referral_code column to users")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(transactions)")]
+        if 'timestamp' not in columns:
+            self._conn.execute("ALTER TABLE transactions ADD COLUMN timestamp TEXT")
+            self._conn.execute("UPDATE transactions SET timestamp = json_extract(body, '$.timestamp')")
+            logger.info("Added timestamp column to transactions")
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta LIMIT 1").fetchone() is None
+
+    def load(self):
+        """Read the whole store into the legacy nested-dict layout."""
+        self.commit_group()
+        with self._lock:
+            self.compact()
+            data = {}
+            written_meta = {}
+            for key, body in self._conn.execute("SELECT key, body FROM meta"):
+                data[key] = json.loads(body)
+                written_meta[key] = body
+            self._written['meta'] = written_meta
+
+            for table in ROW_TABLES:
+                records = {}
+                written = {}
+                for row_id, body in self._conn.execute(f"SELECT id, body FROM {table}"):
+                    records[row_id] = json.loads(body)
+                    written[row_id] = body
+                data[table] = records
+                self._written[table] = written
+            self._data_version = self._read_data_version()
+            self.version += 1
+            self._referral_index = {}
+            self._referral_codes = {}
+            self._user_transactions = {}
+            self._transaction_keys = {}
+            for table in ('users', 'transactions'):
+                for row_id, record in data[table].items():
+                    self._index_row(table, row_id, record)
+            self._image = data
+            self._shared = True
+            return data
+
+    def image(self):
+        """
+        Return the in-memory image of the data without copying it.
+
+        Writes after this call publish new table dicts instead of changing
+        the returned ones, so the image never changes under its reader.
+        """
+        with self._lock:
+            image = self._own_image()
+            self._shared = True
+            return image
+
+    def _own_image(self):
+        # The image for internal use; does not mark it as handed out
+        if self._image is None:
+            self.load()
+        return self._image
+
+    def _read_data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh(self):
+        """
+        Reload the image if another process changed the database since it
+        was loaded; otherwise keep serving it as is.
+
+        Returns:
+            int: The current version
+        """
+        with self._lock:
+            if self._image is None or self._read_data_version() != self._data_version:
+                self.load()
+            return self.version
+
+    def save(self, data):
+        """
+        Persist data, touching only rows that changed since the last save.
+
+        Only records that are not the image's own objects are encoded and
+        compared, so saving an image with a few replaced records costs in
+        proportion to those records, not to the whole dataset.
+
+        Returns:
+            int: Number of rows inserted, updated or deleted
+        """
+        with self._lock:
+            # Journaled rows must reach SQLite before anything newer does
+            self.compact()
+            # Records of the image are replaced, never changed in place, so
+            # one that is still the image's object is known to be unchanged
+            # without encoding it
+            image = self._image or {}
+            pending = {}
+            changes = 0
+
+            for table in ROW_TABLES:
+                records = data.get(table) or {}
+                previous = image.get(table) or {}
+                written = self._written[table]
+                upserts = {}
+                for row_id, record in records.items():
+                    if record is previous.get(row_id) and row_id in written:
+                        continue
+                    body = _dumps(record)
+                    if written.get(row_id) != body:
+                        upserts[row_id] = (record, body)
+                deletes = list(written.keys() - records.keys())
+                pending[table] = (upserts, deletes)
+                changes += len(upserts) + len(deletes)
+
+            meta_upserts = {}
+            for key, value in data.items():
+                if key in ROW_TABLES or (value is image.get(key) and key in self._written['meta']):
+                    continue
+                body = _dumps(value)
+                if self._written['meta'].get(key) != body:
+                    meta_upserts[key] = body
+            meta_deletes = [key for key in self._written['meta'] if key not in data]
+            changes += len(meta_upserts) + len(meta_deletes)
+
+            if not changes:
+                if data is not self._image:
+                    self._image = data
+                    self._shared = True
+                    self.version += 1
+                return 0
+
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                for table, (upserts, deletes) in pending.items():
+                    for row_id, (record, body) in upserts.items():
+                        self._upsert(cur, table, row_id, record, body)
+                    for row_id in deletes:
+                        cur.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+                for key, body in meta_upserts.items():
+                    cur.execute("INSERT OR REPLACE INTO meta (key, body) VALUES (?, ?)", (key, body))
+                for key in meta_deletes:
+                    cur.execute("DELETE FROM meta WHERE key = ?", (key,))
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+            for table, (upserts, deletes) in pending.items():
+                written = self._written[table]
+                for row_id, (record, body) in upserts.items():
+                    written[row_id] = body
+                for row_id in deletes:
+                    del written[row_id]
+                for row_id, (record, body) in upserts.items():
+                    self._index_row(table, row_id, record)
+                for row_id in deletes:
+                    self._unindex_row(table, row_id)
+            self._written['meta'].update(meta_upserts)
+            for key in meta_deletes:
+                del self._written['meta'][key]
+            self._image = data
+            self._shared = True
+            self.version += 1
+
+            logger.debug(f"Saved {changes} changed rows")
+            return changes
+
+    # Group commit
+    def flush(self):
+        """
+        Make every row write so far durable.
+
+        Returns:
+            Future: Resolves to True once everything is on disk
+        """
+        if self.writer is None:
+            future = Future()
+            try:
+                self.commit_group()
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        future = Future()
+        with self._submit_lock:
+            self._waiters.append(future)
+        self.writer.wakeup()
+        return future
+
+    def commit_group(self):
+        """fsync the journal once for every flush() waiting on it."""
+        with self._submit_lock:
+            waiters, self._waiters = self._waiters, []
+        if not waiters:
+            return
+        try:
+            with self._lock:
+                if self.journal is not None:
+                    self.journal.sync()
+        except Exception as e:
+            logger.error(f"Group commit failed: {e}")
+            for future in waiters:
+                future.set_exception(e)
+            return
+        for future in waiters:
+            future.set_result(True)
+        logger.debug(f"Group commit of {len(waiters)} waiters")
+
+    def put_row(self, table, row_id, record):
+        """Insert or replace a single record without rewriting anything else."""
+        self.put_rows([(table, row_id, record)])
+
+    def put_rows(self, rows):
+        """
+        Insert, replace or delete several records atomically.
+
+        The rows go to the journal as a single record when one is attached,
+        otherwise straight into SQLite in one transaction. In 'sync' mode the
+        journal is fsync'ed before this returns; in 'grouped' mode this waits
+        for the group-commit writer, which fsyncs the appends of every thread
+        that arrived in the meantime at once; in 'async' mode it returns as
+        soon as the rows are appended.
+
+        Args:
+            rows: Iterable of (table, row_id, record) tuples. A record of None
+                deletes the row; table 'meta' addresses the top-level keys.
+        """
+        with self._lock:
+            written = self._apply_rows(rows)
+        if written:
+            self._wait_durable()
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Keep every other thread from writing until the block exits.
+
+        Reads and writes inside the block see no interleaved writes, so a
+        read-modify-write in it can't lose a concurrent update. Writes in
+        the block wait for durability once, when the outermost block exits.
+        """
+        state = self._exclusive
+        wrote = False
+        try:
+            with self._lock:
+                state.depth = getattr(state, 'depth', 0) + 1
+                try:
+                    yield self
+                finally:
+                    state.depth -= 1
+                    if state.depth == 0:
+                        wrote, state.wrote = getattr(state, 'wrote', False), False
+        finally:
+            # Rows written before an error are still made durable
+            if wrote:
+                self._wait_durable()
+
+    def _apply_rows(self, rows):
+        """put_rows() without the durability wait; returns whether anything was written."""
+        rows = list(rows)
+        if not rows:
+            return False
+        with self._lock:
+            image = self._own_image()
+            if self._shared:
+                # Copy-on-write: readers keep the image they were handed
+                image = dict(image)
+                copied = set()
+            if self.journal is not None:
+                self.journal.append(rows)
+                for table, row_id, record in rows:
+                    self._pending[(table, row_id)] = record
+            else:
+                self._write_rows([(table, row_id, record, _dumps(record)) for table, row_id, record in rows])
+            for table, row_id, record in rows:
+                if self._shared and table != 'meta' and table not in copied:
+                    image[table] = dict(image.get(table, {}))
+                    copied.add(table)
+                # Records are replaced, never changed in place, so views of
+                # the old record stay consistent
+                if table == 'meta':
+                    if record is None:
+                        image.pop(row_id, None)
+                    else:
+                        image[row_id] = record
+                elif record is None:
+                    image.get(table, {}).pop(row_id, None)
+                    self._unindex_row(table, row_id)
+                else:
+                    image.setdefault(table, {})[row_id] = record
+                    self._index_row(table, row_id, record)
+            self._image = image
+            self._shared = False
+            self.version += 1
+        return True
+
+    def _wait_durable(self):
+        # Must not hold the lock: the group-commit writer needs it to fsync
+        if getattr(self._exclusive, 'depth', 0):
+            # Inside exclusive(); it waits once the lock is released
+            self._exclusive.wrote = True
+            return
+        if self.journal is not None and self.durability == 'grouped':
+            self.flush().result()
+
+    def update(self, build_rows):
+        """
+        Compute rows from the current image and write them, with no other
+        write in between.
+
+        Args:
+            build_rows: Callable taking the image and returning rows for put_rows()
+        """
+        with self._lock:
+            written = self._apply_rows(build_rows(self._own_image()))
+        if written:
+            self._wait_durable()
+
+    def _write_rows(self, rows):
+        """Upsert (table, row_id, record, body) rows into SQLite in one transaction."""
+        cur = self._conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for table, row_id, record, body in rows:
+                if record is None:
+                    key_column = 'key' if table == 'meta' else 'id'
+                    cur.execute(f"DELETE FROM {table} WHERE {key_column} = ?", (row_id,))
+                else:
+                    self._upsert(cur, table, row_id, record, body)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        for table, row_id, record, body in rows:
+            if record is None:
+                self._written[table].pop(row_id, None)
+            else:
+                self._written[table][row_id] = body
+
+    # Secondary indexes over the in-memory image
+    def _index_row(self, table, row_id, record):
+        if table == 'users':
+            self._index_user(row_id, record)
+        elif table == 'transactions':
+            self._index_transaction(row_id, record)
+
+    def _unindex_row(self, table, row_id):
+        if table == 'users':
+            self._unindex_user(row_id)
+        elif table == 'transactions':
+            self._unindex_transaction(row_id)
+
+    def _index_user(self, user_id, user):
+        code = user.get('referral_code') if isinstance(user, dict) else None
+        old = self._referral_codes.get(user_id)
+        if old == code:
+            return
+        if old is not None and self._referral_index.get(old) == user_id:
+            del self._referral_index[old]
+        if code:
+            self._referral_index[code] = user_id
+            self._referral_codes[user_id] = code
+        else:
+            self._referral_codes.pop(user_id, None)
+
+    def _unindex_user(self, user_id):
+        code = self._referral_codes.pop(user_id, None)
+        if code is not None and self._referral_index.get(code) == user_id:
+            del self._referral_index[code]
+
+    def user_id_for_referral_code(self, code):
+        """Return the ID of the user owning a referral code, or None."""
+        self._own_image()
+        return self._referral_index.get(code)
+
+    def _index_transaction(self, transaction_id, transaction):
+        user_id = transaction.get('user_id') if isinstance(transaction, dict) else None
+        key = None if user_id is None else (str(user_id), transaction.get('timestamp') or '')
+        old = self._transaction_keys.get(transaction_id)
+        if old == key:
+            return
+        if old is not None:
+            self._unindex_transaction(transaction_id)
+        if key is not None:
+            user_key, timestamp = key
+            bisect.insort(self._user_transactions.setdefault(user_key, []), (timestamp, transaction_id))
+            self._transaction_keys[transaction_id] = key
+
+    def _unindex_transaction(self, transaction_id):
+        key = self._transaction_keys.pop(transaction_id, None)
+        if key is None:
+            return
+        user_key, timestamp = key
+        entries = self._user_transactions.get(user_key, [])
+        i = bisect.bisect_left(entries, (timestamp, transaction_id))
+        if i < len(entries) and entries[i] == (timestamp, transaction_id):
+            del entries[i]
+
+    def user_transaction_ids(self, user_id, limit=None, offset=0):
+        """
+        Return a user's transaction IDs, newest first.
+
+        Args:
+            user_id: Telegram user ID
+            limit: Maximum number of IDs to return (all if None)
+            offset: Number of newest transactions to skip
+        """
+        self._own_image()
+        with self._lock:
+            entries = self._user_transactions.get(str(user_id), [])
+            end = max(len(entries) - offset, 0)
+            start = 0 if limit is None else max(end - limit, 0)
+            return [transaction_id for _, transaction_id in reversed(entries[start:end])]
+
+    def count_user_transactions(self, user_id):
+        self._own_image()
+        return len(self._user_transactions.get(str(user_id), []))
+
+    def _upsert(self, cur, table, row_id, record, body):
+        if table == 'meta':
+            cur.execute("INSERT OR REPLACE INTO meta (key, body) VALUES (?, ?)", (row_id, body))
+        elif table == 'users':
+            code = record.get('referral_code') if isinstance(record, dict) else None
+            cur.execute(
+                "INSERT OR REPLACE INTO users (id, referral_code, body) VALUES (?, ?, ?)",
+                (row_id, code, body)
+            )
+        elif table == 'transactions':
+            user_id = record.get('user_id') if isinstance(record, dict) else None
+            timestamp = record.get('timestamp') if isinstance(record, dict) else None
+            cur.execute(
+                "INSERT OR REPLACE INTO transactions (id, user_id, timestamp, body) VALUES (?, ?, ?, ?)",
+                (row_id, None if user_id is None else str(user_id), timestamp, body)
+            )
+        elif table in USER_KEYED_TABLES:
+            user_id = record.get('user_id') if isinstance(record, dict) else None
+            cur.execute(
+                f"INSERT OR REPLACE INTO {table} (id, user_id, body) VALUES (?, ?, ?)",
+                (row_id, None if user_id is None else str(user_id), body)
+            )
+        else:
+            cur.execute(f"INSERT OR REPLACE INTO {table} (id, body) VALUES (?, ?)", (row_id, body))
+
+    # Address allocations live in their own table, outside the data image
+    def load_allocations(self):
+        """Return every (location, address) pair handed out so far."""
+        with self._lock:
+            return self._conn.execute("SELECT location, address FROM allocations").fetchall()
+
+    def allocation_owners(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT owner FROM allocations")]
+
+    def add_allocations(self, rows):
+        """Record (location, address, owner) allocations in one transaction."""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.executemany(
+                    "INSERT OR REPLACE INTO allocations (location, address, owner, allocated_at) "
+                    "VALUES (?, ?, ?, datetime('now'))",
+                    rows)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def remove_allocations(self, owner=None, location=None, address=None):
+        """
+        Delete allocations by owner, or a single one by location and address.
+
+        Returns:
+            list: The (location, address) pairs removed
+        """
+        with self._lock:
+            if owner is not None:
+                where, params = "owner = ?", (owner,)
+            else:
+                where, params = "location = ? AND address = ?", (location, address)
+            rows = self._conn.execute(f"SELECT location, address FROM allocations WHERE {where}", params).fetchall()
+            self._conn.execute(f"DELETE FROM allocations WHERE {where}", params)
+            return rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+        self.commit_group()
+        with self._lock:
+            if self.journal is not None:
+                self.compact()
+                self.journal.close()
+            self._conn.close()
+
+
+class GroupCommitWriter(threading.Thread):
+    """Single writer thread that turns bursts of writes into one commit and one journal fsync."""
+
+    def __init__(self, store, interval_ms=GROUP_COMMIT_INTERVAL_MS):
+        super().__init__(name='group-commit-writer', daemon=True)
+        self.store = store
+        self.interval = interval_ms / 1000
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def run(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            # Give other threads a moment to join this commit
+            time.sleep(self.interval)
+            self._wakeup.clear()
+            try:
+                self.store.commit_group()
+            except Exception as e:
+                logger.error(f"Group commit writer error: {e}")
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self.join(timeout=5)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide store, migrating the legacy pickle on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = Store(DB_FILE)
+                if store.is_empty():
+                    if not migrate_from_pickle(DATA_FILE, store):
+                        logger.info("Initializing new data store with default data")
+                        store.save(copy.deepcopy(default_data))
+                # In sync mode every journal append is fsync'ed on the spot
+                fsync_batch = 1 if store.durability == 'sync' else JOURNAL_FSYNC_BATCH
+                store.attach_journal(Journal(JOURNAL_FILE, fsync_batch=fsync_batch))
+                JournalWorker(store).start()
+                if store.durability != 'sync':
+                    store.writer = GroupCommitWriter(store)
+                    store.writer.start()
+                _store = store
+    return _store
+
+# One-shot migration from the old bot_data.pkl
+def migrate_from_pickle(pickle_path=DATA_FILE, store=None):
+    """
+    Copy the legacy pickle data file into the SQLite store.
+
+    The pickle file is left untouched so it can serve as a backup.
+
+    Returns:
+        bool: True if data was migrated, False if there was nothing to migrate
+    """
+    if not os.path.exists(pickle_path):
+        return False
+
+    try:
+        with open(pickle_path, 'rb') as f:
+            data = pickle.load(f)
+    except (EOFError, pickle.UnpicklingError) as e:
+        logger.error(f"Cannot migrate {pickle_path}: {e}")
+        return False
+
+    # Fill in keys that older data files may lack
+    for key, value in default_data.items():
+        data.setdefault(key, copy.deepcopy(value))
+
+    if store is None:
+        store = Store(DB_FILE)
+    rows = store.save(data)
+    logger.info(f"Migrated {pickle_path} into {store.path} ({rows} rows, {len(data['users'])} users)")
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        source = sys.argv[2] if len(sys.argv) > 2 else DATA_FILE
+        target = Store(DB_FILE)
+        if not target.is_empty():
+            print(f"{DB_FILE} already contains data, refusing to overwrite it")
+            sys.exit(1)
+        sys.exit(0 if migrate_from_pickle(source, target) else 1)
+    print("Usage: python storage.py migrate [pickle_file]")
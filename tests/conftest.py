@@ -0,0 +1,29 @@
+import os
+import sys
+import copy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+from config import default_data
+from journal import Journal
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A fresh store with default data and a journal, installed as the process-wide one."""
+    monkeypatch.chdir(tmp_path)
+    store = storage.Store(str(tmp_path / 'bot_data.db'), durability='sync')
+    store.save(copy.deepcopy(default_data))
+    store.attach_journal(Journal(str(tmp_path / 'bot_data.journal'), fsync_batch=1))
+    monkeypatch.setattr(storage, '_store', store)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def user(store):
+    """ID of a registered user with a balance of 100000."""
+    store.put_row('users', '1001', {'username': 'test', 'balance': 100000, 'dns_configs': [], 'wireguard_configs': []})
+    return 1001
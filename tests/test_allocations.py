@@ -0,0 +1,135 @@
+import random
+import pytest
+import allocations
+import range_db
+import repository
+from config import DNS_RANGES_DB_FILE
+
+
+@pytest.fixture
+def registry(store, monkeypatch):
+    # 6 usable IPv4 addresses and 3 IPv6 ones
+    range_db.write(DNS_RANGES_DB_FILE, {'test': {'ipv4': ['10.0.0.0/29'], 'ipv6': ['fd00::/126']}})
+    registry = allocations.AllocationRegistry(store)
+    monkeypatch.setattr(allocations, '_registry', registry)
+    return registry
+
+
+def test_addresses_are_unique_until_exhausted(registry):
+    owners = [allocations.new_owner() for _ in range(6)]
+    addresses = [registry.allocate('test', 4, owner) for owner in owners]
+
+    assert sorted(addresses) == [f"10.0.0.{n}" for n in range(1, 7)]
+    assert registry.allocate('test', 4, allocations.new_owner()) is None
+    assert registry.count('test', 4) == 6
+
+
+def test_release_owner_frees_all_its_addresses(registry):
+    owner = allocations.new_owner()
+    ipv4 = registry.allocate('test', 4, owner)
+    ipv6 = registry.allocate('test', 6, owner)
+    other = registry.allocate('test', 4, allocations.new_owner())
+
+    assert registry.release_owner(owner) == 2
+    assert not registry.is_allocated('test', ipv4)
+    assert not registry.is_allocated('test', ipv6)
+    assert registry.is_allocated('test', other)
+    assert registry.release_owner(owner) == 0
+
+
+def test_released_address_can_be_handed_out_again(registry):
+    owners = [allocations.new_owner() for _ in range(6)]
+    addresses = dict(zip(owners, (registry.allocate('test', 4, owner) for owner in owners)))
+    registry.release_owner(owners[2])
+
+    assert registry.allocate('test', 4, allocations.new_owner()) == addresses[owners[2]]
+
+
+def test_allocations_survive_a_restart(registry, store):
+    owner = allocations.new_owner()
+    address = registry.allocate('test', 4, owner)
+
+    reloaded = allocations.AllocationRegistry(store)
+    assert reloaded.is_allocated('test', address)
+    assert reloaded.count('test', 4) == 1
+
+
+def test_release_orphans_keeps_live_owners(registry):
+    live, orphan = allocations.new_owner(), allocations.new_owner()
+    registry.allocate('test', 4, live)
+    registry.allocate('test', 4, orphan)
+
+    assert registry.release_orphans({live}) == 1
+    assert registry.count('test', 4) == 1
+
+
+def test_release_expired(registry):
+    owner = allocations.new_owner()
+    address = registry.allocate('test', 4, owner)
+    repository.put_user(1, {'dns_configs': [
+        {'id': 'old', 'allocation_id': owner, 'expiry_date': '2020-01-01 00:00:00'},
+        {'id': 'new', 'allocation_id': allocations.new_owner(), 'expiry_date': '2999-01-01 00:00:00'}
+    ]})
+
+    assert allocations.release_expired() == 1
+    assert not registry.is_allocated('test', address)
+    configs = repository.get_user(1)['dns_configs']
+    assert configs[0]['expired'] and not configs[1].get('expired')
+    # Each expired config is released once
+    assert allocations.release_expired() == 0
+
+
+def test_config_owner_falls_back_to_the_config_id():
+    assert allocations.config_owner({'id': 'A1234', 'allocation_id': 'abc'}) == 'abc'
+    assert allocations.config_owner({'id': 'A1234'}) == 'A1234'
+
+
+@pytest.mark.parametrize('typecode, base', [('I', 0), (None, 0), (allocations.WIDE, 2 ** 64 - 500)])
+def test_sorted_blocks_matches_a_set(typecode, base, monkeypatch):
+    monkeypatch.setattr(allocations.SortedBlocks, 'BLOCK_SIZE', 8)
+    rng = random.Random(1)
+    initial = sorted(base + value for value in rng.sample(range(1000), 50))
+    blocks = allocations.SortedBlocks(typecode, initial)
+    expected = set(initial)
+    for _ in range(5000):
+        value = base + rng.randrange(1000)
+        if rng.random() < 0.6:
+            assert blocks.add(value) == (value not in expected)
+            expected.add(value)
+        else:
+            assert blocks.discard(value) == (value in expected)
+            expected.discard(value)
+
+    assert list(blocks) == sorted(expected)
+    assert len(blocks) == len(expected)
+    assert all((base + value in blocks) == (base + value in expected) for value in range(1000))
+    # Blocks are split instead of growing without bound
+    assert max(len(block) for block in blocks._blocks) <= 16
+
+
+def test_ipv6_addresses_are_kept_in_wide_arrays(registry):
+    registry.allocate('test', 6, allocations.new_owner())
+
+    assert all(isinstance(block, allocations.WideArray) for block in registry._taken[('test', 6)]._blocks)
+
+
+def test_batch_writes_allocations_once_at_the_end(registry, store):
+    owner = allocations.new_owner()
+    with registry.batch():
+        addresses = [registry.allocate('test', 4, owner) for _ in range(3)]
+        with registry.batch():
+            addresses.append(registry.allocate('test', 6, owner))
+        assert store.load_allocations() == []
+        assert registry.is_allocated('test', addresses[0])
+
+    assert sorted(address for _, address in store.load_allocations()) == sorted(addresses)
+
+
+def test_release_inside_a_batch_frees_its_addresses(registry, store):
+    owner = allocations.new_owner()
+    with registry.batch():
+        address = registry.allocate('test', 4, owner)
+        assert registry.release_owner(owner) == 1
+
+    assert not registry.is_allocated('test', address)
+    assert store.load_allocations() == []
@@ -0,0 +1,84 @@
+import copy
+import storage
+from config import default_data
+from journal import Journal
+
+
+def open_store(tmp_path):
+    store = storage.Store(str(tmp_path / 'bot_data.db'), durability='sync')
+    if store.is_empty():
+        store.save(copy.deepcopy(default_data))
+    store.attach_journal(Journal(str(tmp_path / 'bot_data.journal'), fsync_batch=1))
+    return store
+
+
+def crash(store):
+    """Drop a store without compacting, as if the process died."""
+    store.journal._file.close()
+    store._conn.close()
+
+
+def test_rows_go_to_the_journal_not_sqlite(tmp_path):
+    store = open_store(tmp_path)
+    store.put_row('tickets', 'T1', {'subject': 'hi'})
+
+    assert store._conn.execute("SELECT COUNT(*) FROM tickets").fetchone()[0] == 0
+    assert store.journal.batches() == [[('tickets', 'T1', {'subject': 'hi'})]]
+    assert store.image()['tickets']['T1'] == {'subject': 'hi'}
+    crash(store)
+
+
+def test_replay_after_crash(tmp_path):
+    store = open_store(tmp_path)
+    store.put_rows([('users', '1', {'balance': 10}), ('tickets', 'T1', {'subject': 'hi'})])
+    store.put_row('users', '1', {'balance': 20})
+    store.put_row('tickets', 'T1', None)
+    store.put_row('meta', 'settings', {'x': 1})
+    crash(store)
+
+    store = open_store(tmp_path)
+    data = store.load()
+    assert data['users']['1'] == {'balance': 20}
+    assert 'T1' not in data['tickets']
+    assert data['settings'] == {'x': 1}
+    # Replayed rows were folded into SQLite and the journal emptied
+    assert store.journal.size() == 0
+    assert store._conn.execute("SELECT body FROM users WHERE id = '1'").fetchone()[0] == '{"balance":20}'
+    store.close()
+
+
+def test_torn_last_record_is_ignored(tmp_path):
+    store = open_store(tmp_path)
+    store.put_row('users', '1', {'balance': 10})
+    crash(store)
+    with open(tmp_path / 'bot_data.journal', 'ab') as f:
+        f.write(b'[["users","1",{"balance":')
+
+    store = open_store(tmp_path)
+    assert store.load()['users']['1'] == {'balance': 10}
+    store.close()
+
+
+def test_replay_stops_at_a_corrupt_record(tmp_path):
+    store = open_store(tmp_path)
+    store.put_row('users', '1', {'balance': 10})
+    crash(store)
+    with open(tmp_path / 'bot_data.journal', 'ab') as f:
+        f.write(b'not json\n')
+        f.write(b'[["users","1",{"balance":99}]]\n')
+
+    store = open_store(tmp_path)
+    assert store.load()['users']['1'] == {'balance': 10}
+    store.close()
+
+
+def test_compact_folds_and_truncates(tmp_path):
+    store = open_store(tmp_path)
+    store.put_row('users', '1', {'balance': 10})
+    store.put_row('users', '1', {'balance': 30})
+
+    assert store.compact() == 1
+    assert store.journal.size() == 0
+    assert store._conn.execute("SELECT body FROM users WHERE id = '1'").fetchone()[0] == '{"balance":30}'
+    store.close()
+
@@ -0,0 +1,125 @@
+import threading
+import ledger
+import repository
+
+
+def test_debit_takes_balance_and_records_transaction(user):
+    result = ledger.debit(user, 30000, 'dns', transaction_id='TX1')
+
+    assert result == ledger.LedgerResult(True, 70000, False)
+    assert repository.get_user(user)['balance'] == 70000
+    transaction = repository.get_transaction('TX1')
+    assert transaction['amount'] == 30000
+    assert transaction['type'] == 'purchase'
+    assert transaction['status'] == 'completed'
+
+
+def test_same_transaction_id_is_applied_once(user):
+    first = ledger.debit(user, 30000, 'dns', transaction_id='TX1')
+    second = ledger.debit(user, 30000, 'dns', transaction_id='TX1')
+
+    assert not first.duplicate
+    assert second == ledger.LedgerResult(True, 70000, True)
+    assert repository.get_user(user)['balance'] == 70000
+
+
+def test_credit_approves_pending_transaction_once(user):
+    repository.append_transaction({'user_id': user, 'amount': 5000, 'status': 'pending'}, 'DEP1')
+
+    assert not ledger.credit(user, 5000, 'deposit', transaction_id='DEP1').duplicate
+    assert ledger.credit(user, 5000, 'deposit', transaction_id='DEP1').duplicate
+    assert repository.get_user(user)['balance'] == 105000
+
+
+def test_insufficient_balance_changes_nothing(user):
+    result = ledger.debit(user, 200000, 'vpn', transaction_id='TX1')
+
+    assert result == ledger.LedgerResult(False, 100000, False)
+    assert repository.get_user(user)['balance'] == 100000
+    assert repository.get_transaction('TX1') is None
+
+
+def test_unknown_user(store):
+    assert not ledger.debit(42, 1000, 'dns').ok
+
+
+def test_mutate_lands_with_the_debit(user):
+    config = {'id': 'D1234'}
+    ledger.debit(user, 30000, 'dns', mutate=lambda record: record.update(dns_configs=[config]))
+
+    assert repository.get_user(user)['dns_configs'][0]['id'] == 'D1234'
+
+
+def test_concurrent_debits_never_overdraw(user):
+    # 40 debits of 5000 against 100000: exactly 20 can succeed
+    results = []
+    barrier = threading.Barrier(40)
+
+    def buy(n):
+        barrier.wait()
+        results.append(ledger.debit(user, 5000, 'dns', transaction_id=f"TX{n}"))
+
+    threads = [threading.Thread(target=buy, args=(n,)) for n in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(result.ok for result in results) == 20
+    assert repository.get_user(user)['balance'] == 0
+
+
+def test_concurrent_retries_of_one_transaction_apply_once(user):
+    barrier = threading.Barrier(10)
+
+    def retry():
+        barrier.wait()
+        ledger.debit(user, 5000, 'dns', transaction_id='SAME')
+
+    threads = [threading.Thread(target=retry) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert repository.get_user(user)['balance'] == 95000
+
+
+def test_transaction_id_for_is_stable():
+    assert ledger.transaction_id_for('callback-1') == ledger.transaction_id_for('callback-1')
+    assert ledger.transaction_id_for('callback-1') != ledger.transaction_id_for('callback-2')
+    # 128 bits, so IDs of different updates don't collide
+    assert len(ledger.transaction_id_for('callback-1')) == 32
+
+
+def test_another_users_transaction_is_not_a_duplicate(user):
+    repository.put_user(2002, {'balance': 0})
+    repository.append_transaction({'user_id': 2002, 'amount': 5000, 'status': 'pending'}, 'DEP1')
+
+    result = ledger.credit(user, 5000, 'deposit', transaction_id='DEP1')
+    assert not result.ok and not result.duplicate
+    assert repository.get_user(user)['balance'] == 100000
+    assert repository.get_transaction('DEP1')['user_id'] == 2002
+    assert repository.get_transaction('DEP1')['status'] == 'pending'
+
+
+def test_ledger_and_transaction_writes_do_not_overwrite_each_other(user):
+    def buy():
+        for n in range(50):
+            ledger.debit(user, 1000, 'dns')
+
+    def touch():
+        for n in range(50):
+            with repository.transaction() as data:
+                record = data['users'][str(user)]
+                record['visits'] = record.get('visits', 0) + 1
+
+    threads = [threading.Thread(target=target) for target in (buy, touch, buy, touch)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    record = repository.get_user(user)
+    assert record['balance'] == 0
+    assert record['visits'] == 100
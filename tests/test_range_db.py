@@ -0,0 +1,8 @@
+import range_db
+
+
+def test_read_source_loads_the_given_py_file(tmp_path):
+    source = tmp_path / 'custom_ranges.py'
+    source.write_text("default_dns_ranges = {'x': {'ipv4': ['192.0.2.0/24'], 'ipv6': []}}\n")
+
+    assert range_db.read_source(str(source)) == {'x': {'ipv4': ['192.0.2.0/24'], 'ipv6': []}}
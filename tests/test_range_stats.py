@@ -0,0 +1,30 @@
+import range_db
+import range_stats
+from config import DNS_RANGES_DB_FILE
+
+
+def write_ranges(ranges):
+    range_db.write(DNS_RANGES_DB_FILE, ranges)
+
+
+def test_only_changed_locations_are_recomputed(store, monkeypatch):
+    write_ranges({'a': {'ipv4': ['10.0.0.0/24'], 'ipv6': ['fd00::/64']},
+                  'b': {'ipv4': ['10.1.0.0/24'], 'ipv6': []}})
+    monkeypatch.setattr(range_stats, '_location_stats', {})
+    monkeypatch.setattr(range_stats, '_summary_key', None)
+    computed = []
+    compute = range_stats.compute_location_stats
+    monkeypatch.setattr(range_stats, 'compute_location_stats',
+                        lambda ipv4, ipv6: (computed.append(ipv4), compute(ipv4, ipv6))[1])
+
+    assert range_stats.get_dns_ranges_summary()['a']['estimated_ipv4_ips'] == 256
+    assert len(computed) == 2
+
+    # Same size and position in the file, different prefix
+    computed.clear()
+    write_ranges({'a': {'ipv4': ['10.0.0.0/24'], 'ipv6': ['fd00::/64']},
+                  'b': {'ipv4': ['10.1.0.0/25'], 'ipv6': []}})
+    summary = range_stats.get_dns_ranges_summary()
+    assert len(computed) == 1
+    assert summary['b']['estimated_ipv4_ips'] == 128
+    assert summary['a']['ipv6_slash64s'] == 1
@@ -0,0 +1,88 @@
+import time
+import threading
+import repository
+
+
+def test_snapshot_does_not_change_under_writes(store):
+    for n in range(200):
+        repository.put_user(n, {'balance': n})
+    view = repository.snapshot()
+    repository.put_user(7, {'balance': 700})
+    repository.put_user(1000, {'balance': 0})
+
+    assert view['users']['7']['balance'] == 7
+    assert '1000' not in view['users']
+    assert repository.snapshot()['users']['7']['balance'] == 700
+
+
+def test_snapshot_can_be_iterated_while_writing(store):
+    for n in range(500):
+        repository.put_user(n, {'balance': n})
+    errors = []
+    done = threading.Event()
+
+    def read():
+        try:
+            while not done.is_set():
+                users = repository.snapshot()['users']
+                assert sum(1 for _ in users.items()) == len(users)
+        except Exception as e:
+            errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for n in range(500, 1500):
+        repository.put_user(n, {'balance': n})
+    done.set()
+    reader.join()
+
+    assert errors == []
+    assert len(repository.snapshot()['users']) == 1500
+
+
+def test_scoped_data_is_dropped_after_a_write(store):
+    with repository.request_scope():
+        repository.put_user(1, {'balance': 1})
+        assert repository.load_data() is repository.load_data()
+        repository.put_user(1, {'balance': 2})
+        assert repository.load_data()['users']['1']['balance'] == 2
+
+
+def test_transaction_increments_are_not_lost(store):
+    with repository.transaction() as data:
+        data['discount_codes'] = {'OFF': {'uses': 0}}
+        data['users']['1'] = {'balance': 0}
+
+    def increment():
+        for _ in range(25):
+            with repository.transaction() as data:
+                uses = data['discount_codes']['OFF']['uses']
+                # Give other threads every chance to interleave
+                time.sleep(0)
+                data['discount_codes']['OFF']['uses'] = uses + 1
+                data['users']['1']['balance'] += 10
+
+    threads = [threading.Thread(target=increment) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    data = repository.snapshot()
+    assert data['discount_codes']['OFF']['uses'] == 200
+    assert data['users']['1']['balance'] == 2000
+
+
+def test_writes_wait_for_an_open_transaction(store):
+    repository.put_user(1, {'balance': 0})
+    entered = threading.Event()
+    writer = threading.Thread(target=lambda: (entered.wait(), repository.put_user(1, {'balance': 5})))
+    writer.start()
+    with repository.transaction() as data:
+        entered.set()
+        writer.join(0.2)
+        assert writer.is_alive()
+        data['users']['1']['balance'] += 1
+    writer.join()
+
+    assert repository.get_user(1)['balance'] == 5
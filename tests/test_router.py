@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+import pytest
+from router import CallbackRouter
+
+ADMIN_ID = 1
+
+
+def make_call(data, user_id=2):
+    return SimpleNamespace(data=data, from_user=SimpleNamespace(id=user_id))
+
+
+@pytest.fixture
+def router():
+    handled = []
+    denied = []
+    router = CallbackRouter(is_admin=lambda user_id: user_id == ADMIN_ID, on_denied=denied.append)
+    for pattern, prefix, admin in [
+        ('menu', False, False),
+        ('buy_', True, False),
+        ('buy_dns_', True, False),
+        ('buy_dns_germany', False, False),
+        ('approve_payment_', True, True),
+    ]:
+        name = pattern + ('*' if prefix else '')
+        router.add(pattern, lambda call, name=name: handled.append((name, call.data)), prefix, admin)
+    router.handled = handled
+    router.denied = denied
+    return router
+
+
+def route_name(router, data):
+    route = router.resolve(data)
+    if route is None:
+        return None
+    router.handled.clear()
+    route[0](make_call(data))
+    return router.handled[0][0]
+
+
+def test_exact_match_beats_prefixes(router):
+    assert route_name(router, 'buy_dns_germany') == 'buy_dns_germany'
+    assert route_name(router, 'menu') == 'menu'
+
+
+def test_longest_prefix_wins(router):
+    assert route_name(router, 'buy_dns_uae') == 'buy_dns_*'
+    assert route_name(router, 'buy_vpn_uae') == 'buy_*'
+    assert route_name(router, 'buy_dns_') == 'buy_dns_*'
+    # A partial match of a longer prefix falls back to the shorter one
+    assert route_name(router, 'buy_dn') == 'buy_*'
+
+
+def test_no_match(router):
+    assert router.resolve('menu_extra') is None
+    assert router.resolve('bu') is None
+    assert router.resolve('') is None
+    assert not router.dispatch(make_call('unknown'))
+    assert not router.dispatch(make_call(None))
+
+
+def test_admin_routes_are_guarded(router):
+    call = make_call('approve_payment_42')
+    assert router.dispatch(call)
+    assert router.handled == [] and router.denied == [call]
+
+    assert router.dispatch(make_call('approve_payment_42', ADMIN_ID))
+    assert router.handled == [('approve_payment_*', 'approve_payment_42')]
+
+
+def test_duplicate_routes_are_rejected(router):
+    with pytest.raises(ValueError):
+        router.add('menu', print)
+    with pytest.raises(ValueError):
+        router.add('buy_', print, prefix=True)
+    # The same text may be both an exact and a prefix route
+    router.add('menu', print, prefix=True)
+
+
+def test_dump_lists_every_route(router):
+    lines = router.dump().splitlines()
+    assert [line.split()[0] for line in lines] == sorted(
+        ['menu', 'buy_*', 'buy_dns_*', 'buy_dns_germany', 'approve_payment_*'], key=lambda p: p.rstrip('*'))
+    assert 'admin' in next(line for line in lines if line.startswith('approve_payment_*'))
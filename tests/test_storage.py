@@ -0,0 +1,70 @@
+import copy
+import threading
+import storage
+from config import default_data
+from journal import Journal
+
+
+def grouped_store(tmp_path):
+    store = storage.Store(str(tmp_path / 'bot_data.db'), durability='grouped')
+    store.save(copy.deepcopy(default_data))
+    # Only the group-commit writer fsyncs
+    store.attach_journal(Journal(str(tmp_path / 'bot_data.journal'), fsync_batch=10 ** 6, fsync_interval=10 ** 6))
+    store.writer = storage.GroupCommitWriter(store)
+    store.writer.start()
+    return store
+
+
+def test_grouped_write_is_synced_before_returning(tmp_path):
+    store = grouped_store(tmp_path)
+    store.put_row('users', '1', {'balance': 10})
+    assert store.journal._unsynced == 0
+    store.update(lambda image: [('users', '1', {'balance': image['users']['1']['balance'] + 5})])
+    assert store.journal._unsynced == 0
+    assert store.image()['users']['1'] == {'balance': 15}
+    store.close()
+
+
+def test_grouped_writes_share_fsyncs(tmp_path, monkeypatch):
+    store = grouped_store(tmp_path)
+    syncs = []
+    sync = store.journal._sync_locked
+    monkeypatch.setattr(store.journal, '_sync_locked', lambda: (syncs.append(1), sync())[1])
+
+    def write(n):
+        for k in range(10):
+            store.put_row('tickets', f"{n}-{k}", {'n': k})
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(store.image()['tickets']) == 80
+    assert store.journal._unsynced == 0
+    assert len(syncs) < 80
+    store.close()
+
+
+def test_save_only_encodes_replaced_records(tmp_path, monkeypatch):
+    store = storage.Store(str(tmp_path / 'bot_data.db'))
+    data = copy.deepcopy(default_data)
+    data['users'] = {str(n): {'balance': n} for n in range(100)}
+    store.save(data)
+
+    encoded = []
+    dumps = storage._dumps
+    monkeypatch.setattr(storage, '_dumps', lambda value: (encoded.append(value), dumps(value))[1])
+    changed = dict(data, users=dict(data['users']))
+    changed['users']['7'] = {'balance': 700}
+    del changed['users']['8']
+
+    assert store.save(changed) == 2
+    assert encoded == [{'balance': 700}]
+
+    monkeypatch.setattr(storage, '_dumps', dumps)
+    reloaded = storage.Store(str(tmp_path / 'bot_data.db')).load()
+    assert reloaded['users']['7'] == {'balance': 700}
+    assert '8' not in reloaded['users']
+    store.close()
@@ -0,0 +1,51 @@
+import os
+import pytest
+import x25519
+
+# RFC 7748 section 5.2, with u-coordinates other than the base point
+RFC_SCALAR_VECTORS = [
+    ('a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4',
+     'e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c',
+     'c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552'),
+    ('4b66e9d4d1b4673c5ad22691957d6af5c11b6421e0ea01d42ca4169e7918ba0d',
+     'e5210f12786811d3f4b7959d0538ae2c31dbe7106fc03c3efc4cd549c715a493',
+     '95cbde9476e8907d7aade45cb4b873f88b595a68799fa152e6f8f7647aac7957'),
+]
+
+
+def test_ladder_matches_rfc_7748():
+    for scalar, u, expected in RFC_SCALAR_VECTORS:
+        result = x25519.x25519(bytes.fromhex(scalar), int.from_bytes(bytes.fromhex(u), 'little') & (2 ** 255 - 1))
+        assert result.hex() == expected
+
+
+def test_base_point_vectors():
+    for private, public in x25519._RFC_VECTORS:
+        assert x25519.x25519(bytes.fromhex(private)).hex() == public
+        assert x25519._public_keys_comb([bytes.fromhex(private)], x25519._get_table())[0].hex() == public
+
+
+def test_comb_matches_ladder_on_random_keys():
+    privates = [os.urandom(32) for _ in range(64)]
+    assert x25519._public_keys_comb(privates, x25519._get_table()) == [x25519.x25519(k) for k in privates]
+
+
+@pytest.mark.parametrize('private', [bytes(32), b'\xff' * 32, bytes([1] + [0] * 31)])
+def test_comb_matches_ladder_on_edge_scalars(private):
+    assert x25519._public_keys_comb([private], x25519._get_table()) == [x25519.x25519(private)]
+
+
+def test_generate_keypairs():
+    pairs = x25519.generate_keypairs(8)
+
+    assert len({private for private, _ in pairs}) == 8
+    for private, public in pairs:
+        # Stored clamped, as wg genkey does
+        assert private[0] & 7 == 0 and private[31] & 128 == 0 and private[31] & 64
+        assert public == x25519.x25519(private)
+
+
+def test_batch_of_one_and_empty_batch():
+    private = os.urandom(32)
+    assert x25519.public_keys([private]) == [x25519.public_key(private)]
+    assert x25519.public_keys([]) == []
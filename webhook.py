@@ -0,0 +1,277 @@
+"""
+Webhook ingestion: an embedded HTTP server that receives Telegram updates.
+
+Each POST is checked against the secret token, parsed and put on a bounded
+queue. A dispatcher hands queued updates to async_runtime.AsyncRuntime, so
+they run on WEBHOOK_CONSUMERS handler threads with the same ordering as the
+async runtime: updates from one chat one after another, in arrival order.
+When the queue is full the update is answered 503 so Telegram retries it
+later. GET /metrics returns queue depth and counters as JSON.
+
+    python webhook.py post [--count N] [--chats N] [--url URL] [--secret S]
+
+posts fake updates to a running server and prints the server's metrics.
+"""
+import ssl
+import sys
+import hmac
+import json
+import time
+import queue
+import asyncio
+import logging
+import argparse
+import threading
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot import types
+from async_runtime import AsyncRuntime
+from config import (
+    WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_SSL_CERT, WEBHOOK_SSL_KEY, WEBHOOK_QUEUE_SIZE, WEBHOOK_CONSUMERS
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Telegram updates are small; anything bigger is not one
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Telegram opens up to 40 connections at once by default
+    request_queue_size = 128
+
+
+class WebhookServer:
+    def __init__(self, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path='/', secret_token=WEBHOOK_SECRET_TOKEN,
+                 queue_size=WEBHOOK_QUEUE_SIZE, consumers=WEBHOOK_CONSUMERS, ssl_cert=WEBHOOK_SSL_CERT, ssl_key=WEBHOOK_SSL_KEY):
+        if not secret_token:
+            raise ValueError("A webhook secret token is required")
+        self.bot = bot
+        self.path = path or '/'
+        self.secret_token = secret_token
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.consumer_count = consumers
+        self.runtime = AsyncRuntime(bot, workers=consumers, process=self._process)
+        self.started_at = time.time()
+
+        self._lock = threading.Lock()
+        self._counters = {'received': 0, 'processed': 0, 'failed': 0, 'rejected_secret': 0, 'rejected_full': 0, 'invalid': 0}
+        self._queue_peak = 0
+        self._busy = 0
+
+        self.httpd = _HTTPServer((host, port), self._handler_class())
+        if ssl_cert and ssl_key:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(ssl_cert, ssl_key)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def metrics(self):
+        with self._lock:
+            depth = self.queue.qsize()
+            return dict(
+                self._counters,
+                queue_depth=depth,
+                queue_peak=self._queue_peak,
+                queue_capacity=self.queue.maxsize,
+                busy_consumers=self._busy,
+                consumers=self.consumer_count,
+                uptime=int(time.time() - self.started_at)
+            )
+
+    def check_secret(self, value):
+        return hmac.compare_digest((value or '').encode(), self.secret_token.encode())
+
+    def accept(self, body):
+        """
+        Queue one update from a request body.
+
+        Returns:
+            int: HTTP status to answer with
+        """
+        try:
+            update = types.Update.de_json(json.loads(body))
+        except Exception:
+            self._count('invalid')
+            return 400
+        try:
+            self.queue.put_nowait(update)
+        except queue.Full:
+            self._count('rejected_full')
+            return 503
+        with self._lock:
+            self._counters['received'] += 1
+            self._queue_peak = max(self._queue_peak, self.queue.qsize())
+        return 200
+
+    def _process(self, update):
+        with self._lock:
+            self._busy += 1
+        try:
+            self.bot.process_new_updates([update])
+            self._count('processed')
+        except Exception as e:
+            logger.error(f"Error handling update {update.update_id}: {e}")
+            self._count('failed')
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        self.runtime.start()
+        try:
+            while True:
+                update = await loop.run_in_executor(None, self.queue.get)
+                if update is None:
+                    break
+                await self.runtime.dispatch(update)
+            await self.runtime.drain()
+        finally:
+            self.runtime.executor.shutdown(wait=False)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._reply(404)
+                if not server.check_secret(self.headers.get(SECRET_HEADER)):
+                    server._count('rejected_secret')
+                    return self._reply(403)
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0 or length > MAX_BODY_BYTES:
+                    server._count('invalid')
+                    return self._reply(400)
+                self._reply(server.accept(self.rfile.read(length)))
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    return self._reply(404)
+                if not server.check_secret(self.headers.get(SECRET_HEADER)):
+                    return self._reply(403)
+                self._reply(200, json.dumps(server.metrics()).encode())
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+    def start(self):
+        """Start the dispatcher and serve in a background thread."""
+        threading.Thread(target=asyncio.run, args=(self._dispatch(),), name="webhook-dispatcher", daemon=True).start()
+        threading.Thread(target=self.httpd.serve_forever, name="webhook-server", daemon=True).start()
+        host, port = self.httpd.server_address[:2]
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.queue.put(None)
+
+
+def run(bot, url=WEBHOOK_URL, allowed_updates=None):
+    """Register the webhook with Telegram and serve updates until interrupted."""
+    if not url:
+        logger.error("❌ WEBHOOK_URL is not set in config.py")
+        sys.exit(1)
+    if not WEBHOOK_SECRET_TOKEN:
+        logger.error("❌ WEBHOOK_SECRET_TOKEN is not set in config.py")
+        sys.exit(1)
+
+    server = WebhookServer(bot, path=urlparse(url).path)
+    server.start()
+    certificate = open(WEBHOOK_SSL_CERT, 'rb') if WEBHOOK_SSL_CERT else None
+    try:
+        bot.remove_webhook()
+        bot.set_webhook(
+            url=url,
+            certificate=certificate,
+            secret_token=server.secret_token,
+            allowed_updates=allowed_updates,
+            drop_pending_updates=True
+        )
+    finally:
+        if certificate:
+            certificate.close()
+
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Webhook metrics: {server.metrics()}")
+    except KeyboardInterrupt:
+        logger.info("Bot stopped")
+        server.stop()
+
+
+# Local test harness
+def fake_update(update_id, chat_id, text='/start'):
+    user = {'id': chat_id, 'is_bot': False, 'first_name': f"Test {chat_id}"}
+    message = {'message_id': update_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+               'from': user, 'text': text}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+def post_fake_updates(url, secret_token, count, chats=10, text='/start'):
+    """
+    POST count fake updates from chats different chats, a few at a time.
+
+    Returns:
+        dict: HTTP status -> number of responses
+    """
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+    from concurrent.futures import ThreadPoolExecutor
+
+    def post(n):
+        body = json.dumps(fake_update(n, 100000 + n % chats, text)).encode()
+        request = Request(url, data=body, headers={'Content-Type': 'application/json', SECRET_HEADER: secret_token})
+        try:
+            with urlopen(request, timeout=10) as response:
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+    statuses = {}
+    with ThreadPoolExecutor(16) as executor:
+        for status in executor.map(post, range(1, count + 1)):
+            statuses[status] = statuses.get(status, 0) + 1
+    return statuses
+
+def fetch_metrics(url, secret_token):
+    from urllib.request import Request, urlopen
+    parsed = urlparse(url)
+    request = Request(f"{parsed.scheme}://{parsed.netloc}/metrics", headers={SECRET_HEADER: secret_token})
+    with urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post fake updates to a running webhook server")
+    parser.add_argument('command', choices=['post'])
+    parser.add_argument('--url', default=f"http://127.0.0.1:{WEBHOOK_PORT}{urlparse(WEBHOOK_URL).path or '/'}")
+    parser.add_argument('--secret', default=WEBHOOK_SECRET_TOKEN)
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--text', default='/start')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    statuses = post_fake_updates(args.url, args.secret, args.count, args.chats, args.text)
+    elapsed = time.monotonic() - started
+    print(f"Posted {args.count} updates in {elapsed:.2f}s: {statuses}")
+    print(json.dumps(fetch_metrics(args.url, args.secret), indent=2))
@@ -0,0 +1,219 @@
+"""
+X25519 (RFC 7748) key generation without external tools.
+
+Uses the cryptography package, listed in requirements.txt, when it is
+installed. Otherwise public keys are computed in pure Python: a fixed-base
+comb over the equivalent Edwards curve with a precomputed table, converted
+back to Montgomery u-coordinates with one shared inversion per batch. The general Montgomery ladder is kept
+as the reference the fast path is checked against.
+
+The pure-Python path is not constant-time; that is fine for generating keys
+in a process nobody else runs code in, but it is not meant for handling
+untrusted peers' keys.
+"""
+import os
+import threading
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except ImportError:
+    X25519PrivateKey = None
+
+P = 2 ** 255 - 19
+A24 = 121665
+# Edwards25519: -x^2 + y^2 = 1 + d x^2 y^2, birationally equivalent to Curve25519
+D = -121665 * pow(121666, -1, P) % P
+D2 = 2 * D % P
+BASE_U = 9
+
+# RFC 7748 section 6.1
+_RFC_VECTORS = (
+    ('77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a',
+     '8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a'),
+    ('5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb',
+     'de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f'),
+)
+
+
+def clamp(private_key):
+    """Turn 32 random bytes into an X25519 scalar."""
+    k = bytearray(private_key)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return int.from_bytes(k, 'little')
+
+def x25519(private_key, u=BASE_U):
+    """
+    The RFC 7748 Montgomery ladder: multiply the point with u-coordinate u
+    by the clamped private key.
+
+    Returns:
+        bytes: The resulting u-coordinate, 32 bytes little-endian
+    """
+    k = clamp(private_key)
+    x1 = u % P
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for t in reversed(range(255)):
+        bit = (k >> t) & 1
+        swap ^= bit
+        if swap:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = bit
+        a = x2 + z2
+        aa = a * a % P
+        b = x2 - z2
+        bb = b * b % P
+        e = aa - bb
+        c = x3 + z3
+        d = x3 - z3
+        da = d * a % P
+        cb = c * b % P
+        x3 = (da + cb) ** 2 % P
+        z3 = x1 * (da - cb) ** 2 % P
+        x2 = aa * bb % P
+        z2 = e * (aa + A24 * e) % P
+    if swap:
+        x2, z2 = x3, z3
+    return (x2 * pow(z2, P - 2, P) % P).to_bytes(32, 'little')
+
+
+# Fixed-base comb: 32 windows of 8 bits, each with the 255 nonzero multiples
+# of 256^i * B in affine "niels" form (y + x, y - x, 2d x y). About 1 MB,
+# built on first use; a key then costs at most 32 point additions.
+WINDOW_BITS = 8
+WINDOWS = -(-255 // WINDOW_BITS)
+_table = None
+_table_lock = threading.Lock()
+
+def _edwards_base():
+    y = 4 * pow(5, -1, P) % P
+    xx = (y * y - 1) * pow(D * y * y + 1, -1, P) % P
+    x = pow(xx, (P + 3) // 8, P)
+    if (x * x - xx) % P:
+        x = x * pow(2, (P - 1) // 4, P) % P
+    if x & 1:
+        x = P - x
+    return x, y
+
+def _add(point, niels):
+    """Extended coordinates + affine niels point (add-2008-hwcd-3 with Z2 = 1)."""
+    x1, y1, z1, t1 = point
+    yplusx, yminusx, xy2d = niels
+    a = (y1 - x1) * yminusx % P
+    b = (y1 + x1) * yplusx % P
+    c = t1 * xy2d % P
+    d = 2 * z1 % P
+    e, f, g, h = b - a, d - c, d + c, b + a
+    return e * f % P, g * h % P, f * g % P, e * h % P
+
+def _add_extended(p1, p2):
+    x1, y1, z1, t1 = p1
+    x2, y2, z2, t2 = p2
+    a = (y1 - x1) * (y2 - x2) % P
+    b = (y1 + x1) * (y2 + x2) % P
+    c = t1 * D2 * t2 % P
+    d = 2 * z1 * z2 % P
+    e, f, g, h = b - a, d - c, d + c, b + a
+    return e * f % P, g * h % P, f * g % P, e * h % P
+
+def _batch_invert(values):
+    """Invert every value with a single modular inversion (Montgomery's trick)."""
+    prefix = []
+    acc = 1
+    for value in values:
+        prefix.append(acc)
+        acc = acc * value % P
+    inv = pow(acc, -1, P)
+    result = [0] * len(values)
+    for i in reversed(range(len(values))):
+        result[i] = inv * prefix[i] % P
+        inv = inv * values[i] % P
+    return result
+
+def _build_table():
+    x, y = _edwards_base()
+    base = (x, y, 1, x * y % P)
+    extended = []
+    for _ in range(WINDOWS):
+        row = [base]
+        for _ in range(2 ** WINDOW_BITS - 2):
+            row.append(_add_extended(row[-1], base))
+        extended.append(row)
+        # The next window's base is the last multiple plus base
+        base = _add_extended(row[-1], base)
+    flat = [point for row in extended for point in row]
+    inverses = _batch_invert([point[2] for point in flat])
+    table = []
+    for i, row in enumerate(extended):
+        niels_row = []
+        for j, (px, py, _, _) in enumerate(row):
+            zinv = inverses[i * len(row) + j]
+            ax, ay = px * zinv % P, py * zinv % P
+            niels_row.append(((ay + ax) % P, (ay - ax) % P, D2 * ax * ay % P))
+        table.append(niels_row)
+    return table
+
+def _get_table():
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                table = _build_table()
+                _check(table)
+                _table = table
+    return _table
+
+def _public_keys_comb(private_keys, table):
+    mask = 2 ** WINDOW_BITS - 1
+    points = []
+    for private_key in private_keys:
+        k = clamp(private_key)
+        point = (0, 1, 1, 0)
+        window = 0
+        while k:
+            digit = k & mask
+            if digit:
+                point = _add(point, table[window][digit - 1])
+            k >>= WINDOW_BITS
+            window += 1
+        points.append(point)
+    # u = (Z + Y) / (Z - Y), with one inversion for the whole batch
+    inverses = _batch_invert([(z - y) % P for _, y, z, _ in points])
+    return [((z + y) * inv % P).to_bytes(32, 'little')
+            for (_, y, z, _), inv in zip(points, inverses)]
+
+def _check(table):
+    """Check the comb against the RFC 7748 test vectors and the ladder."""
+    privates = [bytes.fromhex(private) for private, _ in _RFC_VECTORS]
+    expected = [bytes.fromhex(public) for _, public in _RFC_VECTORS]
+    if _public_keys_comb(privates, table) != expected or [x25519(k) for k in privates] != expected:
+        raise RuntimeError("X25519 self-test failed")
+
+
+def public_keys(private_keys):
+    """Derive the public key of every 32-byte private key in one batch."""
+    if X25519PrivateKey is not None:
+        return [X25519PrivateKey.from_private_bytes(k).public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+                for k in private_keys]
+    return _public_keys_comb(private_keys, _get_table())
+
+def public_key(private_key):
+    return public_keys([private_key])[0]
+
+def generate_keypairs(count):
+    """
+    Generate count (private key, public key) pairs as raw 32-byte strings.
+
+    The private keys are stored clamped, as wg genkey does.
+    """
+    privates = []
+    for _ in range(count):
+        k = bytearray(os.urandom(32))
+        k[0] &= 248
+        k[31] &= 127
+        k[31] |= 64
+        privates.append(bytes(k))
+    return list(zip(privates, public_keys(privates)))